@@ -0,0 +1,103 @@
+"""
+Бенчмарк потокового чтения docx на синтетическом документе в несколько МБ.
+
+    python benchmarks/bench_docx.py --paragraphs 100000
+
+Строит docx с мейн-квестами, разделами дейликов и балластом, прогоняет
+iter_docx_paragraphs и оба экстрактора и проверяет пик памяти (tracemalloc):
+он не должен зависеть от размера документа. Код выхода 1 — граница нарушена.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from xml.sax.saxutils import escape
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("BOT_TOKEN", "123456:BENCH_TOKEN_BENCH_TOKEN_BENCH_TOKEN")
+
+import bot  # noqa: E402
+
+HEADER = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+)
+
+
+DAILY_SECTION = 40  # строк в каждом из разделов 6.1–6.4 в конце документа
+
+
+def paragraph(i: int, total: int) -> str:
+    tail = i - (total - 4 * DAILY_SECTION)
+    if tail >= 0 and tail % DAILY_SECTION == 0:
+        text = f"● 6.{tail // DAILY_SECTION + 1} Раздел дейликов"
+    elif tail >= 0:
+        text = f"Дейлик {i}"
+    elif i % 50 == 0:
+        text = f"{i // 1000 % 8}.{i} Квест номер {i} → Rare ×1 + 3 coin"
+    else:
+        text = f"Строка документа {i}: " + "описание шага " * 6
+    # Текст разбит на несколько run, как в настоящих docx.
+    half = len(text) // 2
+    return (
+        f"<w:p><w:pPr><w:pStyle w:val=\"Normal\"/></w:pPr>"
+        f"<w:r><w:rPr><w:b/></w:rPr><w:t>{escape(text[:half])}</w:t></w:r>"
+        f"<w:r><w:t xml:space=\"preserve\">{escape(text[half:])}</w:t></w:r></w:p>"
+    )
+
+
+def make_docx(path: str, paragraphs: int) -> int:
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        with zf.open("word/document.xml", "w") as xml:
+            xml.write(HEADER.encode())
+            for i in range(paragraphs):
+                xml.write(paragraph(i, paragraphs).encode())
+            xml.write(b"</w:body></w:document>")
+        return zf.getinfo("word/document.xml").file_size
+
+
+def measure(path: str):
+    tracemalloc.start()
+    started = time.perf_counter()
+    quests, dailies = bot.extract_docx(path, bot._MainQuestExtractor(), bot._DailyTaskExtractor())
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, len(quests), len(dailies)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--paragraphs", type=int, default=100_000)
+    parser.add_argument("--max-peak-mb", type=float, default=8.0)
+    args = parser.parse_args()
+
+    ok = True
+    peaks = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in (args.paragraphs // 10, args.paragraphs):
+            path = os.path.join(tmp, f"doc{count}.docx")
+            xml_size = make_docx(path, count)
+            elapsed, peak, quests, dailies = measure(path)
+            peaks.append(peak)
+            # Результат экстракторов растёт с документом — это не утечка парсера.
+            print(
+                f"{count} абзацев, document.xml {xml_size / 2**20:.1f} МБ, "
+                f"docx {os.path.getsize(path) / 2**20:.1f} МБ: {elapsed:.2f} с, "
+                f"пик {peak / 2**20:.1f} МБ, квестов {quests}, дейликов {dailies}"
+            )
+            if peak > args.max_peak_mb * 2**20:
+                print(f"ОШИБКА: пик памяти больше {args.max_peak_mb} МБ")
+                ok = False
+    if peaks[1] > 3 * peaks[0]:
+        print("ОШИБКА: пик памяти растёт вместе с документом")
+        ok = False
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""
+Бенчмарк фоновой очистки: миллионы брошенных выборов наград и сессий.
+
+    python benchmarks/bench_maintenance.py --rows 2000000
+
+Проверяет, что одна пачка очистки укладывается в --max-batch-ms и не дорожает
+к концу таблицы, а свежие строки остаются на месте. Код выхода 1 — граница нарушена.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("BOT_TOKEN", "123456:BENCH_TOKEN_BENCH_TOKEN_BENCH_TOKEN")
+
+import bot  # noqa: E402
+
+FRESH_ROWS = 1000
+
+
+def fill(rows: int):
+    stale = (datetime.utcnow() - timedelta(hours=bot.QUEST_CHOICE_TTL_HOURS + 1)).isoformat()
+    fresh = datetime.utcnow().isoformat()
+    options = json.dumps(["a", "b", "c"])
+    stale_ts = time.time() - bot.SESSION_TTL - 60
+    conn = bot.get_conn()
+    with conn:
+        conn.executemany(
+            "INSERT INTO quest_choices(token, user_id, box_level, options_json, created_at) "
+            "VALUES(?,?,?,?,?)",
+            ((f"s{i}", i, 1, options, stale) for i in range(rows)),
+        )
+        conn.executemany(
+            "INSERT INTO quest_choices(token, user_id, box_level, options_json, created_at) "
+            "VALUES(?,?,?,?,?)",
+            ((f"f{i}", i, 1, options, fresh) for i in range(FRESH_ROWS)),
+        )
+        conn.executemany(
+            "INSERT INTO session_state(user_id, field, value_json, updated_at) VALUES(?,?,?,?)",
+            ((i, "daily_search", "true", stale_ts) for i in range(rows)),
+        )
+    conn.close()
+
+
+def drain(name: str, job, batch: int) -> list:
+    latencies = []
+    while True:
+        started = time.perf_counter()
+        processed = job(batch)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if processed < batch:
+            break
+    removed = (len(latencies) - 1) * batch + processed
+    print(f"{name}: {removed} строк, {len(latencies)} пачек")
+    return latencies
+
+
+def p95(values: list) -> float:
+    ordered = sorted(values)
+    return ordered[int(len(ordered) * 0.95) - 1] if len(ordered) > 1 else ordered[0]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--batch", type=int, default=bot.MAINTENANCE_BATCH_SIZE)
+    parser.add_argument("--max-batch-ms", type=float, default=100.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot.DB_PATH = os.path.join(tmp, "bench.db")
+        bot.init_db()
+        started = time.perf_counter()
+        fill(args.rows)
+        print(f"Заполнено {args.rows} устаревших строк за {time.perf_counter() - started:.1f} с")
+
+        store = bot.SqliteSessionStore(bot.SESSION_TTL)
+        ok = True
+        for name, job in (
+            ("quest_choices", bot.purge_expired_quest_choices),
+            ("session_state", store.purge_expired),
+        ):
+            latencies = drain(name, job, args.batch)
+            tenth = max(1, len(latencies) // 10)
+            head, tail = p95(latencies[:tenth]), p95(latencies[-tenth:])
+            worst = max(latencies)
+            print(f"  пачка: p95 начало {head:.1f} мс, p95 конец {tail:.1f} мс, максимум {worst:.1f} мс")
+            if worst > args.max_batch_ms:
+                print(f"  ОШИБКА: пачка дольше {args.max_batch_ms} мс")
+                ok = False
+            if tail > 3 * head + 1:
+                print("  ОШИБКА: пачки дорожают к концу таблицы")
+                ok = False
+
+        conn = bot.get_conn()
+        left = conn.execute("SELECT COUNT(*) FROM quest_choices").fetchone()[0]
+        conn.close()
+        if left != FRESH_ROWS:
+            print(f"ОШИБКА: осталось {left} выборов вместо {FRESH_ROWS} свежих")
+            ok = False
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
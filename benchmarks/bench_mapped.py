@@ -0,0 +1,165 @@
+"""
+Бенчмарк памяти MappedShop/MappedDailyTasks против списков записей.
+
+    python benchmarks/bench_mapped.py --items 100000 --workers 4
+
+Собирает артефакт и JSON-бандл со --items наградами магазина и столько же
+дейликов, затем запускает --workers процессов на каждый режим:
+  mapped — read_content_artifact (таблицы поверх mmap);
+  lists  — JSON-бандл в список ShopItem, индекс по id и словарь DailyTask.
+Каждый процесс полностью проходит обе таблицы и делает поиски по ключу,
+после чего все процессы режима одновременно снимают /proc/self/smaps_rollup:
+Anonymous — частная память процесса, Pss — доля с учётом общих страниц.
+Код выхода 1 — mapped-процессу понадобилось больше --max-mapped-mb частной
+памяти или не меньше, чем процессу со списками.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("BOT_TOKEN", "123456:BENCH_TOKEN_BENCH_TOKEN_BENCH_TOKEN")
+
+import bot  # noqa: E402
+
+CATEGORIES = ("mtg", "games", "food", "books", "other")
+
+
+def make_content(items: int) -> dict:
+    shop = [
+        {
+            "id": f"item_{i:06d}",
+            "emoji": "🎁",
+            "name": f"Награда номер {i}",
+            "category": CATEGORIES[i % len(CATEGORIES)],
+            "price": 5 + i % 200,
+            "description": f"Описание награды {i}: " + "подробности " * 4,
+        }
+        for i in range(items)
+    ]
+    dailies = {
+        f"d{i:06d}": {
+            "title": f"Дейлик номер {i}",
+            "coins": 1 + i % 5,
+            "category": f"6.{1 + i % 4}",
+            "cost_key": "standard",
+        }
+        for i in range(items)
+    }
+    return {"shop_rewards": shop, "daily_tasks": dailies}
+
+
+def smaps() -> dict:
+    stats = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                stats[parts[0].rstrip(":")] = int(parts[1])
+    return stats
+
+
+def load(mode: str, path: str):
+    if mode == "mapped":
+        content = bot.read_content_artifact(path)
+        shop = content["shop_rewards"]
+        return shop, shop.by_id, content["daily_tasks"]
+    with open(path, "r", encoding="utf-8") as f:
+        content = json.load(f)
+    shop = [bot.ShopItem.from_dict(item) for item in content["shop_rewards"]]
+    dailies = {
+        code: bot.DailyTask.from_dict(dict(task, code=code)) for code, task in content["daily_tasks"].items()
+    }
+    return shop, {item.id: item for item in shop}, dailies
+
+
+def worker(mode: str, path: str, items: int):
+    before = smaps()
+    shop, by_id, dailies = load(mode, path)
+    # Полный проход и поиски: страницы таблиц действительно прочитаны.
+    total = sum(item.price for item in shop) + sum(task.coins for task in dailies.values())
+    step = max(1, items // 10000)
+    found = sum(1 for i in range(0, items, step) if by_id.get(f"item_{i:06d}") and f"d{i:06d}" in dailies)
+    print("ready", flush=True)
+    sys.stdin.readline()  # ждём, пока загрузятся все процессы режима
+    after = smaps()
+    print(json.dumps({
+        "anon_kb": after["Anonymous"] - before["Anonymous"],
+        "rss_kb": after["Rss"] - before["Rss"],
+        "pss_kb": after["Pss"] - before["Pss"],
+        "checksum": total + found,
+    }), flush=True)
+    sys.stdin.readline()
+
+
+def run_mode(mode: str, path: str, items: int, workers: int) -> list:
+    procs = [
+        subprocess.Popen(
+            [sys.executable, __file__, "--worker", mode, "--path", path, "--items", str(items)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+        )
+        for _ in range(workers)
+    ]
+    for proc in procs:
+        while proc.stdout.readline().strip() != "ready":
+            pass
+    results = []
+    for proc in procs:
+        proc.stdin.write("\n")
+        proc.stdin.flush()
+        results.append(json.loads(proc.stdout.readline()))
+    for proc in procs:
+        proc.stdin.close()
+        proc.wait()
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=100_000, help="наград магазина и дейликов")
+    parser.add_argument("--workers", type=int, default=4, help="процессов на режим")
+    parser.add_argument("--max-mapped-mb", type=float, default=4.0, help="частная память mapped-процесса")
+    parser.add_argument("--worker", choices=("mapped", "lists"), help=argparse.SUPPRESS)
+    parser.add_argument("--path", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(args.worker, args.path, args.items)
+        return 0
+
+    content = make_content(args.items)
+    with tempfile.TemporaryDirectory() as tmp:
+        artifact = os.path.join(tmp, "content.bin")
+        bundle = os.path.join(tmp, "bundle.json")
+        bot.write_content_artifact(content, artifact)
+        with open(bundle, "w", encoding="utf-8") as f:
+            json.dump(content, f, ensure_ascii=False)
+        print(
+            f"{args.items} наград и {args.items} дейликов: артефакт {os.path.getsize(artifact) / 2**20:.1f} МБ, "
+            f"бандл {os.path.getsize(bundle) / 2**20:.1f} МБ, процессов на режим: {args.workers}"
+        )
+        worst = {}
+        for mode, path in (("mapped", artifact), ("lists", bundle)):
+            results = run_mode(mode, path, args.items, args.workers)
+            if len({r["checksum"] for r in results}) != 1:
+                print(f"{mode}: процессы прочитали разное содержимое")
+                return 1
+            worst[mode] = max(r["anon_kb"] for r in results) / 1024
+            print(
+                f"{mode:>6}: частная память на процесс до {worst[mode]:.1f} МБ, "
+                f"RSS до {max(r['rss_kb'] for r in results) / 1024:.1f} МБ, "
+                f"PSS всего {sum(r['pss_kb'] for r in results) / 1024:.1f} МБ"
+            )
+
+    if worst["mapped"] > args.max_mapped_mb or worst["mapped"] >= worst["lists"]:
+        print(f"FAIL: mapped {worst['mapped']:.1f} МБ (граница {args.max_mapped_mb} МБ, списки {worst['lists']:.1f} МБ)")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
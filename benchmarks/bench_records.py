@@ -0,0 +1,106 @@
+"""
+Бенчмарк записей контента на __slots__ против прежних словарей.
+
+    python benchmarks/bench_records.py --copies 20
+
+Берёт встроенный контент (мейн-квесты, дейлики, магазин, таблицы лутбоксов),
+--copies раз размножает его и для каждой таблицы снимает удерживаемую память
+(tracemalloc) в двух формах: словари, как до перехода на записи, и _Record.
+Обе формы собираются из одного JSON-текста, так что строки у них одинаковые.
+Затем меряет фильтр дейликов по категории и цене — в записях поля читаются
+атрибутами, в словарях — через .get().
+Код выхода 1 — какая-то таблица в записях заняла больше --max-ratio от словарей
+или фильтр по записям оказался медленнее.
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("BOT_TOKEN", "123456:BENCH_TOKEN_BENCH_TOKEN_BENCH_TOKEN")
+
+import bot  # noqa: E402
+
+
+def tables(copies: int) -> dict:
+    """Таблица -> (класс записи, список словарей) с уникальными ключами в каждой копии."""
+    dailies = list(bot.build_daily_tasks_from_raw().values())
+    loot = [entry for entries in bot.DEFAULT_REWARD_TABLE.values() for entry in entries]
+    source = {
+        "quests": (bot.Quest, bot.MAIN_QUESTS, "code"),
+        "dailies": (bot.DailyTask, dailies, "code"),
+        "shop": (bot.ShopItem, bot.DEFAULT_SHOP_REWARDS, "id"),
+        "loot": (bot.LootEntry, loot, "name"),
+    }
+    result = {}
+    for name, (cls, records, key) in source.items():
+        rows = []
+        for copy in range(copies):
+            for record in records:
+                row = record.to_dict()
+                row[key] = f"{row[key]}#{copy}"
+                rows.append(row)
+        result[name] = (cls, rows)
+    return result
+
+
+def retained(build) -> int:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    obj = build()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del obj
+    return after - before
+
+
+def filter_us(rows, getter, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        sum(1 for row in rows if getter(row, "category") == "6.2" and getter(row, "cost_key") != "focus")
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--copies", type=int, default=20, help="сколько раз размножить встроенный контент")
+    parser.add_argument("--max-ratio", type=float, default=1.0, help="граница: память записей / память словарей")
+    parser.add_argument("--repeat", type=int, default=200, help="повторов фильтра дейликов")
+    args = parser.parse_args()
+
+    failed = False
+    data = tables(args.copies)
+    for name, (cls, rows) in data.items():
+        text = json.dumps(rows, ensure_ascii=False)
+        as_dicts = retained(lambda: json.loads(text))
+        as_records = retained(lambda: [cls.from_dict(row) for row in json.loads(text)])
+        ratio = as_records / as_dicts
+        failed |= ratio > args.max_ratio
+        print(
+            f"{name:>8}: {len(rows):>6} записей, словари {as_dicts / 1024:8.1f} КБ, "
+            f"записи {as_records / 1024:8.1f} КБ ({ratio:.2f})"
+        )
+
+    cls, rows = data["dailies"]
+    records = [cls.from_dict(row) for row in rows]
+    dict_time = filter_us(rows, lambda row, key: row.get(key), args.repeat)
+    record_time = filter_us(records, getattr, args.repeat)
+    print(f"фильтр {len(rows)} дейликов: словари {dict_time:.1f} мкс, записи {record_time:.1f} мкс")
+    failed |= record_time > dict_time
+
+    if failed:
+        print(f"FAIL: записи тяжелее словарей (граница {args.max_ratio}) или фильтр по ним медленнее")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""
+Бенчмарк разбора callback: CallbackRouter против цепочки фильтров startswith.
+
+    python benchmarks/bench_router.py --handlers 13 50 200 800
+
+Для каждого числа обработчиков строит два Dispatcher: в одном каждый
+обработчик зарегистрирован со своим F.data.startswith, в другом — один
+обработчик с фильтром роутера и столько же маршрутов. Нужный обработчик
+зарегистрирован последним, апдейт проходит через feed_update целиком.
+Отдельно меряется CallbackRouter.match.
+Код выхода 1 — роутер медленнее цепочки, дорожает с числом маршрутов больше
+чем в --max-growth раз или match дольше --max-match-us.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("BOT_TOKEN", "123456:BENCH_TOKEN_BENCH_TOKEN_BENCH_TOKEN")
+
+from aiogram import Dispatcher, F  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+
+import bot  # noqa: E402
+
+TARGET = "target:item:42"
+
+
+def callback_update(update_id: int, data: str) -> Update:
+    user = {"id": 1, "is_bot": False, "first_name": "u"}
+    return Update.model_validate(
+        {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": user,
+                "chat_instance": "bench",
+                "data": data,
+                "message": {
+                    "message_id": 1,
+                    "date": 0,
+                    "chat": {"id": 1, "type": "private"},
+                    "from": user,
+                    "text": "x",
+                },
+            },
+        },
+        context={"bot": bot.bot},
+    )
+
+
+async def handled(callback, **payload):
+    return payload
+
+
+async def parsed_by_hand(callback):
+    # Как обработчики до роутера: каждый сам режет callback.data.
+    return {"item_id": int(callback.data.split(":")[2])}
+
+
+def chain_dispatcher(handlers: int) -> Dispatcher:
+    dp = Dispatcher()
+    for i in range(handlers - 1):
+        dp.callback_query.register(parsed_by_hand, F.data.startswith(f"r{i}:"))
+    dp.callback_query.register(parsed_by_hand, F.data.startswith("target:item:"))
+    return dp
+
+
+def router_dispatcher(handlers: int):
+    router = bot.CallbackRouter()
+    for i in range(handlers - 1):
+        router.route(f"r{i}", ("x", int))(handled)
+    router.route("target:item", ("item_id", int))(handled)
+    dp = Dispatcher()
+    dp.callback_query.register(bot.dispatch_callback, router.filter)
+    return dp, router
+
+
+def feed_us(dp: Dispatcher, repeat: int) -> float:
+    updates = [callback_update(i, TARGET) for i in range(repeat)]
+
+    async def run():
+        started = time.perf_counter()
+        for update in updates:
+            if await dp.feed_update(bot.bot, update) != {"item_id": 42}:
+                raise RuntimeError("обработчик не вызван")
+        return time.perf_counter() - started
+
+    return asyncio.run(run()) / repeat * 1e6
+
+
+def match_us(router: bot.CallbackRouter, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        router.match(TARGET)
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--handlers", type=int, nargs="+", default=[13, 50, 200, 800], help="числа обработчиков")
+    parser.add_argument("--repeat", type=int, default=200, help="апдейтов на замер")
+    parser.add_argument("--max-growth", type=float, default=3.0, help="граница: роутер на max / на min обработчиков")
+    parser.add_argument("--max-match-us", type=float, default=20.0, help="граница на CallbackRouter.match")
+    args = parser.parse_args()
+
+    counts = sorted(args.handlers)
+    rows = []
+    print(f"{'обработчиков':>12} {'startswith':>12} {'роутер':>10} {'match':>8}")
+    for handlers in counts:
+        chain = feed_us(chain_dispatcher(handlers), args.repeat)
+        dp, router = router_dispatcher(handlers)
+        routed = feed_us(dp, args.repeat)
+        matched = match_us(router, args.repeat * 50)
+        rows.append((chain, routed, matched))
+        print(f"{handlers:>12} {chain:>9.0f} us {routed:>7.0f} us {matched:>5.1f} us")
+
+    failed = []
+    if rows[-1][1] >= rows[-1][0]:
+        failed.append(f"роутер не быстрее цепочки на {counts[-1]} обработчиках")
+    if rows[-1][1] > rows[0][1] * args.max_growth:
+        failed.append(f"роутер дорожает в {rows[-1][1] / rows[0][1]:.1f} раза (граница {args.max_growth})")
+    if max(row[2] for row in rows) > args.max_match_us:
+        failed.append(f"match дольше {args.max_match_us} us")
+    if failed:
+        print("FAIL: " + "; ".join(failed))
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,32 +1,48 @@
+import argparse
 import asyncio
+import bisect
+import difflib
+import hashlib
 import itertools
 import json
+import mmap
+import multiprocessing
 import os
 import random
 import sqlite3
+import struct
+import time
 import zipfile
-from datetime import datetime, date
+import zlib
+from datetime import datetime, date, timedelta
 from typing import Dict, List, Tuple, Optional
 from xml.etree import ElementTree as ET
 
 from dotenv import load_dotenv
 import re
 import uuid
-from collections import defaultdict
+from contextvars import ContextVar
+from collections import OrderedDict
+from queue import Full
 
 try:
-    from aiogram import Bot, Dispatcher, F
+    from aiogram import BaseMiddleware, Bot, Dispatcher, F
     from aiogram.filters import Command
     from aiogram.types import (
         Message,
         CallbackQuery,
         InlineKeyboardMarkup,
         InlineKeyboardButton,
+        InlineQuery,
+        InlineQueryResultArticle,
+        InputTextMessageContent,
         ReplyKeyboardMarkup,
         KeyboardButton,
     )
     from aiogram.client.default import DefaultBotProperties
+    from aiogram.dispatcher.flags import get_flag
     from aiogram.enums import ParseMode
+    from aiogram.exceptions import TelegramBadRequest
 except ImportError:
     # Friendly runtime error if aiogram is not installed.
     # Install with: pip install aiogram
@@ -37,7 +53,9 @@ except ImportError:
 
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN", "PASTE_YOUR_TOKEN_HERE")
-DB_PATH = "game_bot.db"
+DB_PATH = os.getenv("DB_PATH", "game_bot.db")
+# Сколько ждать снятия блокировки SQLite, когда в базу пишут несколько процессов
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "10"))
 
 # Если хочешь сделать бота приватным — впиши сюда свой Telegram ID
 # Узнать можно у @userinfobot
@@ -119,6 +137,7 @@ def patch_aiogram_rendering():
 
     orig_answer = Message.answer
     orig_edit = Message.edit_text
+    orig_edit_markup = Message.edit_reply_markup
 
     async def patched_answer(self, text, **kwargs):
         kwargs["reply_markup"] = clean_markup(kwargs.get("reply_markup"))
@@ -128,8 +147,13 @@ def patch_aiogram_rendering():
         kwargs["reply_markup"] = clean_markup(kwargs.get("reply_markup"))
         return await orig_edit(self, clean_text_symbols(text), **kwargs)
 
+    async def patched_edit_markup(self, **kwargs):
+        kwargs["reply_markup"] = clean_markup(kwargs.get("reply_markup"))
+        return await orig_edit_markup(self, **kwargs)
+
     Message.answer = patched_answer  # type: ignore
     Message.edit_text = patched_edit  # type: ignore
+    Message.edit_reply_markup = patched_edit_markup  # type: ignore
     Message._clean_patched = True  # type: ignore
 
     orig_send = AiogramBot.send_message
@@ -151,12 +175,56 @@ def patch_aiogram_rendering():
 # ================== БАЗА ДАННЫХ ==================
 
 def get_conn():
-    return sqlite3.connect(DB_PATH)
+    return sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT)
+
+
+# Прогресс ведётся отдельно по кампаниям. В этих таблицах campaign входит в ключ,
+# поэтому старую таблицу при миграции пересоздаём; в остальных хватает ADD COLUMN.
+CAMPAIGN_KEYED_TABLES = ("main_progress", "level_finals", "reward_stacks")
+CAMPAIGN_COLUMN_TABLES = ("rewards", "rewards_archive", "quest_choices")
+
+
+def _migrate_campaign_columns(c) -> List[str]:
+    """
+    Добавляет колонку campaign в таблицы прогресса старой базы. Строки, записанные
+    до миграции, относятся к кампании по умолчанию. Возвращает таблицы, отложенные
+    как <table>_old: их строки переносятся после создания новых (_finish_campaign_migration).
+    """
+    renamed = []
+    for table in CAMPAIGN_KEYED_TABLES + CAMPAIGN_COLUMN_TABLES:
+        columns = [row[1] for row in c.execute(f"PRAGMA table_info({table})")]
+        if not columns or "campaign" in columns:
+            continue
+        if table in CAMPAIGN_KEYED_TABLES:
+            c.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+            renamed.append(table)
+        else:
+            c.execute(
+                f"ALTER TABLE {table} ADD COLUMN campaign TEXT NOT NULL DEFAULT '{DEFAULT_CAMPAIGN}'"
+            )
+    return renamed
+
+
+def _finish_campaign_migration(c, renamed: List[str]):
+    for table in renamed:
+        # Стопки уже пересобраны из rewards вместе с кампанией — старые не нужны.
+        if table != "reward_stacks":
+            columns = ", ".join(row[1] for row in c.execute(f"PRAGMA table_info({table}_old)"))
+            c.execute(
+                f"INSERT OR IGNORE INTO {table}({columns}) SELECT {columns} FROM {table}_old"
+            )
+        c.execute(f"DROP TABLE {table}_old")
 
 
 def init_db():
     conn = get_conn()
     c = conn.cursor()
+    # Инкрементальный VACUUM: прагма действует только для новой базы,
+    # существующую переводит _enable_incremental_vacuum в конце init_db.
+    c.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    # WAL: читатели не ждут писателя, несколько воркеров могут делить один файл.
+    c.execute("PRAGMA journal_mode=WAL")
+    renamed = _migrate_campaign_columns(c)
 
     c.execute(
         """
@@ -169,25 +237,27 @@ def init_db():
     )
 
     c.execute(
-        """
+        f"""
     CREATE TABLE IF NOT EXISTS rewards(
         id        INTEGER PRIMARY KEY AUTOINCREMENT,
         user_id   INTEGER,
         name      TEXT,
         box_level INTEGER,
         used      INTEGER DEFAULT 0,
-        created_at TEXT
+        created_at TEXT,
+        campaign  TEXT NOT NULL DEFAULT '{DEFAULT_CAMPAIGN}'
     )
     """
     )
 
     c.execute(
-        """
+        f"""
     CREATE TABLE IF NOT EXISTS main_progress(
         user_id    INTEGER,
+        campaign   TEXT NOT NULL DEFAULT '{DEFAULT_CAMPAIGN}',
         node_index INTEGER,
         status     TEXT,
-        PRIMARY KEY(user_id, node_index)
+        PRIMARY KEY(user_id, campaign, node_index)
     )
     """
     )
@@ -206,20 +276,470 @@ def init_db():
 
     c.execute(
         """
+    CREATE TABLE IF NOT EXISTS processed_callbacks(
+        key        TEXT PRIMARY KEY,
+        expires_at REAL
+    )
+    """
+    )
+
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS user_campaigns(
+        user_id  INTEGER PRIMARY KEY,
+        campaign TEXT
+    )
+    """
+    )
+
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS session_state(
+        user_id    INTEGER,
+        field      TEXT,
+        value_json TEXT,
+        updated_at REAL,
+        PRIMARY KEY(user_id, field)
+    )
+    """
+    )
+
+    c.execute(
+        f"""
     CREATE TABLE IF NOT EXISTS quest_choices(
         token      TEXT PRIMARY KEY,
         user_id    INTEGER,
         box_level  INTEGER,
         options_json TEXT,
+        created_at TEXT,
+        campaign   TEXT NOT NULL DEFAULT '{DEFAULT_CAMPAIGN}'
+    )
+    """
+    )
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_quest_choices_created ON quest_choices(created_at)"
+    )
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_session_state_updated ON session_state(updated_at)"
+    )
+
+    # Стопки одинаковых неиспользованных наград: инвентарь читает только их.
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'reward_stacks'")
+    stacks_exist = c.fetchone() is not None
+    c.execute(
+        f"""
+    CREATE TABLE IF NOT EXISTS reward_stacks(
+        user_id   INTEGER,
+        campaign  TEXT NOT NULL DEFAULT '{DEFAULT_CAMPAIGN}',
+        name      TEXT,
+        box_level INTEGER,
+        count     INTEGER,
+        last_id   INTEGER,
+        PRIMARY KEY(user_id, campaign, name, box_level)
+    )
+    """
+    )
+    c.execute("DROP INDEX IF EXISTS idx_reward_stacks_page")
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_reward_stacks_campaign_page "
+        "ON reward_stacks(user_id, campaign, last_id)"
+    )
+    c.execute("DROP INDEX IF EXISTS idx_rewards_active")
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_rewards_campaign_active "
+        "ON rewards(user_id, campaign, used, name, box_level, id)"
+    )
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_rewards_used ON rewards(id) WHERE used = 1"
+    )
+    c.execute("CREATE INDEX IF NOT EXISTS idx_daily_tasks_day ON daily_tasks(day)")
+    c.execute(
+        f"""
+    CREATE TABLE IF NOT EXISTS rewards_archive(
+        id          INTEGER PRIMARY KEY,
+        user_id     INTEGER,
+        name        TEXT,
+        box_level   INTEGER,
+        created_at  TEXT,
+        archived_at TEXT,
+        campaign    TEXT NOT NULL DEFAULT '{DEFAULT_CAMPAIGN}'
+    )
+    """
+    )
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS daily_summary(
+        user_id     INTEGER,
+        day         TEXT,
+        done_count  INTEGER,
+        total_count INTEGER,
+        PRIMARY KEY(user_id, day)
+    )
+    """
+    )
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS maintenance_state(
+        job       TEXT PRIMARY KEY,
+        last_run  REAL,
+        processed INTEGER
+    )
+    """
+    )
+
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'coin_ledger'")
+    ledger_exists = c.fetchone() is not None
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS coin_ledger(
+        id         INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id    INTEGER,
+        delta      INTEGER,
+        reason     TEXT,
+        ref        TEXT,
         created_at TEXT
     )
     """
     )
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_coin_ledger_user ON coin_ledger(user_id, delta)"
+    )
+    if not ledger_exists:
+        # Балансы, накопленные до журнала, входят в него одной открывающей записью.
+        c.execute(
+            """
+            INSERT INTO coin_ledger(user_id, delta, reason, ref, created_at)
+            SELECT user_id, coins, 'opening', NULL, ? FROM users WHERE coins != 0
+            """,
+            (datetime.utcnow().isoformat(),),
+        )
+
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'level_finals'")
+    finals_exist = c.fetchone() is not None or "level_finals" in renamed
+    c.execute(
+        f"""
+    CREATE TABLE IF NOT EXISTS level_finals(
+        user_id    INTEGER,
+        campaign   TEXT NOT NULL DEFAULT '{DEFAULT_CAMPAIGN}',
+        level      INTEGER,
+        granted_at TEXT,
+        PRIMARY KEY(user_id, campaign, level)
+    )
+    """
+    )
+    if not finals_exist:
+        # Раньше выдачу финала узнавали по карте «ФИНАЛ N: …» в наградах.
+        for table in ("rewards", "rewards_archive"):
+            c.execute(
+                f"""
+                INSERT OR IGNORE INTO level_finals(user_id, campaign, level, granted_at)
+                SELECT user_id, campaign, CAST(substr(name, 7, instr(name, ':') - 7) AS INTEGER),
+                       created_at
+                FROM {table} WHERE name LIKE 'ФИНАЛ %:%'
+                """
+            )
+
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS user_tokens(
+        user_id INTEGER,
+        token   TEXT,
+        count   INTEGER,
+        PRIMARY KEY(user_id, token)
+    )
+    """
+    )
+    c.execute(
+        """
+    CREATE TABLE IF NOT EXISTS battle_pass(
+        user_id  INTEGER PRIMARY KEY,
+        rp       INTEGER DEFAULT 0,
+        bp_level INTEGER DEFAULT 0
+    )
+    """
+    )
+
+    if not stacks_exist:
+        c.execute(
+            """
+            INSERT INTO reward_stacks(user_id, campaign, name, box_level, count, last_id)
+            SELECT user_id, campaign, name, box_level, COUNT(*), MAX(id)
+            FROM rewards WHERE used = 0
+            GROUP BY user_id, campaign, name, box_level
+            """
+        )
+    _finish_campaign_migration(c, renamed)
 
     conn.commit()
+    _enable_incremental_vacuum(conn)
     conn.close()
 
 
+def _enable_incremental_vacuum(conn):
+    """
+    Переводит существующую базу на auto_vacuum=INCREMENTAL разовым VACUUM
+    (он переписывает файл целиком, поэтому идёт один раз, при старте).
+    Перевод записывается в maintenance_state и не повторяется.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return
+    if conn.execute("SELECT 1 FROM maintenance_state WHERE job = 'auto_vacuum'").fetchone():
+        return
+    print("Перевожу БД на инкрементальный VACUUM (разовый полный VACUUM)…")
+    started = time.perf_counter()
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+    mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    conn.execute(
+        "INSERT OR REPLACE INTO maintenance_state(job, last_run, processed) VALUES('auto_vacuum', ?, ?)",
+        (time.time(), mode),
+    )
+    conn.commit()
+    print(f"VACUUM завершён за {time.perf_counter() - started:.1f} с, auto_vacuum = {mode}")
+
+
+# ---------- Кэш профилей ----------
+
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "300"))
+
+
+class _CachedProfile:
+    __slots__ = ("coins", "statuses", "daily_day", "daily_done", "campaign", "expires_at")
+
+    def __init__(self, expires_at: float):
+        self.coins: Optional[int] = None
+        self.campaign: Optional[str] = None
+        self.statuses: Optional[Dict[int, str]] = None
+        self.daily_day: Optional[str] = None
+        self.daily_done: Optional[set] = None
+        self.expires_at = expires_at
+
+
+class ProfileCache:
+    """
+    LRU-кэш состояния игрока (монеты, статусы квестов, дейлики за день) с TTL.
+    Писатели (update_coins, set_main_status, set_daily_done) обновляют
+    или сбрасывают запись сразу после коммита.
+    """
+
+    def __init__(self, max_users: int, ttl: float):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._items: "OrderedDict[int, _CachedProfile]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _entry(self, user_id: int) -> _CachedProfile:
+        now = time.monotonic()
+        entry = self._items.get(user_id)
+        if entry is None or entry.expires_at <= now:
+            entry = _CachedProfile(now + self.ttl)
+            self._items[user_id] = entry
+            while len(self._items) > self.max_users:
+                self._items.popitem(last=False)
+                self.evictions += 1
+        self._items.move_to_end(user_id)
+        return entry
+
+    def _peek(self, user_id: int) -> Optional[_CachedProfile]:
+        return self._items.get(user_id)
+
+    def coins(self, user_id: int, loader) -> int:
+        entry = self._entry(user_id)
+        if entry.coins is None:
+            self.misses += 1
+            entry.coins = loader(user_id)
+        else:
+            self.hits += 1
+        return entry.coins
+
+    def statuses(self, user_id: int, loader) -> Dict[int, str]:
+        entry = self._entry(user_id)
+        if entry.statuses is None:
+            self.misses += 1
+            entry.statuses = loader(user_id)
+        else:
+            self.hits += 1
+        return entry.statuses
+
+    def campaign(self, user_id: int, loader) -> str:
+        entry = self._entry(user_id)
+        if entry.campaign is None:
+            self.misses += 1
+            entry.campaign = loader(user_id)
+        else:
+            self.hits += 1
+        return entry.campaign
+
+    def daily_done(self, user_id: int, day: str, loader) -> set:
+        entry = self._entry(user_id)
+        if entry.daily_done is None or entry.daily_day != day:
+            self.misses += 1
+            entry.daily_day = day
+            entry.daily_done = loader(user_id, day)
+        else:
+            self.hits += 1
+        return entry.daily_done
+
+    def forget_coins(self, user_id: int):
+        entry = self._peek(user_id)
+        if entry is not None:
+            entry.coins = None
+
+    def apply_status(self, user_id: int, node_index: int, status: str):
+        entry = self._peek(user_id)
+        if entry is not None and entry.statuses is not None:
+            entry.statuses[node_index] = status
+
+    def apply_daily(self, user_id: int, task_code: str, day: str, done: bool):
+        entry = self._peek(user_id)
+        if entry is not None and entry.daily_done is not None and entry.daily_day == day:
+            if done:
+                entry.daily_done.add(task_code)
+            else:
+                entry.daily_done.discard(task_code)
+
+    def forget(self, user_id: int):
+        self._items.pop(user_id, None)
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+
+
+PROFILE_CACHE = ProfileCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL)
+
+
+# ---------- Отложенная запись (write-behind) ----------
+
+JOURNAL_FLUSH_MS = int(os.getenv("JOURNAL_FLUSH_MS", "500"))
+JOURNAL_MAX_PENDING = int(os.getenv("JOURNAL_MAX_PENDING", "5000"))
+
+
+class WriteBehindJournal:
+    """
+    Копит в памяти отметки дейликов и изменения монет и сбрасывает их
+    в БД одной транзакцией раз в flush_interval_ms (и при остановке).
+    Чтения должны смотреть сюда раньше БД.
+    При падении процесса теряется не больше одного интервала.
+    """
+
+    def __init__(self, flush_interval_ms: int, max_pending: int):
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_pending = max_pending
+        self._daily: Dict[Tuple[int, str, str], bool] = {}
+        self._coins: Dict[int, int] = {}
+        self._ledger: List[Tuple[int, int, str, Optional[str], str]] = []
+        self._wake = asyncio.Event()
+        self._running = False
+
+    def set_daily_done(self, user_id: int, task_code: str, day: str, done: bool):
+        self._daily[(user_id, task_code, day)] = done
+        self._flush_if_full()
+
+    def add_coins(self, user_id: int, delta: int, reason: str, ref: Optional[str] = None):
+        self._coins[user_id] = self._coins.get(user_id, 0) + delta
+        self._ledger.append((user_id, delta, reason, ref, datetime.utcnow().isoformat()))
+        self._flush_if_full()
+
+    def daily_state(self, user_id: int, task_code: str, day: str) -> Optional[bool]:
+        return self._daily.get((user_id, task_code, day))
+
+    def pending_coins(self, user_id: int) -> int:
+        return self._coins.get(user_id, 0)
+
+    def _flush_if_full(self):
+        if len(self._daily) + len(self._ledger) < self.max_pending:
+            return
+        if self._running:
+            # Сброс делает фоновый цикл: обработчик не ждёт fsync.
+            self._wake.set()
+        else:
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Пишет накопленное одной транзакцией. Возвращает число записанных изменений.
+        Выполняется в потоке event loop, как и остальные запросы к БД: так кэш
+        профилей и буфер меняются атомарно относительно чтений.
+        """
+        if not self._daily and not self._coins:
+            return 0
+        daily, self._daily = self._daily, {}
+        coins, self._coins = self._coins, {}
+        ledger, self._ledger = self._ledger, []
+
+        now = datetime.utcnow().isoformat()
+        conn = get_conn()
+        try:
+            with conn:
+                conn.executemany(
+                    """
+                    INSERT INTO daily_tasks(user_id, task_code, day, done)
+                    VALUES(?,?,?,?)
+                    ON CONFLICT(user_id, task_code, day) DO UPDATE SET done = excluded.done
+                    """,
+                    [(uid, code, day, 1 if done else 0) for (uid, code, day), done in daily.items()],
+                )
+                conn.executemany(
+                    """
+                    INSERT INTO users(user_id, coins, created_at)
+                    VALUES(?,?,?)
+                    ON CONFLICT(user_id) DO UPDATE SET coins = coins + excluded.coins
+                    """,
+                    [(uid, delta, now) for uid, delta in coins.items() if delta],
+                )
+                conn.executemany(
+                    "INSERT INTO coin_ledger(user_id, delta, reason, ref, created_at) "
+                    "VALUES(?,?,?,?,?)",
+                    ledger,
+                )
+        except Exception:
+            # Вернём несохранённое в буфер: более свежие отметки важнее старых.
+            for key, done in daily.items():
+                self._daily.setdefault(key, done)
+            for uid, delta in coins.items():
+                self._coins[uid] = self._coins.get(uid, 0) + delta
+            self._ledger[:0] = ledger
+            raise
+        finally:
+            conn.close()
+
+        for (uid, code, day), done in daily.items():
+            PROFILE_CACHE.apply_daily(uid, code, day, done)
+        for uid in coins:
+            PROFILE_CACHE.forget_coins(uid)
+        return len(daily) + len(ledger)
+
+    async def run(self):
+        """Фоновый цикл сброса журнала: раз в интервал или сразу при переполнении."""
+        self._running = True
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+                try:
+                    self.flush()
+                except Exception as exc:
+                    print(f"Не удалось сбросить журнал дейликов: {exc}")
+        finally:
+            self._running = False
+
+
+DAILY_JOURNAL = WriteBehindJournal(JOURNAL_FLUSH_MS, JOURNAL_MAX_PENDING)
+
+
 def get_or_create_user(user_id: int) -> int:
     """
     Возвращает текущий баланс монет.
@@ -239,25 +759,39 @@ def get_or_create_user(user_id: int) -> int:
     else:
         coins = row[0]
     conn.close()
-    return coins
+    return coins + DAILY_JOURNAL.pending_coins(user_id)
 
 
-def update_coins(user_id: int, delta: int):
-    conn = get_conn()
-    c = conn.cursor()
+def _apply_coins(c, user_id: int, delta: int, reason: str, ref: Optional[str] = None):
+    """Меняет баланс и пишет запись в журнал монет на переданном курсоре (без commit)."""
+    now = datetime.utcnow().isoformat()
     c.execute(
         """
         INSERT INTO users(user_id, coins, created_at)
         VALUES(?,?,?)
-        ON CONFLICT(user_id) DO UPDATE SET coins = coins + ?
+        ON CONFLICT(user_id) DO UPDATE SET coins = coins + excluded.coins
     """,
-        (user_id, 0, datetime.utcnow().isoformat(), delta),
+        (user_id, delta, now),
+    )
+    c.execute(
+        "INSERT INTO coin_ledger(user_id, delta, reason, ref, created_at) VALUES(?,?,?,?,?)",
+        (user_id, delta, reason, ref, now),
     )
-    conn.commit()
-    conn.close()
 
 
-def get_coins(user_id: int) -> int:
+def update_coins(user_id: int, delta: int, reason: str, ref: Optional[str] = None):
+    """Изменение баланса вместе с записью в coin_ledger — одной транзакцией."""
+    conn = get_conn()
+    try:
+        _apply_coins(conn.cursor(), user_id, delta, reason, ref)
+        conn.commit()
+    finally:
+        # Закрытие без commit откатывает транзакцию и сразу отпускает блокировку записи.
+        conn.close()
+    PROFILE_CACHE.forget_coins(user_id)
+
+
+def _load_coins(user_id: int) -> int:
     conn = get_conn()
     c = conn.cursor()
     c.execute("SELECT coins FROM users WHERE user_id = ?", (user_id,))
@@ -266,37 +800,101 @@ def get_coins(user_id: int) -> int:
     return row[0] if row else 0
 
 
+def get_coins(user_id: int) -> int:
+    return PROFILE_CACHE.coins(user_id, _load_coins) + DAILY_JOURNAL.pending_coins(user_id)
+
+
+def _insert_reward(c, user_id: int, name: str, box_level: int):
+    """Добавляет награду и её стопку в текущей кампании игрока (без commit)."""
+    campaign = get_user_campaign(user_id)
+    c.execute(
+        "INSERT INTO rewards(user_id, campaign, name, box_level, used, created_at) "
+        "VALUES(?,?,?,?,?,?)",
+        (user_id, campaign, name, box_level, 0, datetime.utcnow().isoformat()),
+    )
+    c.execute(
+        """
+        INSERT INTO reward_stacks(user_id, campaign, name, box_level, count, last_id)
+        VALUES(?,?,?,?,1,?)
+        ON CONFLICT(user_id, campaign, name, box_level)
+        DO UPDATE SET count = count + 1, last_id = excluded.last_id
+        """,
+        (user_id, campaign, name, box_level, c.lastrowid),
+    )
+
+
 def add_reward(user_id: int, name: str, box_level: int):
     conn = get_conn()
     c = conn.cursor()
-    c.execute(
-        "INSERT INTO rewards(user_id, name, box_level, used, created_at) "
-        "VALUES(?,?,?,?,?)",
-        (user_id, name, box_level, 0, datetime.utcnow().isoformat()),
-    )
+    _insert_reward(c, user_id, name, box_level)
     conn.commit()
     conn.close()
 
 
-def get_active_rewards(user_id: int) -> List[Tuple[int, str, int]]:
+def mark_reward_used(user_id: int, reward_id: int) -> bool:
+    """
+    Помечает награду игрока использованной и уменьшает её стопку.
+    False — награда уже использована, чужая или из другой кампании.
+    """
+    campaign = get_user_campaign(user_id)
     conn = get_conn()
     c = conn.cursor()
     c.execute(
-        "SELECT id, name, box_level FROM rewards "
-        "WHERE user_id = ? AND used = 0 ORDER BY id DESC",
-        (user_id,),
+        "SELECT name, box_level FROM rewards "
+        "WHERE id = ? AND user_id = ? AND campaign = ? AND used = 0",
+        (reward_id, user_id, campaign),
     )
-    rows = c.fetchall()
+    row = c.fetchone()
+    if row is None:
+        conn.close()
+        return False
+    name, box_level = row
+    c.execute("UPDATE rewards SET used = 1 WHERE id = ?", (reward_id,))
+    c.execute(
+        "SELECT MAX(id) FROM rewards "
+        "WHERE user_id = ? AND campaign = ? AND used = 0 AND name = ? AND box_level = ?",
+        (user_id, campaign, name, box_level),
+    )
+    next_id = c.fetchone()[0]
+    if next_id is None:
+        c.execute(
+            "DELETE FROM reward_stacks "
+            "WHERE user_id = ? AND campaign = ? AND name = ? AND box_level = ?",
+            (user_id, campaign, name, box_level),
+        )
+    else:
+        c.execute(
+            "UPDATE reward_stacks SET count = count - 1, last_id = ? "
+            "WHERE user_id = ? AND campaign = ? AND name = ? AND box_level = ?",
+            (next_id, user_id, campaign, name, box_level),
+        )
+    conn.commit()
     conn.close()
-    return rows
+    return True
 
 
-def mark_reward_used(reward_id: int):
+def get_reward_stacks(
+    user_id: int, before_id: Optional[int] = None, limit: int = 8
+) -> List[Tuple[str, int, int, int]]:
+    """
+    Страница стопок (name, box_level, count, last_id) текущей кампании, новые сверху.
+    Keyset-пагинация: следующая страница — before_id = last_id последней строки.
+    """
     conn = get_conn()
     c = conn.cursor()
-    c.execute("UPDATE rewards SET used = 1 WHERE id = ?", (reward_id,))
-    conn.commit()
+    c.execute(
+        "SELECT name, box_level, count, last_id FROM reward_stacks "
+        "WHERE user_id = ? AND campaign = ? AND last_id < ? ORDER BY last_id DESC LIMIT ?",
+        (
+            user_id,
+            get_user_campaign(user_id),
+            before_id if before_id is not None else 2**63 - 1,
+            limit,
+        ),
+    )
+    rows = c.fetchall()
     conn.close()
+    return rows
 
 
 def save_quest_choice(user_id: int, token: str, box_level: int, options: List[str]):
@@ -304,15 +902,23 @@ def save_quest_choice(user_id: int, token: str, box_level: int, options: List[st
     c = conn.cursor()
     c.execute(
         """
-        INSERT INTO quest_choices(token, user_id, box_level, options_json, created_at)
-        VALUES(?,?,?,?,?)
+        INSERT INTO quest_choices(token, user_id, campaign, box_level, options_json, created_at)
+        VALUES(?,?,?,?,?,?)
         ON CONFLICT(token) DO UPDATE SET
             user_id=excluded.user_id,
+            campaign=excluded.campaign,
             box_level=excluded.box_level,
             options_json=excluded.options_json,
             created_at=excluded.created_at
         """,
-        (token, user_id, box_level, json.dumps(options, ensure_ascii=False), datetime.utcnow().isoformat()),
+        (
+            token,
+            user_id,
+            get_user_campaign(user_id),
+            box_level,
+            json.dumps(options, ensure_ascii=False),
+            datetime.utcnow().isoformat(),
+        ),
     )
     conn.commit()
     conn.close()
@@ -322,7 +928,8 @@ def load_quest_choice(token: str) -> Optional[Dict]:
     conn = get_conn()
     c = conn.cursor()
     c.execute(
-        "SELECT user_id, box_level, options_json FROM quest_choices WHERE token = ?",
+        "SELECT user_id, box_level, options_json, created_at, campaign "
+        "FROM quest_choices WHERE token = ?",
         (token,),
     )
     row = c.fetchone()
@@ -333,7 +940,13 @@ def load_quest_choice(token: str) -> Optional[Dict]:
         options = json.loads(row[2]) if row[2] else []
     except Exception:
         options = []
-    return {"user_id": row[0], "box_level": row[1], "options": options}
+    return {
+        "user_id": row[0],
+        "box_level": row[1],
+        "options": options,
+        "created_at": row[3],
+        "campaign": row[4],
+    }
 
 
 def clear_quest_choice(token: str):
@@ -344,16 +957,25 @@ def clear_quest_choice(token: str):
     conn.close()
 
 
-def get_main_status(user_id: int, node_index: int) -> str:
+def _load_main_statuses(user_id: int) -> Dict[int, str]:
     conn = get_conn()
     c = conn.cursor()
     c.execute(
-        "SELECT status FROM main_progress WHERE user_id = ? AND node_index = ?",
-        (user_id, node_index),
+        "SELECT node_index, status FROM main_progress WHERE user_id = ? AND campaign = ?",
+        (user_id, get_user_campaign(user_id)),
     )
-    row = c.fetchone()
+    rows = c.fetchall()
     conn.close()
-    return row[0] if row else "locked"
+    return {node_index: status for node_index, status in rows}
+
+
+def get_main_statuses(user_id: int) -> Dict[int, str]:
+    """Все статусы квестов игрока одним обращением (только для чтения)."""
+    return PROFILE_CACHE.statuses(user_id, _load_main_statuses)
+
+
+def get_main_status(user_id: int, node_index: int) -> str:
+    return get_main_statuses(user_id).get(node_index, "locked")
 
 
 def set_main_status(user_id: int, node_index: int, status: str):
@@ -361,29 +983,34 @@ def set_main_status(user_id: int, node_index: int, status: str):
     c = conn.cursor()
     c.execute(
         """
-        INSERT INTO main_progress(user_id, node_index, status)
-        VALUES(?,?,?)
-        ON CONFLICT(user_id, node_index) DO UPDATE SET status = ?
+        INSERT INTO main_progress(user_id, campaign, node_index, status)
+        VALUES(?,?,?,?)
+        ON CONFLICT(user_id, campaign, node_index) DO UPDATE SET status = excluded.status
     """,
-        (user_id, node_index, status, status),
+        (user_id, get_user_campaign(user_id), node_index, status),
     )
     conn.commit()
     conn.close()
+    PROFILE_CACHE.apply_status(user_id, node_index, status)
 
 
 def get_daily_done(user_id: int, task_code: str, day: str) -> bool:
+    buffered = DAILY_JOURNAL.daily_state(user_id, task_code, day)
+    if buffered is not None:
+        return buffered
+    return task_code in PROFILE_CACHE.daily_done(user_id, day, _load_daily_done)
+
+
+def _load_daily_done(user_id: int, day: str) -> set:
     conn = get_conn()
     c = conn.cursor()
     c.execute(
-        """
-        SELECT done FROM daily_tasks
-        WHERE user_id = ? AND task_code = ? AND day = ?
-    """,
-        (user_id, task_code, day),
+        "SELECT task_code FROM daily_tasks WHERE user_id = ? AND day = ? AND done = 1",
+        (user_id, day),
     )
-    row = c.fetchone()
+    rows = c.fetchall()
     conn.close()
-    return bool(row[0]) if row else False
+    return {row[0] for row in rows}
 
 
 def set_daily_done(user_id: int, task_code: str, day: str, done: bool):
@@ -399,46 +1026,815 @@ def set_daily_done(user_id: int, task_code: str, day: str, done: bool):
     )
     conn.commit()
     conn.close()
+    PROFILE_CACHE.apply_daily(user_id, task_code, day, done)
 
 
-# ================== ИГРОВАЯ КОНФИГА ==================
+# ================== СОСТОЯНИЕ СЕССИЙ ==================
 
-LOOTBOXES = {
-    1: {"name": "Little Happiness", "price": 10},
-    2: {"name": "Medium Loot Box", "price": 20},
-    3: {"name": "Large Loot Box", "price": 40},
-    4: {"name": "Epic Loot Box", "price": 80},
-    5: {"name": "Legendary Loot Box", "price": 150},
-}
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")  # memory | sqlite
+SESSION_MAX_USERS = int(os.getenv("SESSION_MAX_USERS", "50000"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(6 * 3600)))
+SESSION_FIELDS = ("shop_filters", "daily_filter", "daily_search", "quest_choices")
 
-# Упрощённые d100-таблицы для лутбоксов (можешь позже вставить свои большие)
-LOOTBOX_XLSX_CANDIDATES = ["lootbox.xlsx", "Лутбоксы.xlsx"]
-TASKS_DOCX_CANDIDATES = [
-    os.getenv("TASKS_DOCX"),
-    "🎮 RLViGame_bot.docx",
-]
-DEFAULT_REWARD_TABLE = {
-    1: [
-        (40, "🧁 Маленькая вкусняшка"),
-        (70, "☕ Маленький кофе"),
-        (90, "🎀 Милый стикер/мелочь"),
-        (100, "🌟 Мини-набор радости (3 маленьких предмета)"),
-    ],
-    2: [
-        (40, "🍫 Набор сладостей"),
-        (70, "🎮 Небольшой игровой бонус/скин"),
-        (90, "🔌 Мини-аксессуар"),
-        (100, "🌟 MTG + мини-техника"),
-    ],
-    3: [
-        (40, "🎮 Игра на скидке"),
-        (70, "📦 Полезный гаджет"),
-        (90, "🃏 MTG мини-набор"),
-        (100, "🌟 Крупная награда + вкусняшки"),
-    ],
-    4: [
-        (40, "🃏 MTG эпический набор"),
-        (70, "🔊 Хорошая колонка/техника"),
+
+class _Session:
+    __slots__ = SESSION_FIELDS + ("expires_at",)
+
+    def __init__(self, expires_at: float):
+        self.shop_filters = None
+        self.daily_filter = None
+        self.daily_search = None
+        self.quest_choices = None
+        self.expires_at = expires_at
+
+
+class MemorySessionStore:
+    """
+    Состояние экранов (фильтры, поиск, выборы наград) в памяти процесса.
+    Ограничено по числу пользователей (LRU) и по времени простоя (TTL).
+    """
+
+    def __init__(self, max_users: int, ttl: float):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._items: "OrderedDict[int, _Session]" = OrderedDict()
+
+    def _alive(self, user_id: int) -> Optional[_Session]:
+        session = self._items.get(user_id)
+        if session is None:
+            return None
+        if session.expires_at <= time.monotonic():
+            del self._items[user_id]
+            return None
+        return session
+
+    def _evict(self):
+        # Порядок OrderedDict совпадает с порядком истечения: каждое касание двигает в конец.
+        now = time.monotonic()
+        while self._items:
+            user_id, session = next(iter(self._items.items()))
+            if session.expires_at > now and len(self._items) <= self.max_users:
+                break
+            self._items.popitem(last=False)
+
+    def get(self, user_id: int, field: str, default=None):
+        session = self._alive(user_id)
+        if session is None:
+            return default
+        value = getattr(session, field)
+        return default if value is None else value
+
+    def set(self, user_id: int, field: str, value):
+        session = self._alive(user_id)
+        if session is None:
+            session = _Session(0.0)
+            self._items[user_id] = session
+        setattr(session, field, value)
+        session.expires_at = time.monotonic() + self.ttl
+        self._items.move_to_end(user_id)
+        self._evict()
+
+    def pop(self, user_id: int, field: str, default=None):
+        session = self._alive(user_id)
+        if session is None:
+            return default
+        value = getattr(session, field)
+        setattr(session, field, None)
+        if all(getattr(session, f) is None for f in SESSION_FIELDS):
+            del self._items[user_id]
+        return default if value is None else value
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class SqliteSessionStore:
+    """То же состояние в таблице session_state: переживает рестарт бота."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+
+    def get(self, user_id: int, field: str, default=None):
+        conn = get_conn()
+        c = conn.cursor()
+        c.execute(
+            "SELECT value_json FROM session_state WHERE user_id = ? AND field = ? AND updated_at > ?",
+            (user_id, field, time.time() - self.ttl),
+        )
+        row = c.fetchone()
+        conn.close()
+        if not row:
+            return default
+        value = json.loads(row[0])
+        return default if value is None else value
+
+    def set(self, user_id: int, field: str, value):
+        conn = get_conn()
+        c = conn.cursor()
+        c.execute(
+            """
+            INSERT INTO session_state(user_id, field, value_json, updated_at)
+            VALUES(?,?,?,?)
+            ON CONFLICT(user_id, field) DO UPDATE SET
+                value_json=excluded.value_json,
+                updated_at=excluded.updated_at
+            """,
+            (user_id, field, json.dumps(value, ensure_ascii=False), time.time()),
+        )
+        conn.commit()
+        conn.close()
+
+    def pop(self, user_id: int, field: str, default=None):
+        value = self.get(user_id, field, default)
+        conn = get_conn()
+        c = conn.cursor()
+        c.execute("DELETE FROM session_state WHERE user_id = ? AND field = ?", (user_id, field))
+        conn.commit()
+        conn.close()
+        return value
+
+    def purge_expired(self, batch_size: int) -> int:
+        conn = get_conn()
+        c = conn.cursor()
+        c.execute(
+            """
+            DELETE FROM session_state WHERE rowid IN (
+                SELECT rowid FROM session_state WHERE updated_at <= ? LIMIT ?
+            )
+            """,
+            (time.time() - self.ttl, batch_size),
+        )
+        removed = c.rowcount
+        conn.commit()
+        conn.close()
+        return removed
+
+
+def make_session_store(backend: str):
+    if backend == "sqlite":
+        return SqliteSessionStore(SESSION_TTL)
+    return MemorySessionStore(SESSION_MAX_USERS, SESSION_TTL)
+
+
+SESSIONS = make_session_store(SESSION_BACKEND)
+
+
+# ================== ОБСЛУЖИВАНИЕ БД ==================
+
+QUEST_CHOICE_TTL_HOURS = float(os.getenv("QUEST_CHOICE_TTL_HOURS", "72"))
+MAINTENANCE_INTERVAL = float(os.getenv("MAINTENANCE_INTERVAL", "3600"))
+MAINTENANCE_BATCH_SIZE = int(os.getenv("MAINTENANCE_BATCH_SIZE", "1000"))
+MAINTENANCE_PAUSE = float(os.getenv("MAINTENANCE_PAUSE", "0.05"))
+MAINTENANCE_TICK = float(os.getenv("MAINTENANCE_TICK", "60"))
+DAILY_RETENTION_DAYS = int(os.getenv("DAILY_RETENTION_DAYS", "30"))
+REWARDS_ARCHIVE_INTERVAL = float(os.getenv("REWARDS_ARCHIVE_INTERVAL", str(MAINTENANCE_INTERVAL)))
+VACUUM_INTERVAL = float(os.getenv("VACUUM_INTERVAL", "86400"))
+RECONCILE_INTERVAL = float(os.getenv("RECONCILE_INTERVAL", "86400"))
+# Дописывать ли в журнал корректирующую запись при расхождении (баланс не меняется).
+RECONCILE_REPAIR = os.getenv("RECONCILE_REPAIR", "1") == "1"
+
+
+def quest_choice_cutoff() -> str:
+    return (datetime.utcnow() - timedelta(hours=QUEST_CHOICE_TTL_HOURS)).isoformat()
+
+
+def quest_choice_expired(created_at: Optional[str]) -> bool:
+    return bool(created_at) and created_at < quest_choice_cutoff()
+
+
+def purge_expired_quest_choices(batch_size: int = MAINTENANCE_BATCH_SIZE) -> int:
+    """Удаляет одну пачку брошенных выборов наград (по created_at). Возвращает число строк."""
+    conn = get_conn()
+    c = conn.cursor()
+    c.execute(
+        """
+        DELETE FROM quest_choices WHERE token IN (
+            SELECT token FROM quest_choices WHERE created_at < ? LIMIT ?
+        )
+        """,
+        (quest_choice_cutoff(), batch_size),
+    )
+    removed = c.rowcount
+    conn.commit()
+    conn.close()
+    return removed
+
+
+def rollup_old_daily_tasks(batch_size: int = MAINTENANCE_BATCH_SIZE) -> int:
+    """
+    Сворачивает пачку старых отметок дейликов в daily_summary (по пользователю и дню)
+    и удаляет их. Свёртка и удаление — одна транзакция, поэтому прерванный прогон
+    ничего не теряет и не считает дважды.
+    """
+    cutoff = (date.today() - timedelta(days=DAILY_RETENTION_DAYS)).isoformat()
+    conn = get_conn()
+    c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    c.execute(
+        "SELECT rowid, user_id, day, done FROM daily_tasks WHERE day < ? LIMIT ?",
+        (cutoff, batch_size),
+    )
+    rows = c.fetchall()
+    summary: Dict[Tuple[int, str], List[int]] = {}
+    for _, user_id, day, done in rows:
+        counts = summary.setdefault((user_id, day), [0, 0])
+        counts[0] += 1 if done else 0
+        counts[1] += 1
+    c.executemany(
+        """
+        INSERT INTO daily_summary(user_id, day, done_count, total_count) VALUES(?,?,?,?)
+        ON CONFLICT(user_id, day) DO UPDATE SET
+            done_count = done_count + excluded.done_count,
+            total_count = total_count + excluded.total_count
+        """,
+        [(user_id, day, done, total) for (user_id, day), (done, total) in summary.items()],
+    )
+    c.executemany("DELETE FROM daily_tasks WHERE rowid = ?", [(row[0],) for row in rows])
+    conn.commit()
+    conn.close()
+    return len(rows)
+
+
+def archive_used_rewards(batch_size: int = MAINTENANCE_BATCH_SIZE) -> int:
+    """Переносит пачку использованных наград в rewards_archive."""
+    conn = get_conn()
+    c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    c.execute(
+        "SELECT id, user_id, campaign, name, box_level, created_at FROM rewards "
+        "WHERE used = 1 ORDER BY id LIMIT ?",
+        (batch_size,),
+    )
+    rows = c.fetchall()
+    now = datetime.utcnow().isoformat()
+    c.executemany(
+        "INSERT OR IGNORE INTO rewards_archive"
+        "(id, user_id, campaign, name, box_level, created_at, archived_at) "
+        "VALUES(?,?,?,?,?,?,?)",
+        [row + (now,) for row in rows],
+    )
+    c.executemany("DELETE FROM rewards WHERE id = ?", [(row[0],) for row in rows])
+    conn.commit()
+    conn.close()
+    return len(rows)
+
+
+def incremental_vacuum(batch_size: int = MAINTENANCE_BATCH_SIZE) -> int:
+    """Возвращает ОС до batch_size свободных страниц. Возвращает число освобождённых."""
+    conn = get_conn()
+    c = conn.cursor()
+    if c.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        conn.close()
+        return 0
+    before = c.execute("PRAGMA freelist_count").fetchone()[0]
+    # Одна прагма на всю пачку. execute() модуля sqlite3 делает у неё лишь один шаг
+    # (одна страница), executescript() доводит её до конца.
+    # N = 0 значит «всё», поэтому пустой список не трогаем.
+    if before:
+        conn.executescript(f"PRAGMA incremental_vacuum({min(before, batch_size)})")
+    after = c.execute("PRAGMA freelist_count").fetchone()[0]
+    conn.close()
+    return before - after
+
+
+class CoinReconciler:
+    """
+    Сверяет users.coins с суммой coin_ledger за один проход по пользователям
+    (пачками по user_id, каждая пачка — отдельное чтение). Расхождения логирует;
+    с repair дописывает в журнал запись 'reconcile' на разницу. Сам баланс
+    не трогается: чинить его вслепую хуже, а запись видна при разборе.
+    """
+
+    def __init__(self, repair: bool = RECONCILE_REPAIR):
+        self.repair = repair
+        self.after_user_id = -1
+        self.checked = 0
+        self.repaired = 0
+        self.mismatches: List[Tuple[int, int, int]] = []
+
+    def __call__(self, batch_size: int = MAINTENANCE_BATCH_SIZE) -> int:
+        if self.after_user_id < 0:
+            self.checked = 0
+            self.repaired = 0
+            self.mismatches = []
+        conn = get_conn()
+        c = conn.cursor()
+        c.execute(
+            """
+            SELECT u.user_id, u.coins, COALESCE(SUM(l.delta), 0)
+            FROM (SELECT user_id, coins FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?) u
+            LEFT JOIN coin_ledger l ON l.user_id = u.user_id
+            GROUP BY u.user_id
+            ORDER BY u.user_id
+            """,
+            (self.after_user_id, batch_size),
+        )
+        rows = c.fetchall()
+        conn.close()
+        for user_id, coins, ledger_sum in rows:
+            if coins != ledger_sum:
+                self.mismatches.append((user_id, coins, ledger_sum))
+                print(f"Баланс {user_id} расходится с журналом: {coins} против {ledger_sum}")
+                if self.repair:
+                    self._repair(user_id)
+        self.checked += len(rows)
+        if len(rows) < batch_size:
+            self.after_user_id = -1  # проход закончен, следующий начнётся сначала
+        else:
+            self.after_user_id = rows[-1][0]
+        return len(rows)
+
+
+    def _repair(self, user_id: int):
+        # Разница пересчитывается в той же инструкции: изменения монет между
+        # чтением и записью идут вместе со своей строкой журнала и её не меняют.
+        conn = get_conn()
+        c = conn.cursor()
+        c.execute(
+            """
+            INSERT INTO coin_ledger(user_id, delta, reason, ref, created_at)
+            SELECT user_id, coins - (SELECT COALESCE(SUM(delta), 0) FROM coin_ledger WHERE user_id = ?),
+                   'reconcile', NULL, ?
+            FROM users WHERE user_id = ?
+              AND coins != (SELECT COALESCE(SUM(delta), 0) FROM coin_ledger WHERE user_id = ?)
+            """,
+            (user_id, datetime.utcnow().isoformat(), user_id, user_id),
+        )
+        self.repaired += c.rowcount
+        conn.commit()
+        conn.close()
+
+
+COIN_RECONCILER = CoinReconciler()
+
+
+def purge_processed_callbacks(batch_size: int = MAINTENANCE_BATCH_SIZE) -> int:
+    if isinstance(CALLBACK_DEDUP, SqliteDedupCache):
+        return CALLBACK_DEDUP.purge_expired(batch_size)
+    return 0
+
+
+def purge_expired_sessions(batch_size: int = MAINTENANCE_BATCH_SIZE) -> int:
+    if isinstance(SESSIONS, SqliteSessionStore):
+        return SESSIONS.purge_expired(batch_size)
+    return 0  # память чистится сама по LRU/TTL
+
+
+# (имя, задача, интервал в секундах). Каждая задача обрабатывает одну пачку
+# и возвращает её размер; пачка меньше MAINTENANCE_BATCH_SIZE — работа закончена.
+# Вакуум идёт последним, чтобы забрать страницы, освобождённые остальными.
+MAINTENANCE_JOBS = [
+    ("quest_choices", purge_expired_quest_choices, MAINTENANCE_INTERVAL),
+    ("session_state", purge_expired_sessions, MAINTENANCE_INTERVAL),
+    ("processed_callbacks", purge_processed_callbacks, MAINTENANCE_INTERVAL),
+    ("daily_rollup", rollup_old_daily_tasks, MAINTENANCE_INTERVAL),
+    ("coin_reconcile", COIN_RECONCILER, RECONCILE_INTERVAL),
+    ("rewards_archive", archive_used_rewards, REWARDS_ARCHIVE_INTERVAL),
+    ("incremental_vacuum", incremental_vacuum, VACUUM_INTERVAL),
+]
+
+
+def get_maintenance_last_run(name: str) -> float:
+    conn = get_conn()
+    c = conn.cursor()
+    c.execute("SELECT last_run FROM maintenance_state WHERE job = ?", (name,))
+    row = c.fetchone()
+    conn.close()
+    return row[0] if row else 0.0
+
+
+def mark_maintenance_run(name: str, processed: int):
+    conn = get_conn()
+    c = conn.cursor()
+    c.execute(
+        """
+        INSERT INTO maintenance_state(job, last_run, processed) VALUES(?,?,?)
+        ON CONFLICT(job) DO UPDATE SET last_run = excluded.last_run, processed = excluded.processed
+        """,
+        (name, time.time(), processed),
+    )
+    conn.commit()
+    conn.close()
+
+
+async def run_maintenance_job(name: str, job) -> int:
+    """Гоняет задачу пачками в отдельном потоке, уступая event loop между пачками."""
+    total = 0
+    while True:
+        processed = await asyncio.to_thread(job)
+        total += processed
+        if processed < MAINTENANCE_BATCH_SIZE:
+            break
+        await asyncio.sleep(MAINTENANCE_PAUSE)
+    if total:
+        print(f"Обслуживание {name}: обработано {total} строк")
+    return total
+
+
+async def run_due_maintenance():
+    """Запускает задачи, чей интервал истёк. Время прогона хранится в БД и переживает рестарт."""
+    for name, job, interval in MAINTENANCE_JOBS:
+        try:
+            if time.time() - await asyncio.to_thread(get_maintenance_last_run, name) < interval:
+                continue
+            processed = await run_maintenance_job(name, job)
+            await asyncio.to_thread(mark_maintenance_run, name, processed)
+        except Exception as exc:
+            print(f"Ошибка обслуживания {name}: {exc}")
+
+
+async def maintenance_loop():
+    while True:
+        await run_due_maintenance()
+        await asyncio.sleep(MAINTENANCE_TICK)
+
+
+# ================== ИМПОРТ СТАРЫХ ДАННЫХ ==================
+
+USERS_JSON_FILE = os.getenv("USERS_JSON_FILE", "data/users.json")
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))
+IMPORT_CHUNK_BYTES = 1 << 20
+# Символы, которыми может продолжаться число: «1.» или «12» на краю куска — ещё не конец.
+_JSON_NUMBER_TAIL = "0123456789.eE+-"
+
+
+def iter_json_object_items(fp, chunk_bytes: int = IMPORT_CHUNK_BYTES):
+    """
+    Потоково отдаёт пары (ключ, значение) верхнеуровневого JSON-объекта,
+    держа в памяти только текущий кусок файла, а не весь документ.
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+
+    def fill() -> bool:
+        nonlocal buf, pos, eof
+        if eof:
+            return False
+        chunk = fp.read(chunk_bytes)
+        if not chunk:
+            eof = True
+            return False
+        buf = buf[pos:] + chunk
+        pos = 0
+        return True
+
+    def skip(chars: str):
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in chars:
+                pos += 1
+            if pos < len(buf) or not fill():
+                return
+
+    def decode():
+        nonlocal pos
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+                # Число на краю куска могло оборваться: raw_decode примет «1.» из «1.5»
+                # как 1. Значение окончено, только если за ним уже виден не-числовой символ.
+                if eof or (end < len(buf) and buf[end] not in _JSON_NUMBER_TAIL):
+                    pos = end
+                    return value
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            if not fill():
+                value, pos = decoder.raw_decode(buf, pos)
+                return value
+
+    skip(" \t\r\n")
+    if pos >= len(buf) or buf[pos] != "{":
+        raise ValueError("ожидался JSON-объект на верхнем уровне")
+    pos += 1
+    while True:
+        skip(" \t\r\n,")
+        if pos >= len(buf):
+            raise ValueError("JSON-объект оборван")
+        if buf[pos] == "}":
+            return
+        key = decode()
+        skip(" \t\r\n")
+        if pos >= len(buf) or buf[pos] != ":":
+            raise ValueError(f"ожидалось ':' после ключа {key!r}")
+        pos += 1
+        skip(" \t\r\n")
+        yield key, decode()
+
+
+def _write_import_batch(users: List[Tuple], tokens: List[Tuple], passes: List[Tuple]):
+    conn = get_conn()
+    with conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO users(user_id, coins, created_at) VALUES(?,?,?)", users
+        )
+        conn.executemany(
+            """
+            INSERT INTO user_tokens(user_id, token, count) VALUES(?,?,?)
+            ON CONFLICT(user_id, token) DO UPDATE SET count = excluded.count
+            """,
+            tokens,
+        )
+        conn.executemany(
+            """
+            INSERT INTO battle_pass(user_id, rp, bp_level) VALUES(?,?,?)
+            ON CONFLICT(user_id) DO UPDATE SET rp = excluded.rp, bp_level = excluded.bp_level
+            """,
+            passes,
+        )
+    conn.close()
+
+
+def import_users_json(path: str = USERS_JSON_FILE, batch_size: int = IMPORT_BATCH_SIZE) -> Dict:
+    """
+    Переносит users.json ({user_id: {tokens, rp, bp_level}}) в users, user_tokens
+    и battle_pass. Пишет пачками по batch_size пользователей, каждая — своя транзакция;
+    повторный запуск перезаписывает те же строки.
+    """
+    init_db()
+    started = time.perf_counter()
+    imported = skipped = 0
+    now = datetime.utcnow().isoformat()
+    users: List[Tuple] = []
+    tokens: List[Tuple] = []
+    passes: List[Tuple] = []
+
+    def flush_batch(stage: str):
+        nonlocal users, tokens, passes
+        if users:
+            _write_import_batch(users, tokens, passes)
+        users, tokens, passes = [], [], []
+        elapsed = time.perf_counter() - started
+        print(
+            f"{stage}: {imported} пользователей, пропущено {skipped}, "
+            f"{imported / max(elapsed, 1e-9):.0f}/с"
+        )
+
+    with open(path, "r", encoding="utf-8") as f:
+        for key, record in iter_json_object_items(f):
+            try:
+                uid = int(key)
+                rp = int(record.get("rp", 0) or 0)
+                bp_level = int(record.get("bp_level", 0) or 0)
+                user_tokens = [(uid, str(t), int(n)) for t, n in (record.get("tokens") or {}).items()]
+            except (TypeError, ValueError, AttributeError):
+                skipped += 1
+                continue
+            users.append((uid, 0, now))
+            passes.append((uid, rp, bp_level))
+            tokens.extend(user_tokens)
+            imported += 1
+            if len(users) >= batch_size:
+                flush_batch("Импорт")
+    flush_batch("Импорт завершён")
+    return {"imported": imported, "skipped": skipped, "seconds": time.perf_counter() - started}
+
+
+# ================== БЭКАП И ВЫГРУЗКА ==================
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_INTERVAL = float(os.getenv("BACKUP_INTERVAL", "0"))  # 0 — без автоматических бэкапов
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+BACKUP_PAGES = int(os.getenv("BACKUP_PAGES", "1024"))
+BACKUP_PAUSE = float(os.getenv("BACKUP_PAUSE", "0.01"))
+EXPORT_FETCH_SIZE = 5000
+
+
+def backup_database(dest: Optional[str] = None, pages: int = BACKUP_PAGES) -> str:
+    """
+    Горячий бэкап через online backup API SQLite: копирует по pages страниц за шаг
+    из одного снимка базы, так что копия согласована, а бот продолжает писать.
+    """
+    if dest is None:
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+        dest = os.path.join(BACKUP_DIR, f"{os.path.splitext(os.path.basename(DB_PATH))[0]}-{stamp}.db")
+    tmp_dest = dest + ".part"
+    src = get_conn()
+    dst = sqlite3.connect(tmp_dest)
+    try:
+        # Открытая транзакция чтения фиксирует снимок WAL на всё копирование:
+        # иначе каждая чужая запись перезапускала бы бэкап с нуля.
+        src.execute("BEGIN")
+        src.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+        src.backup(dst, pages=pages, sleep=BACKUP_PAUSE)
+    except BaseException:
+        dst.close()
+        src.close()
+        # Недописанная копия (диск полон, база занята) не должна копиться в BACKUP_DIR.
+        if os.path.exists(tmp_dest):
+            os.remove(tmp_dest)
+        raise
+    dst.close()
+    src.close()
+    # Недописанный файл никогда не лежит под именем бэкапа.
+    os.replace(tmp_dest, dest)
+    return dest
+
+
+def _prune_backups(keep: int = BACKUP_KEEP):
+    if not os.path.isdir(BACKUP_DIR):
+        return
+    prefix = os.path.splitext(os.path.basename(DB_PATH))[0] + "-"
+    backups = sorted(
+        name for name in os.listdir(BACKUP_DIR) if name.startswith(prefix) and name.endswith(".db")
+    )
+    for name in backups[:-keep] if keep > 0 else []:
+        os.remove(os.path.join(BACKUP_DIR, name))
+
+
+def scheduled_backup(batch_size: int = MAINTENANCE_BATCH_SIZE) -> int:
+    """Задача обслуживания: один бэкап за прогон плюс ротация старых."""
+    path = backup_database()
+    _prune_backups(BACKUP_KEEP)
+    print(f"Бэкап базы: {path}")
+    return 0
+
+
+if BACKUP_INTERVAL > 0:
+    MAINTENANCE_JOBS.append(("backup", scheduled_backup, BACKUP_INTERVAL))
+
+
+def export_jsonl(out_dir: str, tables: Optional[List[str]] = None) -> Dict[str, int]:
+    """
+    Выгружает таблицы в out_dir/<таблица>.jsonl построчно, не держа таблицу в памяти.
+    Все таблицы читаются в одной транзакции чтения — срез согласован между ними,
+    а в WAL-режиме писатели при этом не ждут.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    conn = get_conn()
+    c = conn.cursor()
+    c.execute("BEGIN")
+    c.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")
+    existing = [row[0] for row in c.fetchall()]
+    counts: Dict[str, int] = {}
+    try:
+        for table in tables or existing:
+            if table not in existing:
+                print(f"Таблицы {table} нет, пропускаю")
+                continue
+            started = time.perf_counter()
+            c.execute(f'SELECT * FROM "{table}"')
+            columns = [d[0] for d in c.description]
+            written = 0
+            with open(os.path.join(out_dir, f"{table}.jsonl"), "w", encoding="utf-8") as f:
+                while True:
+                    rows = c.fetchmany(EXPORT_FETCH_SIZE)
+                    if not rows:
+                        break
+                    f.writelines(
+                        json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows
+                    )
+                    written += len(rows)
+            counts[table] = written
+            print(f"Выгрузка {table}: {written} строк за {time.perf_counter() - started:.1f} с")
+    finally:
+        conn.rollback()
+        conn.close()
+    return counts
+
+
+# ================== МОДЕЛИ КОНТЕНТА ==================
+
+
+class _Record:
+    """
+    Неизменяемая запись контента на __slots__: у объекта нет __dict__,
+    поля читаются атрибутами. Сравнение и хэш — по значениям полей.
+    """
+
+    __slots__ = ()
+    _defaults: Dict = {}
+
+    def __init__(self, **fields):
+        unknown = set(fields) - set(self.__slots__)
+        if unknown:
+            raise TypeError(f"{type(self).__name__}: неизвестные поля {sorted(unknown)}")
+        for name in self.__slots__:
+            object.__setattr__(self, name, fields[name] if name in fields else self._defaults.get(name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} неизменяем")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} неизменяем")
+
+    def __reduce__(self):
+        # pickle и copy по умолчанию восстанавливают слоты через setattr.
+        return type(self).from_dict, (self.to_dict(),)
+
+    def _values(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self._values() == other._values()
+
+    def __hash__(self):
+        return hash((type(self).__name__,) + self._values())
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+    def replace(self, **changes):
+        return type(self)(**dict(self.to_dict(), **changes))
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, raw: Dict):
+        return cls(**{name: raw[name] for name in cls.__slots__ if name in raw})
+
+
+class Quest(_Record):
+    """Мейн-квест: index — номер в БД, code — код из документа («1.2») или пустой."""
+
+    __slots__ = ("index", "code", "title", "desc", "reward_coins", "reward_card")
+    _defaults = {"code": "", "desc": "", "reward_coins": 0, "reward_card": "common"}
+    index: int
+    code: str
+    title: str
+    desc: str
+    reward_coins: int
+    reward_card: str
+
+
+class ShopItem(_Record):
+    """Награда магазина."""
+
+    __slots__ = ("id", "name", "emoji", "category", "price", "description")
+    _defaults = {"emoji": "", "category": "other", "price": 0, "description": ""}
+    id: str
+    name: str
+    emoji: str
+    category: str
+    price: int
+    description: str
+
+
+class DailyTask(_Record):
+    """Дейлик; code совпадает с ключом в DAILY_TASKS."""
+
+    __slots__ = ("code", "title", "coins", "category", "cost_key")
+    _defaults = {"coins": 1, "category": "", "cost_key": "standard"}
+    code: str
+    title: str
+    coins: int
+    category: str
+    cost_key: str
+
+
+class LootEntry(_Record):
+    """Строка d100-таблицы лутбокса: бросок до threshold включительно даёт name."""
+
+    __slots__ = ("threshold", "name")
+    threshold: int
+    name: str
+
+
+# ================== ИГРОВАЯ КОНФИГА ==================
+
+LOOTBOXES = {
+    1: {"name": "Little Happiness", "price": 10},
+    2: {"name": "Medium Loot Box", "price": 20},
+    3: {"name": "Large Loot Box", "price": 40},
+    4: {"name": "Epic Loot Box", "price": 80},
+    5: {"name": "Legendary Loot Box", "price": 150},
+}
+
+# Упрощённые d100-таблицы для лутбоксов (можешь позже вставить свои большие)
+LOOTBOX_XLSX_CANDIDATES = ["lootbox.xlsx", "Лутбоксы.xlsx"]
+TASKS_DOCX_CANDIDATES = [
+    os.getenv("TASKS_DOCX"),
+    "🎮 RLViGame_bot.docx",
+]
+DEFAULT_REWARD_TABLE = {
+    1: [
+        (40, "🧁 Маленькая вкусняшка"),
+        (70, "☕ Маленький кофе"),
+        (90, "🎀 Милый стикер/мелочь"),
+        (100, "🌟 Мини-набор радости (3 маленьких предмета)"),
+    ],
+    2: [
+        (40, "🍫 Набор сладостей"),
+        (70, "🎮 Небольшой игровой бонус/скин"),
+        (90, "🔌 Мини-аксессуар"),
+        (100, "🌟 MTG + мини-техника"),
+    ],
+    3: [
+        (40, "🎮 Игра на скидке"),
+        (70, "📦 Полезный гаджет"),
+        (90, "🃏 MTG мини-набор"),
+        (100, "🌟 Крупная награда + вкусняшки"),
+    ],
+    4: [
+        (40, "🃏 MTG эпический набор"),
+        (70, "🔊 Хорошая колонка/техника"),
         (90, "🎮 Крупная игра/DLC"),
         (100, "🌟 Крупная покупка + бонус"),
     ],
@@ -449,6 +1845,9 @@ DEFAULT_REWARD_TABLE = {
         (100, "💖 Техника + MTG + подарок от себя"),
     ],
 }
+DEFAULT_REWARD_TABLE: Dict[int, List[LootEntry]] = {
+    lvl: [LootEntry(threshold=t, name=name) for t, name in entries] for lvl, entries in DEFAULT_REWARD_TABLE.items()
+}
 REWARD_TABLE = {lvl: list(entries) for lvl, entries in DEFAULT_REWARD_TABLE.items()}
 
 # Карты-награды за Мейн-квесты
@@ -468,7 +1867,7 @@ RARITY_TO_BOX_LEVEL = {
 }
 
 SHOP_REWARDS_FILE = os.getenv("SHOP_REWARDS_FILE", "data/shop_rewards.json")
-DEFAULT_SHOP_REWARDS: List[Dict] = [
+DEFAULT_SHOP_REWARDS = [
     {
         "id": "coffee_break",
         "emoji": "☕",
@@ -518,10 +1917,11 @@ DEFAULT_SHOP_REWARDS: List[Dict] = [
         "description": "Более крупная покупка, когда закрыт важный этап.",
     },
 ]
-SHOP_REWARDS: List[Dict] = []
+DEFAULT_SHOP_REWARDS: List[ShopItem] = [ShopItem.from_dict(item) for item in DEFAULT_SHOP_REWARDS]
+SHOP_REWARDS: List[ShopItem] = []
 SHOP_PRICE_PRESETS = [10, 20, 30, 40, 50, 75, 100, 150, 200, 300, 500]
-SHOP_FILTERS: Dict[int, Dict] = defaultdict(lambda: {"category": "all", "price": "all"})
 SHOP_PAGE_SIZE = 8
+INVENTORY_PAGE_SIZE = int(os.getenv("INVENTORY_PAGE_SIZE", "8"))
 SHOP_CATEGORY_ICONS = {
     "mtg": "◇",
     "mtg_cash": "◆",
@@ -627,9 +2027,10 @@ MAIN_QUESTS = [
         "reward_card": "legendary",
     },
 ]
+MAIN_QUESTS: List[Quest] = [Quest.from_dict(q) for q in MAIN_QUESTS]
 
 # Дейлики
-DAILY_TASKS = {}
+DAILY_TASKS: Dict[str, DailyTask] = {}
 COST_CATEGORIES = {
     "small": 1,  # маленькая задача
     "standard": 2,  # стандартная
@@ -648,6 +2049,7 @@ THEME_LABELS = {
     "finance": "Финансы",
     "social": "Социальное",
     "rest": "Отдых",
+    "docx": "Из документа",
 }
 RAW_DAILIES = {
     "work": {
@@ -1302,7 +2704,6 @@ QUEST_DEPENDENCIES = {
     "2.5": "2.4",
     "2.7": "2.6",
 }
-QUEST_CHOICES: Dict[int, Dict[str, Dict]] = {}
 
 # Группы квестов для отображения (по образцу документа)
 LEVEL_GROUPS = {
@@ -1327,10 +2728,6 @@ LEVEL_SCHEDULE = {
     7: {"start": date(2026, 5, 5), "end": date(2026, 5, 31)},
 }
 
-DAILY_SEARCH_WAIT: Dict[int, bool] = {}
-DAILY_FILTER_STATE: Dict[int, Dict] = defaultdict(
-    lambda: {"filter_coin": "all", "category": "all", "page": 0, "search": ""}
-)
 
 
 def _excel_col_to_index(col: str) -> int:
@@ -1369,7 +2766,7 @@ def _read_shared_strings(zf: zipfile.ZipFile, ns: str) -> List[str]:
     return strings
 
 
-def load_lootbox_reward_tables_from_excel(xlsx_path: str) -> Dict[int, List[Tuple[int, str]]]:
+def load_lootbox_reward_tables_from_excel(xlsx_path: str) -> Dict[int, List[LootEntry]]:
     """
     Читает lootbox.xlsx и собирает таблицы наград для уровней 1–5.
     Ожидается, что названия листов начинаются с «1. », «2. » и т.д.
@@ -1405,7 +2802,7 @@ def load_lootbox_reward_tables_from_excel(xlsx_path: str) -> Dict[int, List[Tupl
                         sheet_paths[lvl] = f"xl/{rel_map[rid]}"
 
             shared_strings = _read_shared_strings(zf, ns_main)
-            reward_tables: Dict[int, List[Tuple[int, str]]] = {}
+            reward_tables: Dict[int, List[LootEntry]] = {}
 
             for lvl, sheet_path in sheet_paths.items():
                 try:
@@ -1424,7 +2821,7 @@ def load_lootbox_reward_tables_from_excel(xlsx_path: str) -> Dict[int, List[Tupl
                     rows.append([row_values.get(0, ""), row_values.get(1, "")])
 
                 # ищем строку-заголовок с d100 и собираем данные ниже
-                entries: List[Tuple[int, str]] = []
+                entries: List[LootEntry] = []
                 header_seen = False
                 for roll_raw, reward_name in rows:
                     if not header_seen:
@@ -1438,10 +2835,10 @@ def load_lootbox_reward_tables_from_excel(xlsx_path: str) -> Dict[int, List[Tupl
                         roll_num = int(float(str(roll_raw)))
                     except ValueError:
                         continue
-                    entries.append((roll_num, reward_name))
+                    entries.append(LootEntry(threshold=roll_num, name=str(reward_name)))
 
                 if entries:
-                    entries.sort(key=lambda x: x[0])
+                    entries.sort(key=lambda e: e.threshold)
                     reward_tables[lvl] = entries
 
             return reward_tables
@@ -1450,21 +2847,30 @@ def load_lootbox_reward_tables_from_excel(xlsx_path: str) -> Dict[int, List[Tupl
         return {}
 
 
-def refresh_reward_table():
-    """Обновляет глобальную таблицу наград из Excel с откатом к дефолту."""
-    global REWARD_TABLE
-    env_path = os.getenv("LOOTBOX_XLSX")
-    candidates = [env_path] + LOOTBOX_XLSX_CANDIDATES
-    xlsx_path = next((p for p in candidates if p and os.path.exists(p)), candidates[1])
-
-    loaded = load_lootbox_reward_tables_from_excel(xlsx_path)
-    merged: Dict[int, List[Tuple[int, str]]] = {}
+def merge_reward_tables(loaded: Dict[int, List[LootEntry]]) -> Dict[int, List[LootEntry]]:
+    """Дополняет загруженные таблицы встроенными для отсутствующих уровней."""
+    merged: Dict[int, List[LootEntry]] = {}
     for lvl in LOOTBOXES:
         if loaded.get(lvl):
             merged[lvl] = loaded[lvl]
         else:
             merged[lvl] = list(DEFAULT_REWARD_TABLE.get(lvl, []))
-    REWARD_TABLE = merged
+    return merged
+
+
+def lootbox_xlsx_path() -> str:
+    candidates = [os.getenv("LOOTBOX_XLSX")] + LOOTBOX_XLSX_CANDIDATES
+    return next((p for p in candidates if p and os.path.exists(p)), candidates[1])
+
+
+def refresh_reward_table():
+    """Обновляет глобальную таблицу наград из Excel с откатом к дефолту."""
+    global REWARD_TABLE
+    xlsx_path = lootbox_xlsx_path()
+
+    loaded = load_lootbox_reward_tables_from_excel(xlsx_path)
+    REWARD_TABLE = merge_reward_tables(loaded)
+    invalidate_catalogs()
 
     if loaded:
         print(f"Награды лутбоксов загружены из {xlsx_path}")
@@ -1472,75 +2878,75 @@ def refresh_reward_table():
         print("Используются встроенные награды лутбоксов")
 
 
-def _load_docx_lines(docx_path: str) -> List[str]:
-    """Возвращает список строк (абзацев) из docx."""
-    with zipfile.ZipFile(docx_path) as zf:
-        xml = zf.read("word/document.xml")
-    root = ET.fromstring(xml)
-    ns = {"w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main"}
-    lines = []
-    for p in root.findall(".//w:p", ns):
-        texts = [t.text for t in p.findall(".//w:t", ns) if t.text]
-        if texts:
-            lines.append("".join(texts))
-    return lines
+DOCX_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
 
 
-def load_main_quests_from_docx(docx_path: str) -> List[Dict]:
+def iter_docx_paragraphs(docx_path: str):
     """
-    Парсит docx и достаёт мейн-квесты вида:
-    '1.1 Название → Rare ×1 + 3 coin'
-    Возвращает список с последовательной нумерацией для БД и оригинальным кодом.
+    Потоково отдаёт непустые абзацы docx: document.xml распаковывается один раз
+    по мере чтения, разобранные элементы сразу удаляются из дерева.
     """
-    try:
-        lines = _load_docx_lines(docx_path)
-    except Exception as exc:
-        print(f"Не удалось прочитать docx для квестов: {exc}")
-        return []
+    p_tag, t_tag, body_tag = DOCX_NS + "p", DOCX_NS + "t", DOCX_NS + "body"
+    with zipfile.ZipFile(docx_path) as zf, zf.open("word/document.xml") as xml:
+        body = None
+        texts_stack: List[List[str]] = []  # абзацы бывают вложены (надписи)
+        for event, elem in ET.iterparse(xml, events=("start", "end")):
+            tag = elem.tag
+            if event == "start":
+                if tag == p_tag:
+                    texts_stack.append([])
+                elif tag == body_tag:
+                    body = elem
+                continue
+            if tag == t_tag:
+                if elem.text and texts_stack:
+                    texts_stack[-1].append(elem.text)
+            elif tag == p_tag:
+                texts = texts_stack.pop()
+                elem.clear()
+                if not texts_stack and body is not None:
+                    body.clear()
+                if texts:
+                    yield "".join(texts)
+
+
+class _MainQuestExtractor:
+    """Собирает мейн-квесты вида '1.1 Название → Rare ×1 + 3 coin'."""
 
     pattern = re.compile(
         r"(?P<code>\d+\.\d+)\s+(?P<title>.+?)\s*→\s*(?P<rarity>[A-Za-zА-Яа-я]+)\s*×1\s*\+\s*(?P<coins>\d+)\s*coin",
         re.IGNORECASE,
     )
+    rarities = {"common", "uncommon", "rare", "epic", "legendary"}
 
-    quests = []
-    seen = set()
-    for line in lines:
-        for m in pattern.finditer(line):
+    def __init__(self):
+        self._found: List[Tuple[str, str, int, str]] = []
+        self._seen = set()
+
+    def feed(self, line: str):
+        for m in self.pattern.finditer(line):
             rarity = m.group("rarity").strip().lower()
-            rarity = {
-                "common": "common",
-                "uncommon": "uncommon",
-                "rare": "rare",
-                "epic": "epic",
-                "legendary": "legendary",
-            }.get(rarity, "common")
+            if rarity not in self.rarities:
+                rarity = "common"
             key = (m.group("code"), m.group("title").strip())
-            if key in seen:
+            if key in self._seen:
                 continue
-            seen.add(key)
-            quests.append(
-                {
-                    "code": m.group("code"),
-                    "title": m.group("title").strip(),
-                    "reward_coins": int(m.group("coins")),
-                    "reward_card": rarity,
-                }
-            )
+            self._seen.add(key)
+            self._found.append((key[0], key[1], int(m.group("coins")), rarity))
 
-    for idx, q in enumerate(quests, start=1):
-        q["index"] = idx
-        q["desc"] = ""
-    return quests
+    def result(self) -> List[Quest]:
+        return [
+            Quest(index=idx, code=code, title=title, reward_coins=coins, reward_card=rarity)
+            for idx, (code, title, coins, rarity) in enumerate(self._found, start=1)
+        ]
 
 
-def load_daily_tasks_from_docx(docx_path: str) -> Dict[str, Dict]:
-    """Читает docx и собирает категории 6.1–6.4 с монетами 1/2/3/5."""
-    try:
-        lines = _load_docx_lines(docx_path)
-    except Exception as exc:
-        print(f"Не удалось прочитать docx для дейликов: {exc}")
-        return {}
+class _DailyTaskExtractor:
+    """
+    Собирает дейлики из разделов 6.1–6.4 (монеты 1/2/3/5) за один проход:
+    заголовок раздела открывает новую корзину, строки до следующего заголовка
+    попадают в неё. Повторный заголовок того же раздела начинает его заново.
+    """
 
     categories = [
         ("6.1", 1),
@@ -1548,55 +2954,107 @@ def load_daily_tasks_from_docx(docx_path: str) -> Dict[str, Dict]:
         ("6.3", 3),
         ("6.4", 5),
     ]
-    starts = {}
-    for idx, line in enumerate(lines):
-        for code, _coins in categories:
-            if line.startswith(("● " + code, "▲ " + code, "★ " + code, "⏱ " + code)):
-                starts[code] = idx
-
-    tasks: Dict[str, Dict] = {}
-    for code, coins in categories:
-        if code not in starts:
-            continue
-        start_idx = starts[code] + 1
-        next_indices = [i for c, i in starts.items() if i > starts[code]]
-        end_idx = min(next_indices) if next_indices else len(lines)
-        bucket: List[str] = []
-        for offset, line in enumerate(lines[start_idx:end_idx]):
-            if not line or "вариант" in line.lower() or "монет" in line.lower():
-                continue
-            # пропустим первые описательные строки после заголовка
-            if offset < 2:
-                continue
-            text = line.strip()
-            if not text:
-                continue
-            bucket.append(text)
-        for i, title in enumerate(bucket, start=1):
-            key = f"d{code.replace('.', '')}_{i}"
-            tasks[key] = {"title": title, "coins": coins}
+
+    header = re.compile(
+        "^[●▲★⏱] (" + "|".join(re.escape(code) for code, _coins in categories) + ")"
+    )
+    cost_keys = {1: "small", 2: "standard", 3: "unpleasant", 5: "focus"}
+
+    def __init__(self):
+        self._buckets: Dict[str, List[str]] = {}
+        self._current: Optional[List[str]] = None
+        self._offset = 0
+
+    def feed(self, line: str):
+        m = self.header.match(line)
+        if m is not None:
+            self._current = self._buckets[m.group(1)] = []
+            self._offset = 0
+            return
+        if self._current is None:
+            return
+        offset = self._offset
+        self._offset += 1
+        lowered = line.lower()
+        if not line or "вариант" in lowered or "монет" in lowered:
+            return
+        # пропустим первые описательные строки после заголовка
+        if offset < 2:
+            return
+        text = line.strip()
+        if text:
+            self._current.append(text)
+
+    def result(self) -> Dict[str, DailyTask]:
+        tasks: Dict[str, DailyTask] = {}
+        for code, coins in self.categories:
+            for i, title in enumerate(self._buckets.get(code, []), start=1):
+                key = f"d{code.replace('.', '')}_{i}"
+                tasks[key] = DailyTask(
+                    code=key,
+                    title=title,
+                    coins=coins,
+                    category="docx",
+                    cost_key=self.cost_keys.get(coins, "standard"),
+                )
+        return tasks
+
+
+def extract_docx(docx_path: str, *extractors):
+    """Один проход по абзацам docx, каждый абзац получают все экстракторы."""
+    for line in iter_docx_paragraphs(docx_path):
+        for extractor in extractors:
+            extractor.feed(line)
+    return tuple(extractor.result() for extractor in extractors)
+
+
+def load_docx_content(docx_path: str) -> Tuple[List[Quest], Dict[str, DailyTask]]:
+    """Мейн-квесты и дейлики из одного docx за один проход."""
+    try:
+        return extract_docx(docx_path, _MainQuestExtractor(), _DailyTaskExtractor())
+    except Exception as exc:
+        print(f"Не удалось прочитать docx: {exc}")
+        return [], {}
+
+
+def load_main_quests_from_docx(docx_path: str) -> List[Quest]:
+    """
+    Парсит docx и достаёт мейн-квесты вида:
+    '1.1 Название → Rare ×1 + 3 coin'
+    Возвращает список с последовательной нумерацией для БД и оригинальным кодом.
+    """
+    try:
+        (quests,) = extract_docx(docx_path, _MainQuestExtractor())
+    except Exception as exc:
+        print(f"Не удалось прочитать docx для квестов: {exc}")
+        return []
+    return quests
+
+
+def load_daily_tasks_from_docx(docx_path: str) -> Dict[str, DailyTask]:
+    """Читает docx и собирает категории 6.1–6.4 с монетами 1/2/3/5."""
+    try:
+        (tasks,) = extract_docx(docx_path, _DailyTaskExtractor())
+    except Exception as exc:
+        print(f"Не удалось прочитать docx для дейликов: {exc}")
+        return {}
     return tasks
 
 
-def build_daily_tasks_from_raw() -> Dict[str, Dict]:
+def build_daily_tasks_from_raw() -> Dict[str, DailyTask]:
     tasks = {}
     for theme, costs in RAW_DAILIES.items():
         for cost_key, items in costs.items():
             coins = COST_CATEGORIES.get(cost_key, 1)
             for i, title in enumerate(items, start=1):
                 code = f"{theme}_{cost_key}_{i}"
-                tasks[code] = {
-                    "title": title,
-                    "coins": coins,
-                    "category": theme,
-                    "cost_key": cost_key,
-                }
+                tasks[code] = DailyTask(code=code, title=title, coins=coins, category=theme, cost_key=cost_key)
     return tasks
 
 
-def _quest_level(q: Dict) -> int:
-    code = q.get("code", "")
-    if isinstance(code, str) and "." in code:
+def _quest_level(q: Quest) -> int:
+    code = q.code
+    if "." in code:
         try:
             return int(code.split(".", 1)[0])
         except ValueError:
@@ -1604,20 +3062,21 @@ def _quest_level(q: Dict) -> int:
     return 0
 
 
-def _quest_by_code(code: str) -> Dict:
-    return next((q for q in MAIN_QUESTS if q.get("code") == code), None)
+def _quest_by_code(code: str) -> Optional[Quest]:
+    return active_catalog().quests_by_code.get(code)
 
 
 def _prev_levels_done(uid: int, lvl: int) -> bool:
-    for q in MAIN_QUESTS:
-        if _quest_level(q) < lvl and get_main_status(uid, q["index"]) != "done":
+    statuses = get_main_statuses(uid)
+    for q in active_catalog().main_quests:
+        if _quest_level(q) < lvl and statuses.get(q.index) != "done":
             return False
     return True
 
 
 def _is_level_open(uid: int, lvl: int, today: date = None) -> bool:
     today = today or date.today()
-    schedule = LEVEL_SCHEDULE.get(lvl)
+    schedule = active_catalog().level_schedule.get(lvl)
     if schedule:
         start = schedule.get("start")
         if start and today < start:
@@ -1627,96 +3086,208 @@ def _is_level_open(uid: int, lvl: int, today: date = None) -> bool:
     return True
 
 
-def _quest_dependency_met(uid: int, quest: Dict) -> bool:
-    code = quest.get("code")
+def _quest_dependency_met(uid: int, quest: Quest) -> bool:
+    code = quest.code
     if not code:
         return True
-    dep = QUEST_DEPENDENCIES.get(code)
+    dep = active_catalog().quest_dependencies.get(code)
     if not dep:
         return True
     prev = _quest_by_code(dep)
     if not prev:
         return True
-    return get_main_status(uid, prev["index"]) == "done"
+    return get_main_status(uid, prev.index) == "done"
 
 
 def _ensure_unlocks(uid: int):
     """Активирует все квесты, у которых выполнены зависимости и уровень открыт."""
     today = date.today()
-    for q in MAIN_QUESTS:
+    for q in active_catalog().main_quests:
         lvl = _quest_level(q)
         if not _is_level_open(uid, lvl, today=today):
             continue
-        status = get_main_status(uid, q["index"])
+        status = get_main_status(uid, q.index)
         if status == "locked" and _quest_dependency_met(uid, q):
-            set_main_status(uid, q["index"], "active")
+            set_main_status(uid, q.index, "active")
+
+
+LEVEL_MARKS = {"done": "✓", "active": "•"}
+
+
+class LevelPage:
+    """
+    Скелет экрана уровня для одного каталога: заголовок, группы, строка финала
+    и кнопки. На запрос подставляются только отметки статусов.
+    """
+
+    __slots__ = ("parts", "markup")
+
+    def __init__(self, catalog: "Catalog", lvl: int):
+        # str — готовая строка; tuple — (индекс квеста, индекс зависимости, хвост строки)
+        parts: List = [catalog.level_labels.get(lvl, f"Уровень {lvl}")]
+        meta = catalog.level_meta.get(lvl, {})
+        date_range = meta.get("dates", "")
+        if date_range:
+            parts.append(f"⏳ {date_range}")
+        if meta.get("final_coins") or meta.get("final_cards"):
+            rewards_txt = []
+            coins = meta.get("final_coins", 0)
+            if coins:
+                rewards_txt.append(f"+{coins} coin")
+            for r in meta.get("final_cards", []):
+                rewards_txt.append(REWARD_CARDS.get(r, REWARD_CARDS['common'])['label'])
+            parts.append("🎯 Финал: " + " + ".join(rewards_txt))
+        parts.append("")
+        kb = []
+        listed_ids = set()
+
+        def add_q(q: Quest):
+            dep_index = None
+            dep = catalog.quest_dependencies.get(q.code) if q.code else None
+            prev = catalog.quests_by_code.get(dep) if dep else None
+            if prev:
+                dep_index = prev.index
+            label = q.code or str(q.index)
+            parts.append((q.index, dep_index, f" {label}. {q.title}"))
+            kb.append(
+                [InlineKeyboardButton(text=f"Открыть {label}", callback_data=f"quest:{q.index}")]
+            )
+            listed_ids.add(q.index)
+
+        groups = catalog.level_groups.get(lvl)
+        if groups:
+            for name, codes in groups:
+                parts.append(f"<b>{name}</b>")
+                for code in codes:
+                    q = catalog.quests_by_code.get(code)
+                    if q:
+                        add_q(q)
+                parts.append("")
+        # Остальные квесты, если есть
+        for q in catalog.quests_by_level.get(lvl, []):
+            if q.index not in listed_ids:
+                add_q(q)
+
+        kb.append([InlineKeyboardButton(text="⬅ К карте", callback_data="menu:map")])
+        self.parts = tuple(parts)
+        self.markup = InlineKeyboardMarkup(inline_keyboard=kb)
+
+    def render(self, statuses: Dict[int, str]) -> str:
+        lines = []
+        for part in self.parts:
+            if part.__class__ is str:
+                lines.append(part)
+                continue
+            index, dep_index, tail = part
+            status = statuses.get(index, "locked")
+            if status != "done" and dep_index is not None and statuses.get(dep_index) != "done":
+                status = "locked"
+            lines.append(LEVEL_MARKS.get(status, "✗") + tail)
+        return "\n".join(lines)
 
 
 def _grant_level_final(uid: int, lvl: int):
-    meta = LEVEL_META.get(lvl)
+    catalog = active_catalog()
+    meta = catalog.level_meta.get(lvl)
     if not meta:
         return
-    quests = [q for q in MAIN_QUESTS if _quest_level(q) == lvl]
+    quests = catalog.quests_by_level.get(lvl, [])
     if not quests:
         return
-    if not all(get_main_status(uid, q["index"]) == "done" for q in quests):
-        return
-
-    # Проверим, выдавали ли финал ранее (по записи в rewards)
-    final_marker = f"ФИНАЛ {lvl}"
-    existing = [r for r in get_active_rewards(uid) if final_marker in r[1]]
-    if existing:
+    if not all(get_main_status(uid, q.index) == "done" for q in quests):
         return
 
+    # Отметка в level_finals, монеты и карты — одна транзакция:
+    # уникальный ключ (user_id, campaign, level) не даст выдать финал дважды.
     coins = meta.get("final_coins", 0)
-    if coins:
-        update_coins(uid, coins)
-    for rarity in meta.get("final_cards", []):
-        card_cfg = REWARD_CARDS.get(rarity, REWARD_CARDS["common"])
-        add_reward(uid, f"{final_marker}: {card_cfg['label']}", 0)
+    conn = get_conn()
+    try:
+        c = conn.cursor()
+        c.execute(
+            "INSERT OR IGNORE INTO level_finals(user_id, campaign, level, granted_at) VALUES(?,?,?,?)",
+            (uid, get_user_campaign(uid), lvl, datetime.utcnow().isoformat()),
+        )
+        if c.rowcount == 0:
+            return
+        if coins:
+            _apply_coins(c, uid, coins, "level_final", f"level:{lvl}")
+        for rarity in meta.get("final_cards", []):
+            card_cfg = REWARD_CARDS.get(rarity, REWARD_CARDS["common"])
+            _insert_reward(c, uid, f"ФИНАЛ {lvl}: {card_cfg['label']}", 0)
+        conn.commit()
+    finally:
+        conn.close()
+    PROFILE_CACHE.forget_coins(uid)
 
     print(f"Выдан финал уровня {lvl} пользователю {uid}: +{coins} монет, карты {meta.get('final_cards')}")
 
 
 def reset_user_progress(uid: int):
+    # Сначала допишем отложенные отметки, иначе они воскресят прогресс после удаления.
+    DAILY_JOURNAL.flush()
     conn = get_conn()
-    c = conn.cursor()
-    for table in ("users", "rewards", "main_progress", "daily_tasks"):
-        c.execute(f"DELETE FROM {table} WHERE user_id = ?", (uid,))
-    conn.commit()
-    conn.close()
+    try:
+        c = conn.cursor()
+        # Журнал монет не переписывается: обнуление баланса — такая же запись.
+        c.execute("SELECT coins FROM users WHERE user_id = ?", (uid,))
+        row = c.fetchone()
+        if row and row[0]:
+            _apply_coins(c, uid, -row[0], "reset")
+        for table in (
+            "users",
+            "rewards",
+            "reward_stacks",
+            "rewards_archive",
+            "main_progress",
+            "daily_tasks",
+            "daily_summary",
+            "level_finals",
+            "user_tokens",
+            "battle_pass",
+        ):
+            c.execute(f"DELETE FROM {table} WHERE user_id = ?", (uid,))
+        conn.commit()
+    finally:
+        conn.close()
+    PROFILE_CACHE.forget(uid)
     coins = get_or_create_user(uid)
     _ensure_unlocks(uid)
     return coins
 
 
 def level_progress(uid: int) -> str:
-    levels = {}
-    for q in MAIN_QUESTS:
-        lvl = _quest_level(q)
-        levels.setdefault(lvl, []).append(q)
+    catalog = active_catalog()
+    levels = catalog.quests_by_level
     current_lvl = None
     for lvl in sorted(levels):
-        if not all(get_main_status(uid, q["index"]) == "done" for q in levels[lvl]):
+        if not all(get_main_status(uid, q.index) == "done" for q in levels[lvl]):
             current_lvl = lvl
             break
     if current_lvl is None:
         current_lvl = max(levels) if levels else 0
     quests = levels.get(current_lvl, [])
-    done = sum(1 for q in quests if get_main_status(uid, q["index"]) == "done")
+    done = sum(1 for q in quests if get_main_status(uid, q.index) == "done")
     total = len(quests)
-    title = LEVEL_LABELS.get(current_lvl, f"Уровень {current_lvl}")
+    title = catalog.level_labels.get(current_lvl, f"Уровень {current_lvl}")
     return f"{title}: {done}/{total} квестов"
 
 
+def tasks_docx_path() -> Optional[str]:
+    return next((p for p in TASKS_DOCX_CANDIDATES if p and os.path.exists(p)), None)
+
+
 def refresh_tasks_from_docx():
-    """Обновляет MAIN_QUESTS и DAILY_TASKS из docx, иначе оставляет дефолты."""
+    """
+    Обновляет MAIN_QUESTS и DAILY_TASKS. Квесты берутся из docx (иначе дефолты),
+    дейлики — встроенные RAW плюс разделы 6.x из того же docx (категория «docx»).
+    """
     global MAIN_QUESTS, DAILY_TASKS
-    docx_path = next((p for p in TASKS_DOCX_CANDIDATES if p and os.path.exists(p)), None)
+    docx_dailies: Dict[str, DailyTask] = {}
+    docx_path = tasks_docx_path()
     if not docx_path:
         print("Docx с квестами/дейликами не найден, используются дефолты")
     else:
-        main_quests = load_main_quests_from_docx(docx_path)
+        main_quests, docx_dailies = load_docx_content(docx_path)
         if main_quests:
             MAIN_QUESTS = main_quests
             print(f"Мейн-квесты загружены из {docx_path}: {len(MAIN_QUESTS)} шт.")
@@ -1724,13 +3295,15 @@ def refresh_tasks_from_docx():
             print("Не удалось загрузить мейн-квесты из docx, дефолтные.")
 
     DAILY_TASKS = build_daily_tasks_from_raw()
-    print(f"Дейлики загружены из RAW: {len(DAILY_TASKS)} шт.")
+    DAILY_TASKS.update(docx_dailies)
+    print(f"Дейлики загружены: RAW {len(DAILY_TASKS) - len(docx_dailies)} шт., из docx {len(docx_dailies)} шт.")
+    invalidate_catalogs()
 
 
 # ================== МАГАЗИН НАГРАД ==================
 
 
-def _normalize_shop_reward(raw: Dict, idx: int) -> Optional[Dict]:
+def _normalize_shop_reward(raw: Dict, idx: int) -> Optional[ShopItem]:
     try:
         price = int(raw.get("price", 0))
     except (TypeError, ValueError):
@@ -1739,17 +3312,17 @@ def _normalize_shop_reward(raw: Dict, idx: int) -> Optional[Dict]:
     reward_id = str(raw.get("id") or idx + 1).replace(":", "_")
     name = str(raw.get("name") or f"Награда {idx + 1}")
     category = str(raw.get("category") or "other")
-    return {
-        "id": reward_id,
-        "name": name,
-        "emoji": raw.get("emoji", ""),
-        "category": category,
-        "price": price,
-        "description": str(raw.get("description") or ""),
-    }
+    return ShopItem(
+        id=reward_id,
+        name=name,
+        emoji=str(raw.get("emoji") or ""),
+        category=category,
+        price=price,
+        description=str(raw.get("description") or ""),
+    )
 
 
-def load_shop_rewards(path: str) -> List[Dict]:
+def load_shop_rewards(path: str) -> List[ShopItem]:
     if not os.path.exists(path):
         return []
     try:
@@ -1763,7 +3336,7 @@ def load_shop_rewards(path: str) -> List[Dict]:
         print(f"Файл {path} должен содержать список наград")
         return []
 
-    normalized: List[Dict] = []
+    normalized: List[ShopItem] = []
     for idx, raw in enumerate(data):
         if not isinstance(raw, dict):
             continue
@@ -1784,77 +3357,953 @@ def refresh_shop_rewards():
     else:
         SHOP_REWARDS = list(DEFAULT_SHOP_REWARDS)
         print("Используются дефолтные награды магазина")
+    invalidate_catalogs()
+    SHOP_PAGE_CACHE.clear()
 
 
 def get_shop_filters(uid: int) -> Dict:
-    return SHOP_FILTERS.setdefault(uid, {"category": "all", "price": "all"})
+    return SESSIONS.get(uid, "shop_filters") or {"category": "all", "price": "all"}
+
+
+def set_shop_filter(uid: int, key: str, value: str):
+    filters = dict(get_shop_filters(uid))
+    filters[key] = value
+    SESSIONS.set(uid, "shop_filters", filters)
+
+
+def reset_shop_filters(uid: int):
+    SESSIONS.set(uid, "shop_filters", {"category": "all", "price": "all"})
+
+
+def shop_price_options() -> List[int]:
+    prices = sorted({r.price for r in active_catalog().shop_rewards})
+    if not prices:
+        return []
+    options = [p for p in SHOP_PRICE_PRESETS if prices[0] <= p <= prices[-1]]
+    if not options:
+        options = prices[:6]
+    return options[:6]
+
+
+def shop_price_label(uid: int) -> str:
+    filters = get_shop_filters(uid)
+    pf = filters.get("price", "all")
+    if pf == "all":
+        return "все цены"
+    if pf == "balance":
+        return "по балансу"
+    if isinstance(pf, str) and pf.startswith("max:"):
+        try:
+            val = int(pf.split(":", 1)[1])
+            return f"до {val}"
+        except ValueError:
+            return "все цены"
+    return "все цены"
+
+
+def shop_max_price(price_filter: str, coins: int) -> Optional[int]:
+    """Потолок цены для фильтра; для «по балансу» — текущие монеты."""
+    if price_filter == "balance":
+        return coins
+    if isinstance(price_filter, str) and price_filter.startswith("max:"):
+        try:
+            return int(price_filter.split(":", 1)[1])
+        except ValueError:
+            return None
+    return None
+
+
+def shop_items_for(category: str, max_price: Optional[int]) -> List[ShopItem]:
+    items = list(active_catalog().shop_rewards)
+    if category != "all":
+        items = [i for i in items if i.category == category]
+    if max_price is not None:
+        items = [i for i in items if i.price <= max_price]
+    items.sort(key=lambda i: (i.price, i.name))
+    return items
+
+
+def filtered_shop_rewards(uid: int) -> List[ShopItem]:
+    filters = get_shop_filters(uid)
+    price_filter = filters.get("price", "all")
+    coins = get_coins(uid) if price_filter == "balance" else 0
+    return shop_items_for(filters.get("category", "all"), shop_max_price(price_filter, coins))
+
+
+def shop_categories() -> List[str]:
+    return sorted({i.category for i in active_catalog().shop_rewards})
+
+
+def get_shop_reward(item_id: str) -> Optional[ShopItem]:
+    return active_catalog().shop_by_id.get(str(item_id))
+
+
+# ================== КОНТЕНТ: БАНДЛ И КОМПИЛЯЦИЯ ==================
+
+CONTENT_ARTIFACT = os.getenv("CONTENT_ARTIFACT", "data/content.bin")
+CONTENT_MAGIC = b"RLVC"
+CONTENT_FORMAT = 3
+# JSON-секция с отпечатками исходников, из которых собран артефакт.
+CONTENT_SOURCES_KEY = "_sources"
+CONTENT_ALIGN = 8
+# Заголовок: magic, версия формата, число секций; затем таблица секций.
+_CONTENT_HEADER = struct.Struct("<4sHH")
+_CONTENT_SECTION = struct.Struct("<24sQQ")  # имя, смещение, длина
+
+
+def content_from_globals() -> Dict:
+    """Текущий контент по умолчанию в каноническом (JSON-совместимом) виде бандла."""
+    return {
+        "main_quests": [q.to_dict() for q in MAIN_QUESTS],
+        "daily_tasks": {
+            code: {k: v for k, v in task.to_dict().items() if k != "code"} for code, task in DAILY_TASKS.items()
+        },
+        "shop_rewards": [item.to_dict() for item in SHOP_REWARDS or DEFAULT_SHOP_REWARDS],
+        "reward_table": {
+            str(lvl): [[e.threshold, e.name] for e in entries] for lvl, entries in REWARD_TABLE.items()
+        },
+        "level_labels": {str(lvl): label for lvl, label in LEVEL_LABELS.items()},
+        "level_meta": {str(lvl): meta for lvl, meta in LEVEL_META.items()},
+        "level_schedule": {
+            str(lvl): {k: v.isoformat() if v else None for k, v in sched.items()}
+            for lvl, sched in LEVEL_SCHEDULE.items()
+        },
+        "level_groups": {
+            str(lvl): [[title, list(codes)] for title, codes in groups]
+            for lvl, groups in LEVEL_GROUPS.items()
+        },
+        "quest_dependencies": QUEST_DEPENDENCIES,
+    }
+
+
+def apply_content(content: Dict):
+    """Подменяет контент по умолчанию содержимым бандла и пересобирает каталоги."""
+    global MAIN_QUESTS, DAILY_TASKS, SHOP_REWARDS, REWARD_TABLE
+    global LEVEL_LABELS, LEVEL_META, LEVEL_SCHEDULE, LEVEL_GROUPS, QUEST_DEPENDENCIES
+    MAIN_QUESTS = [Quest.from_dict(q) for q in content["main_quests"]]
+    DAILY_TASKS = content["daily_tasks"]
+    SHOP_REWARDS = content["shop_rewards"]
+    REWARD_TABLE = {
+        int(lvl): [LootEntry(threshold=int(t), name=name) for t, name in entries]
+        for lvl, entries in content["reward_table"].items()
+    }
+    levels = parse_level_structure(content)
+    LEVEL_LABELS = levels["level_labels"]
+    LEVEL_META = levels["level_meta"]
+    LEVEL_SCHEDULE = levels["level_schedule"]
+    LEVEL_GROUPS = levels["level_groups"]
+    QUEST_DEPENDENCIES = levels["quest_dependencies"]
+    invalidate_catalogs()
+
+
+LEVEL_STRUCTURE_KEYS = (
+    "level_labels",
+    "level_meta",
+    "level_schedule",
+    "level_groups",
+    "quest_dependencies",
+)
+
+
+def default_level_structure() -> Dict:
+    return {
+        "level_labels": LEVEL_LABELS,
+        "level_meta": LEVEL_META,
+        "level_schedule": LEVEL_SCHEDULE,
+        "level_groups": LEVEL_GROUPS,
+        "quest_dependencies": QUEST_DEPENDENCIES,
+    }
+
+
+def parse_level_structure(content: Dict) -> Dict:
+    """Структура уровней из JSON-вида бандла (ключи уровней — строки) во внутренний."""
+    return {
+        "level_labels": {int(lvl): label for lvl, label in content["level_labels"].items()},
+        "level_meta": {int(lvl): meta for lvl, meta in content["level_meta"].items()},
+        "level_schedule": {
+            int(lvl): {k: date.fromisoformat(v) if v else None for k, v in sched.items()}
+            for lvl, sched in content["level_schedule"].items()
+        },
+        "level_groups": {
+            int(lvl): [(title, list(codes)) for title, codes in groups]
+            for lvl, groups in content["level_groups"].items()
+        },
+        "quest_dependencies": dict(content["quest_dependencies"]),
+    }
+
+
+def restrict_level_structure(levels: Dict, quests: List[Quest]) -> Dict:
+    """
+    Оставляет от структуры только то, что относится к квестам кампании:
+    группы и зависимости без чужих кодов, подписи и расписание — только её уровней.
+    """
+    codes = {q.code for q in quests if q.code}
+    present = {_quest_level(q) for q in quests}
+    groups = {}
+    for lvl, lvl_groups in levels["level_groups"].items():
+        kept = [(title, [c for c in group if c in codes]) for title, group in lvl_groups]
+        kept = [(title, group) for title, group in kept if group]
+        if kept:
+            groups[lvl] = kept
+    return {
+        "level_labels": {l: v for l, v in levels["level_labels"].items() if l in present},
+        "level_meta": {l: v for l, v in levels["level_meta"].items() if l in present},
+        "level_schedule": {l: v for l, v in levels["level_schedule"].items() if l in present},
+        "level_groups": groups,
+        "quest_dependencies": {
+            code: required
+            for code, required in levels["quest_dependencies"].items()
+            if code in codes and required in codes
+        },
+    }
+
+
+def validate_level_structure(content: Dict, codes: set) -> List[str]:
+    """Перекрёстные ссылки структуры уровней (JSON-вид) на коды квестов."""
+    errors: List[str] = []
+    for code, required in content["quest_dependencies"].items():
+        for ref in (code, required):
+            if ref not in codes:
+                errors.append(f"QUEST_DEPENDENCIES {code} -> {required}: нет квеста {ref}")
+
+    for lvl, groups in content["level_groups"].items():
+        for title, group_codes in groups:
+            for code in group_codes:
+                if code not in codes:
+                    errors.append(f"LEVEL_GROUPS[{lvl}] «{title}»: нет квеста {code}")
+                elif code.split(".", 1)[0] != str(lvl):
+                    errors.append(f"LEVEL_GROUPS[{lvl}] «{title}»: квест {code} из другого уровня")
+
+    for lvl, meta in content["level_meta"].items():
+        for card in meta.get("final_cards", []):
+            if card not in REWARD_CARDS:
+                errors.append(f"LEVEL_META[{lvl}]: неизвестная карта {card!r}")
+    for lvl, sched in content["level_schedule"].items():
+        if sched.get("start") and sched.get("end") and sched["start"] > sched["end"]:
+            errors.append(f"LEVEL_SCHEDULE[{lvl}]: начало позже конца")
+    return errors
+
+
+# Разделы бандла и их JSON-типы: без них проверять перекрёстные ссылки нечего.
+CONTENT_KEYS = {
+    "main_quests": list,
+    "daily_tasks": dict,
+    "shop_rewards": list,
+    "reward_table": dict,
+    **{key: dict for key in LEVEL_STRUCTURE_KEYS},
+}
+
+
+def validate_content(content: Dict) -> List[str]:
+    """Проверяет бандл, в том числе перекрёстные ссылки. Возвращает список ошибок."""
+    missing = [key for key in CONTENT_KEYS if not isinstance(content.get(key), CONTENT_KEYS[key])]
+    if missing:
+        return [f"нет раздела {key} или у него неверный тип" for key in missing]
+    errors: List[str] = []
+    codes = set()
+    indexes = set()
+    for q in content["main_quests"]:
+        label = f"квест {q.get('code') or q.get('index')}"
+        if q.get("index") in indexes:
+            errors.append(f"{label}: повторный index {q.get('index')}")
+        indexes.add(q.get("index"))
+        if q.get("code"):
+            if q["code"] in codes:
+                errors.append(f"{label}: повторный код")
+            codes.add(q["code"])
+        if not q.get("title"):
+            errors.append(f"{label}: пустое название")
+        if not isinstance(q.get("reward_coins"), int) or q["reward_coins"] < 0:
+            errors.append(f"{label}: некорректные монеты {q.get('reward_coins')!r}")
+        if q.get("reward_card") not in REWARD_CARDS:
+            errors.append(f"{label}: неизвестная карта {q.get('reward_card')!r}")
+
+    errors += validate_level_structure(content, codes)
+
+    for lvl in LOOTBOXES:
+        entries = content["reward_table"].get(str(lvl)) or []
+        if not entries:
+            errors.append(f"лутбокс {lvl}: пустая таблица наград")
+            continue
+        thresholds = [t for t, _ in entries]
+        if any(b <= a for a, b in zip(thresholds, thresholds[1:])):
+            errors.append(f"лутбокс {lvl}: пороги d100 не возрастают")
+        if thresholds[-1] != 100:
+            errors.append(f"лутбокс {lvl}: таблица не покрывает d100 (последний порог {thresholds[-1]})")
+
+    shop_ids = set()
+    for item in content["shop_rewards"]:
+        if item.get("id") in shop_ids:
+            errors.append(f"магазин: повторный id {item.get('id')}")
+        shop_ids.add(item.get("id"))
+        if not isinstance(item.get("price"), int) or item["price"] < 0:
+            errors.append(f"магазин {item.get('id')}: некорректная цена {item.get('price')!r}")
+
+    for code, task in content["daily_tasks"].items():
+        if not task.get("title"):
+            errors.append(f"дейлик {code}: пустое название")
+        if not isinstance(task.get("coins"), int) or task["coins"] <= 0:
+            errors.append(f"дейлик {code}: некорректные монеты {task.get('coins')!r}")
+    return errors
+
+
+# ---------- Таблицы магазина и дейликов в артефакте ----------
+
+
+class MappedTable:
+    """
+    Неизменяемая таблица записей поверх отображённого в память артефакта:
+    строки фиксированной ширины (смещение+длина в таблицу строк, целые поля),
+    общая таблица строк и индекс номеров строк, отсортированный по ключу.
+    Страницы файла делятся между всеми процессами через page cache ОС,
+    запись собирается только при обращении.
+    """
+
+    record_cls = _Record
+    str_fields: Tuple[str, ...] = ()
+    int_fields: Tuple[str, ...] = ()
+
+    def __init__(self, rows: memoryview, strings: memoryview, index: memoryview):
+        self._row = struct.Struct("<" + "II" * len(self.str_fields) + "i" * len(self.int_fields))
+        self._rows = rows
+        self._strings = strings
+        self._index = index.cast("I")
+        self._len = len(rows) // self._row.size
+
+    @classmethod
+    def pack(cls, records: List[Dict]) -> Tuple[bytes, bytes, bytes]:
+        """Собирает (строки, таблица строк, индекс) для секций артефакта."""
+        row = struct.Struct("<" + "II" * len(cls.str_fields) + "i" * len(cls.int_fields))
+        strings = bytearray()
+        offsets: Dict[str, Tuple[int, int]] = {}
+        rows = bytearray()
+        for record in records:
+            values = []
+            for field in cls.str_fields:
+                text = str(record.get(field) or "")
+                if text not in offsets:
+                    data = text.encode("utf-8")
+                    offsets[text] = (len(strings), len(data))
+                    strings += data
+                values.extend(offsets[text])
+            values.extend(int(record.get(field) or 0) for field in cls.int_fields)
+            rows += row.pack(*values)
+        key = cls.str_fields[0]
+        order = sorted(range(len(records)), key=lambda i: str(records[i].get(key) or ""))
+        return bytes(rows), bytes(strings), struct.pack(f"<{len(order)}I", *order)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def _text(self, values, field_idx: int) -> str:
+        start, length = values[2 * field_idx], values[2 * field_idx + 1]
+        return str(self._strings[start:start + length], "utf-8")
+
+    def _key(self, row_idx: int) -> str:
+        values = self._row.unpack_from(self._rows, row_idx * self._row.size)
+        return self._text(values, 0)
+
+    def record(self, row_idx: int):
+        values = self._row.unpack_from(self._rows, row_idx * self._row.size)
+        fields = {field: self._text(values, i) for i, field in enumerate(self.str_fields)}
+        base = 2 * len(self.str_fields)
+        for i, field in enumerate(self.int_fields):
+            fields[field] = values[base + i]
+        return self.record_cls(**fields)
+
+    def records(self):
+        for row_idx in range(self._len):
+            yield self.record(row_idx)
+
+    def find(self, key: str):
+        """Двоичный поиск по ключу (первое строковое поле)."""
+        lo, hi = 0, self._len
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(self._index[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._len and self._key(self._index[lo]) == key:
+            return self.record(self._index[lo])
+        return None
+
+
+class MappedShop(MappedTable):
+    """Награды магазина: ведёт себя как список, by_id — поиск по id."""
+
+    record_cls = ShopItem
+    str_fields = ("id", "name", "emoji", "category", "description")
+    int_fields = ("price",)
+
+    def __iter__(self):
+        return self.records()
+
+    def __getitem__(self, row_idx: int):
+        return self.record(row_idx)
+
+    @property
+    def by_id(self) -> "MappedShop":
+        return self
+
+    def get(self, item_id: str, default=None):
+        found = self.find(item_id)
+        return default if found is None else found
+
+
+class MappedDailyTasks(MappedTable):
+    """Дейлики: ведёт себя как словарь код -> запись в порядке исходного документа."""
+
+    record_cls = DailyTask
+    str_fields = ("code", "title", "category", "cost_key")
+    int_fields = ("coins",)
+
+    def __getitem__(self, code: str):
+        found = self.find(code)
+        if found is None:
+            raise KeyError(code)
+        return found
+
+    def __contains__(self, code: str) -> bool:
+        return self.find(code) is not None
+
+    def get(self, code: str, default=None):
+        found = self.find(code)
+        return default if found is None else found
+
+    def __iter__(self):
+        return (self._key(i) for i in range(self._len))
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        return self.records()
+
+    def items(self):
+        return ((rec.code, rec) for rec in self.records())
+
+
+# Ключ бандла -> класс таблицы; остальные ключи хранятся JSON-секциями.
+CONTENT_TABLES = {"shop_rewards": MappedShop, "daily_tasks": MappedDailyTasks}
+
+
+def write_content_artifact(
+    content: Dict, path: str = CONTENT_ARTIFACT, sources: Optional[Dict] = None
+):
+    """
+    Пишет артефакт: заголовок, таблица секций (имя, смещение, длина) и секции.
+    Магазин и дейлики лежат таблицами (.rows/.strings/.index), остальное — JSON.
+    Смещения абсолютные и выровнены — файл отображается в память и читается срезами.
+    sources — отпечатки исходников (секция _sources), по ним видно, что артефакт устарел.
+    """
+    payloads = []
+    if sources is not None:
+        content = dict(content, **{CONTENT_SOURCES_KEY: sources})
+    for name, value in content.items():
+        table = CONTENT_TABLES.get(name)
+        if table is None:
+            data = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            payloads.append((name.encode("utf-8"), data))
+            continue
+        records = [dict(task, code=code) for code, task in value.items()] if isinstance(value, dict) else value
+        for suffix, data in zip((".rows", ".strings", ".index"), table.pack(records)):
+            payloads.append(((name + suffix).encode("utf-8"), data))
+    offset = _CONTENT_HEADER.size + _CONTENT_SECTION.size * len(payloads)
+    table = []
+    for name, data in payloads:
+        offset += -offset % CONTENT_ALIGN
+        table.append(_CONTENT_SECTION.pack(name, offset, len(data)))
+        offset += len(data)
+
+    tmp_path = path + ".part"
+    with open(tmp_path, "wb") as f:
+        f.write(_CONTENT_HEADER.pack(CONTENT_MAGIC, CONTENT_FORMAT, len(payloads)))
+        f.write(b"".join(table))
+        for name, data in payloads:
+            f.write(b"\0" * (-f.tell() % CONTENT_ALIGN))
+            f.write(data)
+    os.replace(tmp_path, path)
+
+
+def content_sections(buf) -> Dict[str, Tuple[int, int]]:
+    """Таблица секций артефакта: имя -> (смещение, длина)."""
+    magic, version, count = _CONTENT_HEADER.unpack_from(buf, 0)
+    if magic != CONTENT_MAGIC or version != CONTENT_FORMAT:
+        raise ValueError("не артефакт контента или другая версия формата")
+    sections = {}
+    for i in range(count):
+        name, offset, length = _CONTENT_SECTION.unpack_from(buf, _CONTENT_HEADER.size + i * _CONTENT_SECTION.size)
+        sections[name.rstrip(b"\0").decode("utf-8")] = (offset, length)
+    return sections
+
+
+def read_content_artifact(path: str = CONTENT_ARTIFACT) -> Dict:
+    """
+    Отображает артефакт в память: JSON-секции разбираются сразу,
+    магазин и дейлики остаются таблицами поверх общих страниц файла.
+    """
+    with open(path, "rb") as f:
+        buf = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    sections = {
+        name: buf[offset:offset + length] for name, (offset, length) in content_sections(buf).items()
+    }
+    content = {}
+    for name, table in CONTENT_TABLES.items():
+        parts = [sections.pop(name + suffix) for suffix in (".rows", ".strings", ".index")]
+        content[name] = table(*parts)
+    for name, data in sections.items():
+        content[name] = json.loads(bytes(data))
+    return content
+
+
+def content_source_digests() -> Dict[str, Optional[str]]:
+    """Отпечатки исходников контента по умолчанию: вид -> sha1 (None — файла нет)."""
+    paths = {
+        "lootbox": lootbox_xlsx_path(),
+        "shop": SHOP_REWARDS_FILE,
+        "docx": tasks_docx_path(),
+    }
+    return {kind: _file_digest(p) if p and os.path.exists(p) else None for kind, p in paths.items()}
+
+
+def stale_content_sources(recorded: Dict) -> List[str]:
+    """
+    Исходники, изменившиеся после сборки артефакта. Артефакт из бандла
+    от локальных исходников не зависит и устаревшим не считается.
+    """
+    if "bundle" in recorded:
+        return []
+    current = content_source_digests()
+    return [kind for kind, digest in current.items() if recorded.get(kind) != digest]
+
+
+def refresh_content():
+    """
+    Загружает контент по умолчанию: из скомпилированного артефакта, если он есть
+    и собран из тех же исходников, иначе — из исходников (xlsx, docx, json),
+    заодно пересобирая артефакт.
+    """
+    if CONTENT_ARTIFACT and os.path.exists(CONTENT_ARTIFACT):
+        try:
+            content = read_content_artifact(CONTENT_ARTIFACT)
+            stale = stale_content_sources(content.pop(CONTENT_SOURCES_KEY, {}))
+            if not stale:
+                apply_content(content)
+                print(f"Контент загружен из {CONTENT_ARTIFACT}")
+                return
+            print(f"{CONTENT_ARTIFACT} устарел (изменились: {', '.join(stale)}). Пересобираю.")
+            # Исходники читаются и при неудачной проверке: бот работает на них.
+            compile_content(out_path=CONTENT_ARTIFACT)
+            return
+        except Exception as exc:
+            print(f"Не удалось загрузить {CONTENT_ARTIFACT}: {exc}. Читаю исходники.")
+    refresh_reward_table()
+    refresh_shop_rewards()
+    refresh_tasks_from_docx()
+
+
+def compile_content(
+    bundle_path: Optional[str] = None,
+    out_path: str = CONTENT_ARTIFACT,
+    write_bundle: Optional[str] = None,
+) -> bool:
+    """
+    Собирает контент из бандла (JSON) или из исходников xlsx/docx/json,
+    проверяет его и пишет артефакт. При ошибках артефакт не трогается.
+    """
+    if bundle_path:
+        with open(bundle_path, "r", encoding="utf-8") as f:
+            content = json.load(f)
+        sources = {"bundle": _file_digest(bundle_path)}
+    else:
+        sources = content_source_digests()
+        refresh_reward_table()
+        refresh_shop_rewards()
+        refresh_tasks_from_docx()
+        content = content_from_globals()
+
+    errors = validate_content(content)
+    for error in errors:
+        print(f"Ошибка контента: {error}")
+    if errors:
+        return False
+
+    if write_bundle:
+        with open(write_bundle, "w", encoding="utf-8") as f:
+            json.dump(content, f, ensure_ascii=False, indent=2)
+        print(f"Бандл контента сохранён: {write_bundle}")
+    write_content_artifact(content, out_path, sources)
+    print(
+        f"Артефакт контента: {out_path} — квестов {len(content['main_quests'])}, "
+        f"дейликов {len(content['daily_tasks'])}, наград в магазине {len(content['shop_rewards'])}"
+    )
+    return True
+
+
+# ================== КАМПАНИИ ==================
+
+CAMPAIGNS_DIR = os.getenv("CAMPAIGNS_DIR", "campaigns")
+DEFAULT_CAMPAIGN = "default"
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "16"))
+
+
+class Catalog:
+    """
+    Скомпилированный контент одной кампании. Считается неизменяемым:
+    обновление источников собирает новый объект, а одинаковые части
+    (квесты, магазин, лут) разделяются между кампаниями по ссылке.
+    """
+
+    __slots__ = (
+        "name",
+        "version",
+        "main_quests",
+        "daily_tasks",
+        "shop_rewards",
+        "reward_table",
+        "level_labels",
+        "level_meta",
+        "level_schedule",
+        "level_groups",
+        "quest_dependencies",
+        "daily_themes",
+        "quests_by_code",
+        "quests_by_index",
+        "quests_by_level",
+        "shop_by_id",
+        "_callback_ids",
+        "_search_index",
+        "_level_pages",
+        "_shop_prices",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        version: str,
+        main_quests: List[Quest],
+        daily_tasks: Dict[str, DailyTask],
+        shop_rewards: List[ShopItem],
+        reward_table: Dict[int, List[LootEntry]],
+        levels: Optional[Dict] = None,
+    ):
+        self.name = name
+        self.version = version
+        self.main_quests = main_quests
+        self.daily_tasks = daily_tasks
+        self.shop_rewards = shop_rewards
+        self.reward_table = reward_table
+        levels = levels or default_level_structure()
+        self.level_labels = levels["level_labels"]
+        self.level_meta = levels["level_meta"]
+        self.level_schedule = levels["level_schedule"]
+        self.level_groups = levels["level_groups"]
+        self.quest_dependencies = levels["quest_dependencies"]
+
+        themes = list(dict.fromkeys(t.category for t in daily_tasks.values() if t.category))
+        self.daily_themes = themes or list(DAILY_THEMES)
+        self.quests_by_code = {q.code: q for q in main_quests if q.code}
+        self.quests_by_index = {q.index: q for q in main_quests}
+        self.quests_by_level: Dict[int, List[Quest]] = {}
+        for q in main_quests:
+            self.quests_by_level.setdefault(_quest_level(q), []).append(q)
+        if isinstance(shop_rewards, MappedShop):
+            self.shop_by_id = shop_rewards.by_id
+        else:
+            self.shop_by_id = {item.id: item for item in shop_rewards}
+        self._callback_ids: Dict[str, "CallbackIdTable"] = {}
+        self._search_index: Optional["CatalogSearchIndex"] = None
+        self._level_pages: Dict[int, LevelPage] = {}
+        self._shop_prices: Dict[str, List[int]] = {}
+
+    def shop_prices(self, category: str) -> List[int]:
+        """Отсортированные цены наград категории («all» — всех), строятся при первом обращении."""
+        prices = self._shop_prices.get(category)
+        if prices is None:
+            prices = self._shop_prices[category] = sorted(
+                item.price for item in self.shop_rewards if category == "all" or item.category == category
+            )
+        return prices
+
+    def callback_ids(self, kind: str) -> "CallbackIdTable":
+        """Таблица коротких id для callback_data, строится при первом обращении."""
+        table = self._callback_ids.get(kind)
+        if table is None:
+            values, fallback = CALLBACK_ID_SOURCES[kind]
+            table = self._callback_ids[kind] = CallbackIdTable(values(self), fallback)
+        return table
+
+    def search_index(self) -> "CatalogSearchIndex":
+        if self._search_index is None:
+            self._search_index = CatalogSearchIndex(self)
+        return self._search_index
+
+    def level_page(self, lvl: int) -> LevelPage:
+        page = self._level_pages.get(lvl)
+        if page is None:
+            page = self._level_pages[lvl] = LevelPage(self, lvl)
+        return page
+
+
+_DEFAULT_CATALOG: Optional[Catalog] = None
+_CATALOG_GENERATION = 0
+# кампания -> каталог (LRU, дефолтный не вытесняется)
+_CATALOGS: "OrderedDict[str, Catalog]" = OrderedDict()
+# отпечаток источников -> каталог: кампании с одинаковыми файлами делят один объект
+_CATALOGS_BY_FINGERPRINT: Dict[Tuple, Catalog] = {}
+# (вид, sha1 файла) -> разобранная часть каталога
+_CATALOG_PARTS: Dict[Tuple[str, str], object] = {}
+CURRENT_CATALOG: ContextVar[Optional[Catalog]] = ContextVar("current_catalog", default=None)
+
+
+def invalidate_catalogs():
+    """Сбрасывает собранные каталоги после обновления источников по умолчанию."""
+    global _DEFAULT_CATALOG, _CATALOG_GENERATION
+    _CATALOG_GENERATION += 1
+    _DEFAULT_CATALOG = None
+    _CATALOGS.clear()
+    _CATALOGS_BY_FINGERPRINT.clear()
+    _CATALOG_PARTS.clear()
+
+
+def default_catalog() -> Catalog:
+    global _DEFAULT_CATALOG
+    if _DEFAULT_CATALOG is None:
+        _DEFAULT_CATALOG = Catalog(
+            DEFAULT_CAMPAIGN,
+            f"{DEFAULT_CAMPAIGN}.{_CATALOG_GENERATION}",
+            MAIN_QUESTS,
+            DAILY_TASKS,
+            SHOP_REWARDS or list(DEFAULT_SHOP_REWARDS),
+            REWARD_TABLE,
+        )
+    return _DEFAULT_CATALOG
+
+
+def active_catalog() -> Catalog:
+    """Каталог кампании текущего апдейта (или дефолтный вне обработчиков)."""
+    return CURRENT_CATALOG.get() or default_catalog()
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _find_campaign_file(
+    folder: str, suffix: str, preferred: str, skip: Tuple[str, ...] = ()
+) -> Optional[str]:
+    path = os.path.join(folder, preferred)
+    if os.path.exists(path):
+        return path
+    found = sorted(
+        n for n in os.listdir(folder) if n.lower().endswith(suffix) and n.lower() not in skip
+    )
+    return os.path.join(folder, found[0]) if found else None
+
+
+def _catalog_part(kind: str, path: Optional[str], digest: Optional[str], loader, fallback):
+    """Разбирает файл один раз на все кампании; без файла — часть из дефолта."""
+    if not path:
+        return fallback
+    key = (kind, digest)
+    if key not in _CATALOG_PARTS:
+        _CATALOG_PARTS[key] = loader(path) or fallback
+    return _CATALOG_PARTS[key]
+
+
+def _campaign_docx_parts(
+    path: Optional[str], digest: Optional[str], base: Catalog
+) -> Tuple[List[Quest], Dict[str, DailyTask]]:
+    """
+    Квесты и дейлики кампании из её docx за один проход. Дейлики — встроенные RAW
+    плюс разделы 6.x этого docx, как у дефолта; чего в docx нет — из дефолта.
+    """
+    if not path:
+        return base.main_quests, base.daily_tasks
+    quests_key, dailies_key = ("quests", digest), ("dailies", digest)
+    if quests_key not in _CATALOG_PARTS or dailies_key not in _CATALOG_PARTS:
+        quests, docx_dailies = load_docx_content(path)
+        if docx_dailies:
+            dailies = build_daily_tasks_from_raw()
+            dailies.update(docx_dailies)
+        else:
+            dailies = base.daily_tasks
+        _CATALOG_PARTS[quests_key] = quests or base.main_quests
+        _CATALOG_PARTS[dailies_key] = dailies
+    return _CATALOG_PARTS[quests_key], _CATALOG_PARTS[dailies_key]
+
+
+def _load_levels_json(path: str) -> Optional[Dict]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+    except Exception as exc:
+        print(f"Не удалось прочитать {path}: {exc}")
+        return None
+    return {key: raw.get(key) or {} for key in LEVEL_STRUCTURE_KEYS}
 
 
-def reset_shop_filters(uid: int):
-    SHOP_FILTERS[uid] = {"category": "all", "price": "all"}
+def campaign_level_structure(name: str, raw: Optional[Dict], quests: List[Quest]) -> Dict:
+    """
+    Структура уровней кампании: её levels.json, если он ссылается только на её квесты;
+    иначе — дефолтная, из которой убраны группы и зависимости с чужими кодами.
+    """
+    if raw is not None:
+        errors = validate_level_structure(raw, {q.code for q in quests if q.code})
+        if not errors:
+            return parse_level_structure(raw)
+        for error in errors:
+            print(f"Кампания {name}, levels.json: {error}")
+        print(f"Кампания {name}: levels.json отклонён, используется дефолтная структура")
+    return restrict_level_structure(default_level_structure(), quests)
+
+
+def list_campaigns() -> List[str]:
+    names = [DEFAULT_CAMPAIGN]
+    if os.path.isdir(CAMPAIGNS_DIR):
+        names += sorted(
+            n
+            for n in os.listdir(CAMPAIGNS_DIR)
+            if n != DEFAULT_CAMPAIGN and os.path.isdir(os.path.join(CAMPAIGNS_DIR, n))
+        )
+    return names
 
 
-def shop_price_options() -> List[int]:
-    prices = sorted(
-        {int(r.get("price", 0)) for r in SHOP_REWARDS if isinstance(r.get("price"), (int, float))}
+def load_campaign_catalog(name: str) -> Catalog:
+    """
+    Собирает каталог кампании из campaigns/<name>/: *.docx (квесты и дейлики),
+    *.xlsx (лутбоксы), shop_rewards.json, levels.json (структура уровней в виде
+    бандла: level_labels, level_meta, level_schedule, level_groups, quest_dependencies).
+    Отсутствующие файлы берутся из дефолта.
+    """
+    base = default_catalog()
+    folder = os.path.join(CAMPAIGNS_DIR, name)
+    if name == DEFAULT_CAMPAIGN or not os.path.isdir(folder):
+        return base
+
+    docx_path = _find_campaign_file(folder, ".docx", "tasks.docx")
+    xlsx_path = _find_campaign_file(folder, ".xlsx", "lootbox.xlsx")
+    shop_path = _find_campaign_file(folder, ".json", "shop_rewards.json", skip=("levels.json",))
+    levels_path = os.path.join(folder, "levels.json")
+    if not os.path.exists(levels_path):
+        levels_path = None
+    digests = tuple(
+        _file_digest(p) if p else None for p in (docx_path, xlsx_path, shop_path, levels_path)
     )
-    if not prices:
-        return []
-    options = [p for p in SHOP_PRICE_PRESETS if prices[0] <= p <= prices[-1]]
-    if not options:
-        options = prices[:6]
-    return options[:6]
+    if not any(digests):
+        return base
+
+    fingerprint = (_CATALOG_GENERATION,) + digests
+    shared = _CATALOGS_BY_FINGERPRINT.get(fingerprint)
+    if shared is not None:
+        return shared
+
+    main_quests, daily_tasks = _campaign_docx_parts(docx_path, digests[0], base)
+    reward_table = _catalog_part(
+        "loot",
+        xlsx_path,
+        digests[1],
+        lambda p: merge_reward_tables(load_lootbox_reward_tables_from_excel(p)),
+        base.reward_table,
+    )
+    shop_rewards = _catalog_part("shop", shop_path, digests[2], load_shop_rewards, base.shop_rewards)
+    raw_levels = _catalog_part("levels", levels_path, digests[3], _load_levels_json, None)
+    if raw_levels is None and main_quests is base.main_quests:
+        levels = None
+    else:
+        levels = campaign_level_structure(name, raw_levels, main_quests)
+    version = hashlib.sha1(repr(fingerprint).encode("utf-8")).hexdigest()[:12]
+    catalog = Catalog(
+        name, version, main_quests, daily_tasks, shop_rewards, reward_table, levels
+    )
+    _CATALOGS_BY_FINGERPRINT[fingerprint] = catalog
+    print(f"Каталог кампании {name} загружен (версия {version})")
+    return catalog
+
+
+def get_catalog(name: str) -> Catalog:
+    """Ленивая загрузка каталога кампании с LRU-ограничением резидентных каталогов."""
+    if name == DEFAULT_CAMPAIGN:
+        return default_catalog()
+    catalog = _CATALOGS.get(name)
+    if catalog is None:
+        catalog = load_campaign_catalog(name)
+        _CATALOGS[name] = catalog
+        while len(_CATALOGS) > CATALOG_CACHE_SIZE:
+            _CATALOGS.popitem(last=False)
+        _prune_catalog_parts()
+    _CATALOGS.move_to_end(name)
+    return catalog
+
+
+def _prune_catalog_parts():
+    alive = {id(c) for c in _CATALOGS.values()}
+    for fp, catalog in list(_CATALOGS_BY_FINGERPRINT.items()):
+        if id(catalog) not in alive:
+            del _CATALOGS_BY_FINGERPRINT[fp]
+    used = set()
+    for catalog in _CATALOGS_BY_FINGERPRINT.values():
+        used.update(
+            (
+                id(catalog.main_quests),
+                id(catalog.daily_tasks),
+                id(catalog.reward_table),
+                id(catalog.shop_rewards),
+            )
+        )
+    for key, part in list(_CATALOG_PARTS.items()):
+        if id(part) not in used:
+            del _CATALOG_PARTS[key]
 
 
-def shop_price_label(uid: int) -> str:
-    filters = get_shop_filters(uid)
-    pf = filters.get("price", "all")
-    if pf == "all":
-        return "все цены"
-    if pf == "balance":
-        return "по балансу"
-    if isinstance(pf, str) and pf.startswith("max:"):
-        try:
-            val = int(pf.split(":", 1)[1])
-            return f"до {val}"
-        except ValueError:
-            return "все цены"
-    return "все цены"
+def _load_user_campaign(user_id: int) -> str:
+    conn = get_conn()
+    c = conn.cursor()
+    c.execute("SELECT campaign FROM user_campaigns WHERE user_id = ?", (user_id,))
+    row = c.fetchone()
+    conn.close()
+    return row[0] if row else DEFAULT_CAMPAIGN
 
 
-def filtered_shop_rewards(uid: int) -> List[Dict]:
-    filters = get_shop_filters(uid)
-    category = filters.get("category", "all")
-    price_filter = filters.get("price", "all")
-    items = list(SHOP_REWARDS) if SHOP_REWARDS else list(DEFAULT_SHOP_REWARDS)
-    if category != "all":
-        items = [i for i in items if i.get("category") == category]
+def get_user_campaign(user_id: int) -> str:
+    return PROFILE_CACHE.campaign(user_id, _load_user_campaign)
 
-    max_price: Optional[int] = None
-    if price_filter == "balance":
-        max_price = get_coins(uid)
-    elif isinstance(price_filter, str) and price_filter.startswith("max:"):
-        try:
-            max_price = int(price_filter.split(":", 1)[1])
-        except ValueError:
-            max_price = None
-    if max_price is not None:
-        items = [i for i in items if i.get("price", 0) <= max_price]
 
-    items.sort(key=lambda i: (i.get("price", 0), i.get("name", "")))
-    return items
+def set_user_campaign(user_id: int, campaign: str):
+    conn = get_conn()
+    c = conn.cursor()
+    c.execute(
+        """
+        INSERT INTO user_campaigns(user_id, campaign) VALUES(?,?)
+        ON CONFLICT(user_id) DO UPDATE SET campaign = excluded.campaign
+        """,
+        (user_id, campaign),
+    )
+    conn.commit()
+    conn.close()
+    PROFILE_CACHE.forget(user_id)
 
 
-def shop_categories() -> List[str]:
-    items = SHOP_REWARDS if SHOP_REWARDS else DEFAULT_SHOP_REWARDS
-    return sorted({i.get("category", "other") for i in items})
+def catalog_for(user_id: int) -> Catalog:
+    return get_catalog(get_user_campaign(user_id))
 
 
-def get_shop_reward(item_id: str) -> Optional[Dict]:
-    for item in SHOP_REWARDS if SHOP_REWARDS else DEFAULT_SHOP_REWARDS:
-        if str(item.get("id")) == str(item_id):
-            return item
-    return None
+class CampaignMiddleware(BaseMiddleware):
+    """Подставляет каталог кампании пользователя на время обработки апдейта."""
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        catalog = catalog_for(user.id) if user else default_catalog()
+        token = CURRENT_CATALOG.set(catalog)
+        try:
+            return await handler(event, data)
+        finally:
+            CURRENT_CATALOG.reset(token)
 
 
 # ================== ВСПОМОГАТЕЛЬНЫЕ ОТРИСОВКИ ==================
@@ -1862,10 +4311,8 @@ def get_shop_reward(item_id: str) -> Optional[Dict]:
 
 def build_map_view(uid: int) -> Tuple[str, InlineKeyboardMarkup]:
     _ensure_unlocks(uid)
-    levels = {}
-    for q in MAIN_QUESTS:
-        lvl = _quest_level(q)
-        levels.setdefault(lvl, []).append(q)
+    catalog = active_catalog()
+    levels = catalog.quests_by_level
 
     kb = []
     lines = ["☑ <b>Карта</b>\n"]
@@ -1874,7 +4321,7 @@ def build_map_view(uid: int) -> Tuple[str, InlineKeyboardMarkup]:
         statuses = []
         level_open = _is_level_open(uid, lvl)
         for q in quests:
-            st = get_main_status(uid, q["index"])
+            st = get_main_status(uid, q.index)
             if not level_open:
                 st = "locked"
             statuses.append(st)
@@ -1884,8 +4331,8 @@ def build_map_view(uid: int) -> Tuple[str, InlineKeyboardMarkup]:
             mark = "•"
         else:
             mark = "✗"
-        title = LEVEL_LABELS.get(lvl, f"Уровень {lvl}")
-        date_range = LEVEL_META.get(lvl, {}).get("dates", "")
+        title = catalog.level_labels.get(lvl, f"Уровень {lvl}")
+        date_range = catalog.level_meta.get(lvl, {}).get("dates", "")
         date_label = f" ({date_range})" if date_range else ""
         lines.append(f"{mark} {title}{date_label}")
         kb.append(
@@ -1923,34 +4370,32 @@ def build_dailies_view(
     category: str = "all",
 ) -> Tuple[str, InlineKeyboardMarkup]:
     today = date.today().isoformat()
-    DAILY_FILTER_STATE[uid] = {
-        "filter_coin": filter_coin,
-        "category": category,
-        "page": page,
-        "search": search_term,
-    }
-
-    total_all = len(DAILY_TASKS)
+    daily_tasks = active_catalog().daily_tasks
+    total_all = len(daily_tasks)
     lines = ["✓ <b>Дейлики</b>"]
     cat_label = THEME_LABELS.get(category, "Все категории") if category != "all" else "Все категории"
 
-    tasks_list = list(DAILY_TASKS.items())
+    tasks_list = list(daily_tasks.items())
     if category != "all":
-        tasks_list = [(k, v) for k, v in tasks_list if v.get("category") == category]
+        tasks_list = [(k, v) for k, v in tasks_list if v.category == category]
     if filter_coin != "all":
         try:
             cval = int(filter_coin)
-            tasks_list = [(k, v) for k, v in tasks_list if v.get("coins") == cval]
+            tasks_list = [(k, v) for k, v in tasks_list if v.coins == cval]
         except ValueError:
             pass
     if search_term:
         tasks_list = [
-            (k, v) for k, v in tasks_list if search_term.lower() in v.get("title", "").lower()
+            (k, v) for k, v in tasks_list if search_term.lower() in v.title.lower()
         ]
 
     total = len(tasks_list)
     total_pages = max(1, (total + page_size - 1) // page_size)
     page = max(0, min(page, total_pages - 1))
+    state = {"filter_coin": filter_coin, "category": category, "page": page, "search": search_term}
+    # С sqlite-хранилищем set — это запись в БД: перерисовка того же экрана её не делает.
+    if SESSIONS.get(uid, "daily_filter") != state:
+        SESSIONS.set(uid, "daily_filter", state)
     start = page * page_size
     end = start + page_size
     page_tasks = tasks_list[start:end]
@@ -1965,14 +4410,15 @@ def build_dailies_view(
     if total_pages > 1:
         lines.append(f"{page+1}/{total_pages}")
 
+    cat_ref = callback_ref("theme", category)
     kb = [
         [
-            InlineKeyboardButton(text="Все", callback_data=f"dailies:filter:all:{category}:{page}"),
-            InlineKeyboardButton(text="1", callback_data=f"dailies:filter:1:{category}:0"),
-            InlineKeyboardButton(text="2", callback_data=f"dailies:filter:2:{category}:0"),
-            InlineKeyboardButton(text="3", callback_data=f"dailies:filter:3:{category}:0"),
-            InlineKeyboardButton(text="5", callback_data=f"dailies:filter:5:{category}:0"),
-            InlineKeyboardButton(text="8", callback_data=f"dailies:filter:8:{category}:0"),
+            InlineKeyboardButton(text="Все", callback_data=f"dailies:filter:all:{cat_ref}:{page}"),
+            InlineKeyboardButton(text="1", callback_data=f"dailies:filter:1:{cat_ref}:0"),
+            InlineKeyboardButton(text="2", callback_data=f"dailies:filter:2:{cat_ref}:0"),
+            InlineKeyboardButton(text="3", callback_data=f"dailies:filter:3:{cat_ref}:0"),
+            InlineKeyboardButton(text="5", callback_data=f"dailies:filter:5:{cat_ref}:0"),
+            InlineKeyboardButton(text="8", callback_data=f"dailies:filter:8:{cat_ref}:0"),
         ],
         [
             InlineKeyboardButton(
@@ -1984,12 +4430,12 @@ def build_dailies_view(
     for code, info in page_tasks:
         done = get_daily_done(uid, code, today)
         mark = "✓" if done else "◻"
-        lines.append(f"{mark} {info['title']} (+{info['coins']} {COIN_SYMBOL})")
+        lines.append(f"{mark} {info.title} (+{info.coins} {COIN_SYMBOL})")
         kb.append(
             [
                 InlineKeyboardButton(
-                    text=f"{'Отменить' if done else 'Сделать'}: {info['title'][:26]}…",
-                    callback_data=f"daily:{code}",
+                    text=f"{'Отменить' if done else 'Сделать'}: {info.title[:26]}…",
+                    callback_data=f"daily:{callback_ref('daily', code)}",
                 )
             ]
         )
@@ -1999,13 +4445,13 @@ def build_dailies_view(
         if page > 0:
             nav_row.append(
                 InlineKeyboardButton(
-                    text="⬅️", callback_data=f"dailies:filter:{filter_coin}:{category}:{page-1}"
+                    text="⬅️", callback_data=f"dailies:filter:{filter_coin}:{cat_ref}:{page-1}"
                 )
             )
         if page < total_pages - 1:
             nav_row.append(
                 InlineKeyboardButton(
-                    text="➡️", callback_data=f"dailies:filter:{filter_coin}:{category}:{page+1}"
+                    text="➡️", callback_data=f"dailies:filter:{filter_coin}:{cat_ref}:{page+1}"
                 )
             )
     if nav_row:
@@ -2021,16 +4467,16 @@ def build_dailies_category_menu() -> Tuple[str, InlineKeyboardMarkup]:
     buttons = [
         [
             InlineKeyboardButton(
-                text="Все категории", callback_data="dailies:cat:all:all:0"
+                text="Все категории", callback_data=f"dailies:cat:{callback_ref('theme', 'all')}:all:0"
             )
         ]
     ]
     row = []
-    for theme in DAILY_THEMES:
+    for theme in active_catalog().daily_themes:
         row.append(
             InlineKeyboardButton(
                 text=THEME_LABELS.get(theme, theme),
-                callback_data=f"dailies:cat:{theme}:all:0",
+                callback_data=f"dailies:cat:{callback_ref('theme', theme)}:all:0",
             )
         )
         if len(row) == 2:
@@ -2045,11 +4491,11 @@ def build_dailies_category_menu() -> Tuple[str, InlineKeyboardMarkup]:
     )
 
 
-def _shop_icon(item: Dict) -> str:
-    cat = item.get("category")
+def _shop_icon(item: ShopItem) -> str:
+    cat = item.category
     if cat and cat in SHOP_CATEGORY_ICONS:
         return SHOP_CATEGORY_ICONS[cat]
-    return item.get("emoji") or SHOP_CATEGORY_ICONS.get("default", "⟡")
+    return item.emoji or SHOP_CATEGORY_ICONS.get("default", "⟡")
 
 
 def shop_category_label(cat: str) -> str:
@@ -2058,65 +4504,220 @@ def shop_category_label(cat: str) -> str:
     return THEME_LABELS.get(cat, cat)
 
 
+class RenderCache:
+    """
+    Общий для всех игроков LRU отрисованных фрагментов экранов.
+    Ключ обязан включать версию каталога: после обновления контента
+    старые записи просто перестают запрашиваться и вытесняются.
+    """
+
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._items: "OrderedDict[Tuple, object]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Tuple, build):
+        value = self._items.get(key)
+        if value is None:
+            self.misses += 1
+            value = build()
+            self._items[key] = value
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.hits += 1
+            self._items.move_to_end(key)
+        return value
+
+    def clear(self):
+        self._items.clear()
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+
+
+SHOP_PAGE_CACHE_SIZE = int(os.getenv("SHOP_PAGE_CACHE_SIZE", "2000"))
+SHOP_PAGE_CACHE = RenderCache(SHOP_PAGE_CACHE_SIZE)
+
+
+def _render_shop_page(category: str, max_price: Optional[int], page: int) -> Tuple:
+    """Общая для всех часть страницы магазина: строки товаров, их кнопки и навигация."""
+    items = shop_items_for(category, max_price)
+    total_pages = max(1, (len(items) + SHOP_PAGE_SIZE - 1) // SHOP_PAGE_SIZE)
+    page = max(0, min(page, total_pages - 1))
+    page_items = items[page * SHOP_PAGE_SIZE:(page + 1) * SHOP_PAGE_SIZE]
+
+    lines = []
+    if page_items:
+        if total_pages > 1:
+            lines.append(f"Страница {page + 1}/{total_pages}")
+        for item in page_items:
+            lines.append(f"{_shop_icon(item)} {item.name} — {coin_text(item.price)}")
+    else:
+        lines.append("По этим фильтрам ничего не нашлось.")
+
+    rows = [
+        [
+            InlineKeyboardButton(
+                text=f"✓ {item.name[:22]} — {coin_text(item.price)}",
+                callback_data=f"shop:item:{callback_ref('shop', item.id)}",
+            )
+        ]
+        for item in page_items
+    ]
+    nav_row = []
+    if total_pages > 1 and page > 0:
+        nav_row.append(
+            InlineKeyboardButton(text="⬅️", callback_data=f"shop:list:{page-1}")
+        )
+    if total_pages > 1 and page < total_pages - 1:
+        nav_row.append(
+            InlineKeyboardButton(text="➡️", callback_data=f"shop:list:{page+1}")
+        )
+    if nav_row:
+        rows.append(nav_row)
+    return tuple(lines), tuple(tuple(row) for row in rows)
+
+
 def build_shop_view(uid: int, page: int = 0) -> Tuple[str, InlineKeyboardMarkup]:
     filters = get_shop_filters(uid)
-    items = filtered_shop_rewards(uid)
-    total = len(items)
-    total_pages = max(1, (total + SHOP_PAGE_SIZE - 1) // SHOP_PAGE_SIZE)
+    category = filters.get("category", "all")
+    coins = get_coins(uid)
+    catalog = active_catalog()
+    # Список отсортирован по цене, поэтому фильтр по цене оставляет его префикс:
+    # ключом служит число доступных наград, а не сам потолок. Все балансы
+    # между соседними ценами делят одну запись, как и страницы за пределами списка.
+    prices = catalog.shop_prices(category)
+    max_price = shop_max_price(filters.get("price", "all"), coins)
+    count = len(prices) if max_price is None else bisect.bisect_right(prices, max_price)
+    cutoff = None if count == len(prices) else (prices[count - 1] if count else -1)
+    total_pages = max(1, (count + SHOP_PAGE_SIZE - 1) // SHOP_PAGE_SIZE)
     page = max(0, min(page, total_pages - 1))
-    start = page * SHOP_PAGE_SIZE
-    end = start + SHOP_PAGE_SIZE
-    page_items = items[start:end]
+    page_lines, page_rows = SHOP_PAGE_CACHE.get(
+        (catalog.version, category, count, page), lambda: _render_shop_page(category, cutoff, page)
+    )
 
-    cat_label = shop_category_label(filters.get("category", "all"))
+    cat_label = shop_category_label(category)
     price_label = shop_price_label(uid)
-    coins = get_coins(uid)
-
     lines = [
         "◆ <b>Магазин</b>",
         f"{coin_text(coins)}",
         f"{cat_label} · {price_label}",
         "",
+        *page_lines,
     ]
-    if page_items:
-        if total_pages > 1:
-            lines.append(f"Страница {page + 1}/{total_pages}")
-        for item in page_items:
-            icon = _shop_icon(item)
-            lines.append(f"{icon} {item.get('name')} — {coin_text(int(item.get('price', 0)))}")
-    else:
-        lines.append("По этим фильтрам ничего не нашлось.")
-
     kb = [
         [
             InlineKeyboardButton(text=f"Категория: {cat_label[:14]}", callback_data="shop:catmenu"),
             InlineKeyboardButton(text=f"Цена: {price_label}", callback_data="shop:pricemenu"),
         ],
         [InlineKeyboardButton(text="♻️ Сбросить фильтры", callback_data="shop:reset")],
+        *(list(row) for row in page_rows),
+        [InlineKeyboardButton(text="Категории", callback_data="shop:catmenu")],
+        [InlineKeyboardButton(text="⬅ В меню", callback_data="menu:profile")],
+    ]
+    return "\n".join(lines), InlineKeyboardMarkup(inline_keyboard=kb)
+
+
+def build_shop_item_view(uid: int, item: ShopItem) -> Tuple[str, InlineKeyboardMarkup]:
+    lines = [
+        f"{_shop_icon(item)} <b>{item.name}</b>",
+        f"{coin_text(item.price)} · {shop_category_label(item.category)}",
+        f"Баланс: {coin_text(get_coins(uid))}",
+    ]
+    if item.description:
+        lines.append("")
+        lines.append(item.description)
+    kb = [
+        [
+            InlineKeyboardButton(
+                text=f"Купить за {coin_text(item.price)}",
+                callback_data=f"shop:buy:{callback_ref('shop', item.id)}",
+            )
+        ],
+        [InlineKeyboardButton(text="⬅ К списку", callback_data="menu:shop")],
+    ]
+    return "\n".join(lines), InlineKeyboardMarkup(inline_keyboard=kb)
+
+
+def build_daily_card(uid: int, code: str, task: DailyTask) -> Tuple[str, InlineKeyboardMarkup]:
+    done = get_daily_done(uid, code, date.today().isoformat())
+    text = (
+        f"{'✓' if done else '◻'} <b>{task.title}</b>\n"
+        f"+{coin_text(task.coins)} · {THEME_LABELS.get(task.category, task.category)}"
+    )
+    kb = [
+        [
+            InlineKeyboardButton(
+                text="Отменить" if done else "Сделать",
+                callback_data=f"daily:{callback_ref('daily', code)}",
+            )
+        ],
+        [InlineKeyboardButton(text="⬅ К дейликам", callback_data="menu:dailies")],
     ]
-    for item in page_items:
+    return text, InlineKeyboardMarkup(inline_keyboard=kb)
+
+
+def build_inventory_view(
+    uid: int, before_id: Optional[int] = None
+) -> Tuple[str, InlineKeyboardMarkup]:
+    """Страница инвентаря: одинаковые награды схлопнуты в стопки с количеством."""
+    rows = get_reward_stacks(uid, before_id, INVENTORY_PAGE_SIZE + 1)
+    has_more = len(rows) > INVENTORY_PAGE_SIZE
+    rows = rows[:INVENTORY_PAGE_SIZE]
+
+    if not rows and before_id is None:
+        text = (
+            "◻ Инвентарь пуст.\n"
+            f"Заработай {COIN_SYMBOL} или открой лутбокс."
+        )
+        kb = [
+            [InlineKeyboardButton(text="🎁 К лутбоксам", callback_data="menu:loot")],
+            [InlineKeyboardButton(text="⬅ В меню", callback_data="menu:profile")],
+        ]
+        return text, InlineKeyboardMarkup(inline_keyboard=kb)
+
+    lines = ["◻ <b>Инвентарь</b>\n"]
+    kb = []
+    for name, lvl, count, last_id in rows:
+        if lvl == 0:
+            prefix = "✶"
+        elif lvl < 0:
+            prefix = "◆"
+        else:
+            prefix = f"[L{lvl}]"
+        suffix = f" ×{count}" if count > 1 else ""
+        lines.append(f"{prefix} {name}{suffix}")
         kb.append(
             [
                 InlineKeyboardButton(
-                    text=f"✓ {item.get('name')[:22]} — {coin_text(int(item.get('price', 0)))}",
-                    callback_data=f"shop:item:{item.get('id')}",
+                    text=f"Использовать: {name[:18]}…{suffix}",
+                    callback_data=f"use:{last_id}",
                 )
             ]
         )
+    if not rows:
+        lines.append("Дальше пусто.")
 
     nav_row = []
-    if total_pages > 1 and page > 0:
-        nav_row.append(
-            InlineKeyboardButton(text="⬅️", callback_data=f"shop:list:{page-1}")
-        )
-    if total_pages > 1 and page < total_pages - 1:
+    if before_id is not None:
+        nav_row.append(InlineKeyboardButton(text="⏮", callback_data="inv:page:0"))
+    if has_more:
         nav_row.append(
-            InlineKeyboardButton(text="➡️", callback_data=f"shop:list:{page+1}")
+            InlineKeyboardButton(text="➡️", callback_data=f"inv:page:{rows[-1][3]}")
         )
     if nav_row:
         kb.append(nav_row)
-
-    kb.append([InlineKeyboardButton(text="Категории", callback_data="shop:catmenu")])
     kb.append([InlineKeyboardButton(text="⬅ В меню", callback_data="menu:profile")])
     return "\n".join(lines), InlineKeyboardMarkup(inline_keyboard=kb)
 
@@ -2129,7 +4730,7 @@ def build_shop_categories_kb(uid: int) -> InlineKeyboardMarkup:
         [
             InlineKeyboardButton(
                 text=f"{'✓ ' if current == 'all' else ''}Все категории",
-                callback_data="shop:cat:all",
+                callback_data=f"shop:cat:{callback_ref('shopcat', 'all')}",
             )
         ]
     )
@@ -2139,7 +4740,7 @@ def build_shop_categories_kb(uid: int) -> InlineKeyboardMarkup:
         mark = "✓ " if cat == current else ""
         row.append(
             InlineKeyboardButton(
-                text=f"{mark}{shop_category_label(cat)}", callback_data=f"shop:cat:{cat}"
+                text=f"{mark}{shop_category_label(cat)}", callback_data=f"shop:cat:{callback_ref('shopcat', cat)}"
             )
         )
         if len(row) == 2:
@@ -2197,36 +4798,502 @@ def build_shop_price_kb(uid: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
 
-def roll_reward(box_level: int) -> str:
-    return roll_single_reward(box_level)
+def roll_reward(box_level: int) -> str:
+    return roll_single_reward(box_level)
+
+
+def roll_single_reward(box_level: int) -> str:
+    roll = random.randint(1, 100)
+    table = active_catalog().reward_table.get(box_level) or DEFAULT_REWARD_TABLE.get(box_level, [])
+    for entry in table:
+        if roll <= entry.threshold:
+            return f"{entry.name} (d100={roll})"
+    return f"Сюрприз (d100={roll})"
+
+
+def pick_rewards(box_level: int, count: int = 3) -> List[str]:
+    table = active_catalog().reward_table.get(box_level) or DEFAULT_REWARD_TABLE.get(box_level, [])
+    names = [entry.name for entry in table]
+    if not names:
+        return []
+    # случайная выборка с возможными повторами, но чаще всего разные
+    return random.sample(names, k=min(count, len(names)))
+
+
+def resolve_combo_reward(base_name: str, box_level: int) -> Tuple[str, List[str]]:
+    """Если награда комбинированная — докидывает доп. roll'ы и возвращает список предметов."""
+    lower = base_name.lower()
+    if ("комбо" in lower) or ("+" in base_name):
+        parts = base_name.count("+") + 1
+        rolls = [roll_single_reward(box_level) for _ in range(parts)]
+        return base_name, rolls
+    return base_name, [base_name]
+
+
+# ---------- ОЧЕРЕДЬ АПДЕЙТОВ ПО ПОЛЬЗОВАТЕЛЯМ ----------
+
+USER_QUEUE_SIZE = int(os.getenv("USER_QUEUE_SIZE", "8"))
+
+
+class _KeyState:
+    __slots__ = ("lock", "pending", "inflight")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = 0
+        self.inflight: set = set()
+
+
+class KeyedDispatcher:
+    """
+    Выполняет задания одного ключа строго по очереди (asyncio.Lock честный, FIFO),
+    а задания разных ключей — параллельно. Очередь ключа ограничена max_pending,
+    повтор задания с тем же dedup-ключом, пока первое ещё ждёт или выполняется, отбрасывается.
+    """
+
+    DROPPED = object()
+
+    def __init__(self, max_pending: int):
+        self.max_pending = max_pending
+        self._states: Dict[int, _KeyState] = {}
+        self.dropped = 0
+
+    async def run(self, key: int, job, dedup=None):
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = _KeyState()
+        if state.pending >= self.max_pending or (dedup is not None and dedup in state.inflight):
+            self.dropped += 1
+            return self.DROPPED
+
+        state.pending += 1
+        if dedup is not None:
+            state.inflight.add(dedup)
+        try:
+            async with state.lock:
+                return await job()
+        finally:
+            state.pending -= 1
+            if dedup is not None:
+                state.inflight.discard(dedup)
+            if not state.pending:
+                self._states.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+
+class UserSerialMiddleware(BaseMiddleware):
+    """
+    Апдейты одного пользователя обрабатываются последовательно: два нажатия
+    quest_done или shop:buy не перемешают чтение статуса/баланса и запись.
+    """
+
+    def __init__(self, dispatcher: KeyedDispatcher):
+        self.dispatcher = dispatcher
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        callback = getattr(event, "callback_query", None)
+        dedup = None
+        if callback is not None and callback.message is not None:
+            dedup = (callback.message.message_id, callback.data)
+
+        result = await self.dispatcher.run(user.id, lambda: handler(event, data), dedup)
+        if result is KeyedDispatcher.DROPPED:
+            if callback is not None:
+                await callback.answer()
+            return None
+        return result
+
+
+USER_DISPATCHER = KeyedDispatcher(USER_QUEUE_SIZE)
+
+
+# ---------- ЗАЩИТА ОТ ПОВТОРНЫХ CALLBACK ----------
+
+CALLBACK_DEDUP_BACKEND = os.getenv("CALLBACK_DEDUP_BACKEND", "memory")  # memory | sqlite
+CALLBACK_DEDUP_TTL = float(os.getenv("CALLBACK_DEDUP_TTL", "600"))
+CALLBACK_DEDUP_SIZE = int(os.getenv("CALLBACK_DEDUP_SIZE", "20000"))
+# Для покупок повтор той же кнопки законен — ловим только двойное нажатие.
+CALLBACK_TAP_WINDOW = float(os.getenv("CALLBACK_TAP_WINDOW", "3"))
+
+
+class MemoryDedupCache:
+    """Ограниченный по размеру кэш уже обработанных ключей с TTL."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: "OrderedDict[str, float]" = OrderedDict()
+
+    def seen(self, key: str, ttl: float) -> bool:
+        """Отмечает ключ; True — если он уже был отмечен и ещё не истёк."""
+        now = time.monotonic()
+        expires_at = self._items.get(key)
+        if expires_at is not None and expires_at > now:
+            return True
+        self._items[key] = now + ttl
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+        return False
+
+    def forget(self, key: str):
+        self._items.pop(key, None)
+
+
+class SqliteDedupCache:
+    """То же в таблице processed_callbacks: работает между воркерами и рестартами."""
+
+    def seen(self, key: str, ttl: float) -> bool:
+        now = time.time()
+        conn = get_conn()
+        c = conn.cursor()
+        c.execute(
+            """
+            INSERT INTO processed_callbacks(key, expires_at) VALUES(?,?)
+            ON CONFLICT(key) DO UPDATE SET expires_at = excluded.expires_at
+            WHERE processed_callbacks.expires_at <= ?
+            """,
+            (key, now + ttl, now),
+        )
+        fresh = c.rowcount > 0
+        conn.commit()
+        conn.close()
+        return not fresh
+
+    def forget(self, key: str):
+        conn = get_conn()
+        c = conn.cursor()
+        c.execute("DELETE FROM processed_callbacks WHERE key = ?", (key,))
+        conn.commit()
+        conn.close()
+
+    def purge_expired(self, batch_size: int) -> int:
+        conn = get_conn()
+        c = conn.cursor()
+        c.execute(
+            """
+            DELETE FROM processed_callbacks WHERE key IN (
+                SELECT key FROM processed_callbacks WHERE expires_at <= ? LIMIT ?
+            )
+            """,
+            (time.time(), batch_size),
+        )
+        removed = c.rowcount
+        conn.commit()
+        conn.close()
+        return removed
+
+
+# Обработчик вернул это, если отказал, ничего не изменив (не хватило монет,
+# кнопка устарела): повторное нажатие должно пройти сразу, а не через окно.
+TAP_REJECTED = object()
+
+
+async def reject_tap(callback: CallbackQuery, text: str, show_alert: bool = True):
+    """Отвечает на нажатие отказом и снимает с кнопки защиту от повтора."""
+    await callback.answer(text, show_alert=show_alert)
+    return TAP_REJECTED
+
+
+class CallbackDedupMiddleware(BaseMiddleware):
+    """
+    Для маршрутов (и обработчиков) с флагом idempotent отбрасывает повторно
+    доставленные callback (тот же id) и повторные нажатия той же кнопки того же
+    сообщения в течение окна из флага — до любой работы с БД.
+    Если обработчик упал или отказал через reject_tap, ключи снимаются.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.skipped = 0
+
+    async def __call__(self, handler, event: CallbackQuery, data):
+        route = data.get("callback_route")
+        window = route.flags.get("idempotent") if route is not None else get_flag(data, "idempotent")
+        if not window:
+            return await handler(event, data)
+
+        keys = [(f"id:{event.id}", CALLBACK_DEDUP_TTL)]
+        if event.message is not None:
+            keys.append(
+                (
+                    f"btn:{event.from_user.id}:{event.message.chat.id}:"
+                    f"{event.message.message_id}:{event.data}",
+                    window,
+                )
+            )
+        duplicate = False
+        for key, ttl in keys:
+            duplicate = self.cache.seen(key, ttl) or duplicate
+        if duplicate:
+            self.skipped += 1
+            await event.answer("Уже учтено ✓")
+            return None
+        try:
+            result = await handler(event, data)
+        except Exception:
+            # Обработка не удалась — повтор должен пройти.
+            for key, _ in keys:
+                self.cache.forget(key)
+            raise
+        if result is TAP_REJECTED:
+            for key, _ in keys:
+                self.cache.forget(key)
+            return None
+        return result
+
+
+CALLBACK_DEDUP = SqliteDedupCache() if CALLBACK_DEDUP_BACKEND == "sqlite" else MemoryDedupCache(CALLBACK_DEDUP_SIZE)
+
+
+# ---------- ПОИСК ПО КАТАЛОГУ ----------
+
+INLINE_RESULTS_LIMIT = 50  # больше Telegram не принимает за один ответ
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "300"))
+SEARCH_FUZZY_CUTOFF = float(os.getenv("SEARCH_FUZZY_CUTOFF", "0.75"))
+_SEARCH_SPLIT = re.compile(r"\W+")
+
+
+def search_terms(text: str) -> List[str]:
+    return [t for t in _SEARCH_SPLIT.split(text.lower().replace("ё", "е")) if t]
+
+
+class CatalogSearchIndex:
+    """
+    Поиск по названиям наград магазина и дейликов одного каталога.
+    Слова названий лежат отсортированным словарём: префикс ищется bisect'ом,
+    у каждого слова — список записей. Слово запроса без совпадений
+    сопоставляется с похожими словами словаря на ту же букву (опечатки). Все слова запроса
+    должны найтись; ранг — точное слово > префикс > похожее, затем короткие названия.
+    """
+
+    def __init__(self, catalog: "Catalog"):
+        # (вид, значение, название): вид и значение — как в CALLBACK_ID_SOURCES
+        self.entries: List[Tuple[str, str, str]] = [("shop", item.id, item.name) for item in catalog.shop_rewards]
+        self.entries += [("daily", code, task.title) for code, task in catalog.daily_tasks.items()]
+        postings: Dict[str, List[int]] = {}
+        for i, (_kind, _value, title) in enumerate(self.entries):
+            for term in dict.fromkeys(search_terms(title)):
+                postings.setdefault(term, []).append(i)
+        self._vocab = sorted(postings)
+        self._postings = [postings[term] for term in self._vocab]
+        self._vocab_pos = {term: j for j, term in enumerate(self._vocab)}
+
+    def _term_scores(self, term: str) -> Dict[int, int]:
+        scores: Dict[int, int] = {}
+        for j in range(bisect.bisect_left(self._vocab, term), len(self._vocab)):
+            word = self._vocab[j]
+            if not word.startswith(term):
+                break
+            score = 3 if word == term else 2
+            for i in self._postings[j]:
+                if scores.get(i, 0) < score:
+                    scores[i] = score
+        if not scores:
+            # опечатки ищем среди слов на ту же букву — так кандидатов в десятки раз меньше
+            lo = bisect.bisect_left(self._vocab, term[0])
+            hi = bisect.bisect_left(self._vocab, term[0] + "\uffff", lo)
+            for word in difflib.get_close_matches(term, self._vocab[lo:hi], n=5, cutoff=SEARCH_FUZZY_CUTOFF):
+                for i in self._postings[self._vocab_pos[word]]:
+                    scores.setdefault(i, 1)
+        return scores
+
+    def search(self, query: str) -> List[int]:
+        """Номера записей по убыванию релевантности; пустой запрос — весь каталог."""
+        terms = search_terms(query)
+        if not terms:
+            return list(range(len(self.entries)))
+        total: Optional[Dict[int, int]] = None
+        for term in dict.fromkeys(terms):
+            scores = self._term_scores(term)
+            if total is None:
+                total = scores
+            else:
+                total = {i: s + scores[i] for i, s in total.items() if i in scores}
+            if not total:
+                return []
+        return sorted(total, key=lambda i: (-total[i], len(self.entries[i][2]), i))
+
+
+# ---------- КОМПАКТНЫЕ CALLBACK_DATA ----------
+
+# Telegram ограничивает callback_data 64 байтами: вместо id наград, кодов дейликов
+# и названий категорий в кнопки пишется короткий токен — метка таблицы + номер в base64.
+_CB_DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz-_"
+_CB_DIGIT_VALUES = {ch: i for i, ch in enumerate(_CB_DIGITS)}
+CALLBACK_TAG_LEN = 3  # 18 бит: устаревшая кнопка почти наверняка не совпадёт с новой таблицей
+CALLBACK_MAX_DIGITS = 4
+
+
+def encode_callback_int(n: int) -> str:
+    digits = ""
+    while True:
+        n, rem = divmod(n, 64)
+        digits = _CB_DIGITS[rem] + digits
+        if not n:
+            return digits
+
+
+def decode_callback_int(token: str) -> int:
+    if not token or len(token) > CALLBACK_MAX_DIGITS:
+        raise ValueError(token)
+    n = 0
+    for ch in token:
+        value = _CB_DIGIT_VALUES.get(ch)
+        if value is None:
+            raise ValueError(token)
+        n = n * 64 + value
+    return n
+
+
+class CallbackIdTable:
+    """
+    Значения одного вида (id наград, коды дейликов, категории) <-> короткие токены.
+    Метка — хэш самого списка значений: она одинакова во всех воркерах и после
+    рестарта, а кнопка от другой версии контента или кампании не расшифруется.
+    """
+
+    __slots__ = ("values", "index", "tag", "fallback")
+
+    def __init__(self, values: List[str], fallback: Optional[str] = None):
+        self.values = list(values)
+        self.index = {value: i for i, value in enumerate(self.values)}
+        digest = zlib.crc32("\x1f".join(self.values).encode("utf-8")) % 64**CALLBACK_TAG_LEN
+        self.tag = encode_callback_int(digest).rjust(CALLBACK_TAG_LEN, "0")
+        self.fallback = fallback
+
+    def encode(self, value: str) -> str:
+        i = self.index.get(value)
+        if i is None:
+            if self.fallback is None:
+                raise KeyError(value)
+            i = self.index[self.fallback]
+        return self.tag + encode_callback_int(i)
+
+    def decode(self, token: str) -> str:
+        if token[:CALLBACK_TAG_LEN] != self.tag:
+            raise ValueError("кнопка от другой версии контента")
+        i = decode_callback_int(token[CALLBACK_TAG_LEN:])
+        if i >= len(self.values):
+            raise ValueError(token)
+        return self.values[i]
+
+
+# вид -> (значения из каталога, значение по умолчанию для неизвестных)
+CALLBACK_ID_SOURCES = {
+    "shop": (lambda catalog: [item.id for item in catalog.shop_rewards], None),
+    "shopcat": (lambda catalog: ["all"] + sorted({item.category for item in catalog.shop_rewards}), "all"),
+    "daily": (lambda catalog: list(catalog.daily_tasks), None),
+    "theme": (lambda catalog: ["all"] + list(catalog.daily_themes), "all"),
+}
+
+
+class CatalogRef:
+    """Тип поля маршрута: токен -> значение из таблицы активного каталога."""
+
+    __slots__ = ("kind",)
+
+    def __init__(self, kind: str):
+        self.kind = kind
+
+    def __call__(self, token: str) -> str:
+        return active_catalog().callback_ids(self.kind).decode(token)
 
 
-def roll_single_reward(box_level: int) -> str:
-    roll = random.randint(1, 100)
-    table = REWARD_TABLE.get(box_level) or DEFAULT_REWARD_TABLE.get(box_level, [])
-    for threshold, name in table:
-        if roll <= threshold:
-            return f"{name} (d100={roll})"
-    return f"Сюрприз (d100={roll})"
+def callback_ref(kind: str, value: str) -> str:
+    """Токен значения для callback_data кнопки."""
+    return active_catalog().callback_ids(kind).encode(value)
 
 
-def pick_rewards(box_level: int, count: int = 3) -> List[str]:
-    table = REWARD_TABLE.get(box_level) or DEFAULT_REWARD_TABLE.get(box_level, [])
-    names = [name for _, name in table]
-    if not names:
-        return []
-    # случайная выборка с возможными повторами, но чаще всего разные
-    return random.sample(names, k=min(count, len(names)))
+# ---------- РОУТЕР CALLBACK ----------
 
 
-def resolve_combo_reward(base_name: str, box_level: int) -> Tuple[str, List[str]]:
-    """Если награда комбинированная — докидывает доп. roll'ы и возвращает список предметов."""
-    lower = base_name.lower()
-    if ("комбо" in lower) or ("+" in base_name):
-        parts = base_name.count("+") + 1
-        rolls = [roll_single_reward(box_level) for _ in range(parts)]
-        return base_name, rolls
-    return base_name, [base_name]
+class CallbackRoute:
+    """
+    Маршрут callback: префикс, поля payload как (имя, тип) или (имя, тип, дефолт)
+    и флаги (idempotent и т.п.). Последнее поле забирает остаток строки.
+    """
+
+    __slots__ = ("prefix", "fields", "handler", "flags", "invalid")
+
+    def __init__(self, prefix: str, fields: Tuple, handler, flags: Dict, invalid: Optional[str]):
+        self.prefix = prefix
+        self.fields = fields
+        self.handler = handler
+        self.flags = flags
+        self.invalid = invalid
+
+    def decode(self, tail: str) -> Optional[Dict]:
+        """Разбирает хвост после префикса; None — payload не подходит."""
+        if not self.fields:
+            return None if tail else {}
+        parts = tail.split(":", len(self.fields) - 1) if tail else []
+        payload = {}
+        for i, field in enumerate(self.fields):
+            name, cast = field[0], field[1]
+            try:
+                payload[name] = cast(parts[i])
+            except (IndexError, ValueError):
+                if len(field) < 3:
+                    return None
+                payload[name] = field[2]
+        return payload
+
+
+class CallbackRouter:
+    """
+    Разбор callback_data одним поиском по словарю вместо цепочки фильтров
+    startswith: строка режется по ':' и сначала пробуется самый длинный префикс
+    (не глубже самого длинного зарегистрированного). Стоимость не зависит
+    от числа маршрутов, payload приводится к типам один раз.
+    """
+
+    def __init__(self):
+        self._routes: Dict[str, CallbackRoute] = {}
+        self._depth = 1
+
+    def route(self, prefix: str, *fields, invalid: Optional[str] = None, **flags):
+        def decorator(handler):
+            if prefix in self._routes:
+                raise ValueError(f"маршрут {prefix} уже зарегистрирован")
+            self._routes[prefix] = CallbackRoute(prefix, fields, handler, flags, invalid)
+            self._depth = max(self._depth, prefix.count(":") + 1)
+            return handler
+
+        return decorator
+
+    def match(self, data: str) -> Tuple[Optional[CallbackRoute], Optional[Dict]]:
+        """(маршрут, payload); payload None — префикс найден, но данные битые."""
+        parts = data.split(":", self._depth)
+        broken = None
+        for depth in range(min(len(parts), self._depth), 0, -1):
+            prefix = ":".join(parts[:depth]) if depth > 1 else parts[0]
+            route = self._routes.get(prefix)
+            if route is None:
+                continue
+            payload = route.decode(data[len(prefix) + 1:])
+            if payload is not None:
+                return route, payload
+            broken = broken or route
+        return broken, None
+
+    def filter(self, callback: CallbackQuery):
+        """Фильтр для единственного обработчика: кладёт маршрут и payload в data."""
+        route, payload = self.match(callback.data or "")
+        if route is None:
+            return False
+        return {"callback_route": route, "payload": payload}
+
+    def __len__(self) -> int:
+        return len(self._routes)
+
+
+CALLBACK_ROUTER = CallbackRouter()
 
 
 # ================== TELEGRAM-БОТ ==================
@@ -2236,9 +5303,20 @@ bot = Bot(
     default=DefaultBotProperties(parse_mode=ParseMode.HTML),
 )
 dp = Dispatcher()
+dp.update.outer_middleware(UserSerialMiddleware(USER_DISPATCHER))
+dp.update.outer_middleware(CampaignMiddleware())
+dp.callback_query.middleware(CallbackDedupMiddleware(CALLBACK_DEDUP))
 patch_aiogram_rendering()
 
 
+@dp.callback_query(CALLBACK_ROUTER.filter)
+async def dispatch_callback(callback: CallbackQuery, callback_route: CallbackRoute, payload: Optional[Dict]):
+    """Единственный обработчик callback: маршрут уже найден фильтром роутера."""
+    if payload is None:
+        return await reject_tap(callback, callback_route.invalid or "Кнопка устарела, открой /menu")
+    return await callback_route.handler(callback, **payload)
+
+
 def main_menu_kb() -> InlineKeyboardMarkup:
     kb = [
         [
@@ -2300,6 +5378,64 @@ def access_denied(user_id: int) -> bool:
     return ALLOWED_USER_IDS and (user_id not in ALLOWED_USER_IDS)
 
 
+# ---------- ДИФФ ОТРИСОВОК ----------
+
+RENDERED_VIEW_CACHE_SIZE = int(os.getenv("RENDERED_VIEW_CACHE_SIZE", "5000"))
+# (chat_id, message_id) -> (хэш текста, хэш клавиатуры) того, что сейчас на экране
+RENDERED_VIEWS: "OrderedDict[Tuple[int, int], Tuple[str, str]]" = OrderedDict()
+
+
+def _view_hash(value: str) -> str:
+    return hashlib.blake2b(value.encode("utf-8"), digest_size=12).hexdigest()
+
+
+def _markup_hash(markup) -> str:
+    if markup is None:
+        return ""
+    return _view_hash(markup.model_dump_json(exclude_none=True))
+
+
+def _remember_view(key: Tuple[int, int], rendered: Tuple[str, str]):
+    RENDERED_VIEWS[key] = rendered
+    RENDERED_VIEWS.move_to_end(key)
+    while len(RENDERED_VIEWS) > RENDERED_VIEW_CACHE_SIZE:
+        RENDERED_VIEWS.popitem(last=False)
+
+
+async def edit_view(message: Message, text: str, reply_markup=None) -> bool:
+    """
+    Редактирует сообщение, только если отрисовка поменялась.
+    Если изменилась одна клавиатура — отправляет только её.
+    Возвращает True, если запрос к Telegram был сделан.
+    """
+    key = (message.chat.id, message.message_id)
+    rendered = (_view_hash(text), _markup_hash(reply_markup))
+    cached = RENDERED_VIEWS.get(key)
+    if cached == rendered:
+        RENDERED_VIEWS.move_to_end(key)
+        return False
+    try:
+        if cached and cached[0] == rendered[0] and reply_markup is not None:
+            await message.edit_reply_markup(reply_markup=reply_markup)
+        else:
+            await message.edit_text(text, reply_markup=reply_markup)
+    except TelegramBadRequest as exc:
+        # Состояние экрана нам неизвестно (например, после рестарта) — но оно уже такое же.
+        if "message is not modified" not in str(exc):
+            RENDERED_VIEWS.pop(key, None)
+            raise
+    _remember_view(key, rendered)
+    return True
+
+
+def cache_stats() -> Dict[str, Dict]:
+    """Метрики попаданий внутренних кэшей (для /stats и логов)."""
+    return {
+        "profiles": PROFILE_CACHE.stats(),
+        "shop_pages": SHOP_PAGE_CACHE.stats(),
+    }
+
+
 # ---------- АНИМАЦИИ ----------
 
 
@@ -2366,6 +5502,53 @@ async def cmd_menu(message: Message):
     )
 
 
+@dp.message(Command("campaign"))
+async def cmd_campaign(message: Message):
+    uid = message.from_user.id
+    if access_denied(uid):
+        await message.answer("Этот бот приватный 🌙")
+        return
+
+    parts = (message.text or "").split(maxsplit=1)
+    campaigns = list_campaigns()
+    if len(parts) < 2:
+        current = get_user_campaign(uid)
+        lines = ["▤ <b>Кампании</b>"]
+        for name in campaigns:
+            lines.append(f"{'●' if name == current else '○'} {name}")
+        lines.append("\nСменить: /campaign &lt;название&gt;")
+        await message.answer("\n".join(lines))
+        return
+
+    name = parts[1].strip()
+    if name not in campaigns:
+        await message.answer("Такой кампании нет.")
+        return
+    set_user_campaign(uid, name)
+    catalog = get_catalog(name)
+    await message.answer(
+        f"Кампания: <b>{name}</b>\n"
+        f"Квестов: {len(catalog.main_quests)}, дейликов: {len(catalog.daily_tasks)}, "
+        f"наград в магазине: {len(catalog.shop_rewards)}.\n"
+        f"Прогресс и инвентарь у каждой кампании свои, {COIN_SYMBOL} общие.\n/menu"
+    )
+
+
+@dp.message(Command("stats"))
+async def cmd_stats(message: Message):
+    if access_denied(message.from_user.id):
+        await message.answer("Этот бот приватный 🌙")
+        return
+
+    lines = ["▤ <b>Кэши</b>"]
+    for name, stats in cache_stats().items():
+        lines.append(
+            f"{name}: {stats['hit_rate']:.0%} попаданий "
+            f"({stats['hits']}/{stats['hits'] + stats['misses']}), записей {stats['size']}"
+        )
+    await message.answer("\n".join(lines))
+
+
 @dp.message(
     F.text.in_(
         {
@@ -2412,66 +5595,114 @@ async def on_menu_buttons(message: Message):
         view_text, kb = build_shop_category_menu(message.from_user.id)
         await message.answer(view_text, reply_markup=kb)
     elif text.startswith(MENU_ICONS["inv"]):
-        uid = message.from_user.id
-        rewards = get_active_rewards(uid)
-        if not rewards:
-            text = (
-                "◻ Инвентарь пуст.\n"
-                f"Заработай {COIN_SYMBOL} или открой лутбокс."
-            )
-            kb = [
-                [
-                    InlineKeyboardButton(
-                        text="🎁 К лутбоксам", callback_data="menu:loot"
-                    )
-                ],
-                [InlineKeyboardButton(text="⬅ В меню", callback_data="menu:profile")],
-            ]
-        else:
-            lines = ["◻ <b>Инвентарь</b>\n"]
-            kb = []
-            for rid, name, lvl in rewards:
-                if lvl == 0:
-                    prefix = "✶"
-                elif lvl < 0:
-                    prefix = "◆"
-                else:
-                    prefix = f"[L{lvl}]"
-                lines.append(f"{prefix} {name}")
-                kb.append(
-                    [
-                        InlineKeyboardButton(
-                            text=f"Использовать: {name[:18]}…",
-                            callback_data=f"use:{rid}",
-                        )
-                    ]
-                )
-            kb.append(
-                [InlineKeyboardButton(text="⬅ В меню", callback_data="menu:profile")]
-            )
-            text = "\n".join(lines)
-        await message.answer(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
+        text, kb = build_inventory_view(message.from_user.id)
+        await message.answer(text, reply_markup=kb)
     elif text.startswith(MENU_ICONS["profile"]):
         profile_text, kb = build_profile_view(message.from_user.id)
         await message.answer(profile_text, reply_markup=kb)
 
 
+# ---------- INLINE-ПОИСК ----------
+
+
+def inline_result(kind: str, value: str) -> InlineQueryResultArticle:
+    """Карточка результата; выбор отправляет в чат /item или /daily с токеном."""
+    catalog = active_catalog()
+    token = callback_ref(kind, value)
+    if kind == "shop":
+        item = catalog.shop_by_id.get(value)
+        return InlineQueryResultArticle(
+            id=f"s{token}",
+            title=f"{_shop_icon(item)} {item.name}",
+            description=f"{coin_text(item.price)} · {shop_category_label(item.category)}",
+            input_message_content=InputTextMessageContent(message_text=f"/item {token}"),
+        )
+    task = catalog.daily_tasks[value]
+    return InlineQueryResultArticle(
+        id=f"d{token}",
+        title=task.title,
+        description=f"Дейлик +{coin_text(task.coins)} · {THEME_LABELS.get(task.category, task.category)}",
+        input_message_content=InputTextMessageContent(message_text=f"/daily {token}"),
+    )
+
+
+@dp.inline_query()
+async def on_inline_query(query: InlineQuery):
+    """
+    @бот <запрос>: поиск по наградам и дейликам каталога пользователя.
+    Результаты не зависят от прогресса, поэтому Telegram может их кэшировать;
+    общий кэш включается, только если у всех одинаковый каталог и доступ открыт.
+    """
+    shared = not ALLOWED_USER_IDS and not os.path.isdir(CAMPAIGNS_DIR)
+    if access_denied(query.from_user.id):
+        await query.answer([], cache_time=INLINE_CACHE_TIME, is_personal=True)
+        return
+    catalog = active_catalog()
+    found = catalog.search_index().search(query.query)
+    try:
+        offset = max(int(query.offset or 0), 0)
+    except ValueError:
+        offset = 0
+    page = found[offset:offset + INLINE_RESULTS_LIMIT]
+    entries = catalog.search_index().entries
+    end = offset + len(page)
+    await query.answer(
+        [inline_result(*entries[i][:2]) for i in page],
+        cache_time=INLINE_CACHE_TIME,
+        is_personal=not shared,
+        next_offset=str(end) if end < len(found) else "",
+    )
+
+
+@dp.message(Command("item"))
+async def cmd_item(message: Message):
+    uid = message.from_user.id
+    if access_denied(uid):
+        await message.answer("Этот бот приватный 🌙")
+        return
+    parts = (message.text or "").split(maxsplit=1)
+    try:
+        item = get_shop_reward(CatalogRef("shop")(parts[1].strip()))
+    except (IndexError, ValueError):
+        item = None
+    if not item:
+        await message.answer("Награда не найдена. Поиск: набери @ и имя бота, затем название.")
+        return
+    text, kb = build_shop_item_view(uid, item)
+    await message.answer(text, reply_markup=kb)
+
+
+@dp.message(Command("daily"))
+async def cmd_daily(message: Message):
+    uid = message.from_user.id
+    if access_denied(uid):
+        await message.answer("Этот бот приватный 🌙")
+        return
+    parts = (message.text or "").split(maxsplit=1)
+    try:
+        code = CatalogRef("daily")(parts[1].strip())
+    except (IndexError, ValueError):
+        await message.answer("Дейлик не найден. Поиск: набери @ и имя бота, затем название.")
+        return
+    text, kb = build_daily_card(uid, code, active_catalog().daily_tasks[code])
+    await message.answer(text, reply_markup=kb)
+
+
 # ---------- Обработка разделов меню ----------
 
 
-@dp.callback_query(F.data.startswith("menu:"))
-async def cb_menu(callback: CallbackQuery):
+@CALLBACK_ROUTER.route("menu", ("section", str))
+async def cb_menu(callback: CallbackQuery, section: str):
     uid = callback.from_user.id
     if access_denied(uid):
         await callback.answer("Этот бот приватный 🌙", show_alert=True)
         return
 
-    section = callback.data.split(":", 1)[1]
-
     # КВЕСТ-КАРТА
     if section == "map":
         text, kb = build_map_view(uid)
-        await callback.message.edit_text(
+        await edit_view(
+            callback.message,
             text,
             reply_markup=kb,
         )
@@ -2479,7 +5710,7 @@ async def cb_menu(callback: CallbackQuery):
     # ДЕЙЛИКИ
     elif section == "dailies":
         text, kb = build_dailies_category_menu()
-        await callback.message.edit_text(text, reply_markup=kb)
+        await edit_view(callback.message, text, reply_markup=kb)
 
     # ЛУТБОКСЫ
     elif section == "loot":
@@ -2501,7 +5732,8 @@ async def cb_menu(callback: CallbackQuery):
             )
         kb.append([InlineKeyboardButton(text="⬅ В меню", callback_data="menu:profile")])
 
-        await callback.message.edit_text(
+        await edit_view(
+            callback.message,
             text,
             reply_markup=InlineKeyboardMarkup(inline_keyboard=kb),
         )
@@ -2509,57 +5741,18 @@ async def cb_menu(callback: CallbackQuery):
     # МАГАЗИН НАГРАД
     elif section == "shop":
         text, kb = build_shop_category_menu(uid)
-        await callback.message.edit_text(text, reply_markup=kb)
+        await edit_view(callback.message, text, reply_markup=kb)
 
     # ИНВЕНТАРЬ
     elif section == "inv":
-        rewards = get_active_rewards(uid)
-        if not rewards:
-            text = (
-                "◻ Инвентарь пуст.\n"
-                f"Заработай {COIN_SYMBOL} или открой лутбокс."
-            )
-            kb = [
-                [
-                    InlineKeyboardButton(
-                        text="🎁 К лутбоксам", callback_data="menu:loot"
-                    )
-                ],
-                [InlineKeyboardButton(text="⬅ В меню", callback_data="menu:profile")],
-            ]
-        else:
-            lines = ["◻ <b>Инвентарь</b>\n"]
-            kb = []
-            for rid, name, lvl in rewards:
-                if lvl == 0:
-                    prefix = "✶"
-                elif lvl < 0:
-                    prefix = "◆"
-                else:
-                    prefix = f"[L{lvl}]"
-                lines.append(f"{prefix} {name}")
-                kb.append(
-                    [
-                        InlineKeyboardButton(
-                            text=f"Использовать: {name[:18]}…",
-                            callback_data=f"use:{rid}",
-                        )
-                    ]
-                )
-            kb.append(
-                [InlineKeyboardButton(text="⬅ В меню", callback_data="menu:profile")]
-            )
-            text = "\n".join(lines)
-
-        await callback.message.edit_text(
-            text,
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=kb),
-        )
+        text, kb = build_inventory_view(uid)
+        await edit_view(callback.message, text, reply_markup=kb)
 
     # ПРОФИЛЬ / ГЛАВНОЕ МЕНЮ
     elif section in ("profile", "root"):
         text, kb = build_profile_view(uid)
-        await callback.message.edit_text(
+        await edit_view(
+            callback.message,
             text,
             reply_markup=kb,
         )
@@ -2570,15 +5763,14 @@ async def cb_menu(callback: CallbackQuery):
 # ---------- КВЕСТЫ ----------
 
 
-@dp.callback_query(F.data.startswith("quest:"))
-async def cb_open_quest(callback: CallbackQuery):
+@CALLBACK_ROUTER.route("quest", ("idx", int))
+async def cb_open_quest(callback: CallbackQuery, idx: int):
     uid = callback.from_user.id
     if access_denied(uid):
         await callback.answer("Этот бот приватный 🌙", show_alert=True)
         return
 
-    idx = int(callback.data.split(":", 1)[1])
-    quest = next((q for q in MAIN_QUESTS if q["index"] == idx), None)
+    quest = active_catalog().quests_by_index.get(idx)
     if quest is None:
         await callback.answer("Квест не найден", show_alert=True)
         return
@@ -2593,19 +5785,18 @@ async def cb_open_quest(callback: CallbackQuery):
         return
 
     # Анимация движения по карте
-    await show_path_animation(callback.message, quest["title"])
+    await show_path_animation(callback.message, quest.title)
 
-    label = quest.get("code", str(idx))
-    desc = quest.get("desc") or ""
+    label = quest.code or str(idx)
     parts = [
-        f"📖 <b>Квест {label}: {quest['title']}</b>",
+        f"📖 <b>Квест {label}: {quest.title}</b>",
     ]
-    if desc:
-        parts.append(desc)
-    card_label = REWARD_CARDS[quest["reward_card"]]["label"]
-    box_lvl = RARITY_TO_BOX_LEVEL.get(quest["reward_card"], 1)
+    if quest.desc:
+        parts.append(quest.desc)
+    card_label = REWARD_CARDS[quest.reward_card]["label"]
+    box_lvl = RARITY_TO_BOX_LEVEL.get(quest.reward_card, 1)
     parts.append(
-        f"Награда: <b>{coin_text(quest['reward_coins'])}</b> и выбор 1 награды "
+        f"Награда: <b>{coin_text(quest.reward_coins)}</b> и выбор 1 награды "
         f"из лутбокса L{box_lvl} ({card_label})."
     )
     text = "\n\n".join(parts)
@@ -2624,54 +5815,58 @@ async def cb_open_quest(callback: CallbackQuery):
     await callback.answer()
 
 
-@dp.callback_query(F.data.startswith("quest_done:"))
-async def cb_quest_done(callback: CallbackQuery):
+@CALLBACK_ROUTER.route("quest_done", ("idx", int), idempotent=CALLBACK_DEDUP_TTL)
+async def cb_quest_done(callback: CallbackQuery, idx: int):
     uid = callback.from_user.id
     if access_denied(uid):
-        await callback.answer("Этот бот приватный 🌙", show_alert=True)
-        return
+        return await reject_tap(callback, "Этот бот приватный 🌙")
 
-    idx = int(callback.data.split(":", 1)[1])
-    quest = next((q for q in MAIN_QUESTS if q["index"] == idx), None)
+    quest = active_catalog().quests_by_index.get(idx)
     if quest is None:
-        await callback.answer("Квест не найден", show_alert=True)
-        return
+        return await reject_tap(callback, "Квест не найден")
 
     status = get_main_status(uid, idx)
     if status == "done":
-        await callback.answer("Этот квест уже закрыт ✅", show_alert=True)
-        return
+        return await reject_tap(callback, "Этот квест уже закрыт ✅")
 
     # отмечаем выполненным
     set_main_status(uid, idx, "done")
 
     # разлочим следующий
     # квесты, зависящие от этого кода
-    for code, dep in QUEST_DEPENDENCIES.items():
-        if dep == quest.get("code"):
+    for code, dep in active_catalog().quest_dependencies.items():
+        if dep == quest.code:
             nxt = _quest_by_code(code)
-            if nxt and get_main_status(uid, nxt["index"]) == "locked":
-                set_main_status(uid, nxt["index"], "active")
+            if nxt and get_main_status(uid, nxt.index) == "locked":
+                set_main_status(uid, nxt.index, "active")
     _ensure_unlocks(uid)
 
     # награда монетами
-    coins_reward = quest["reward_coins"]
-    update_coins(uid, coins_reward)
+    coins_reward = quest.reward_coins
+    update_coins(uid, coins_reward, "quest", quest.code or None)
 
     # выбор награды из соответствующего лутбокса
-    box_level = RARITY_TO_BOX_LEVEL.get(quest["reward_card"], 1)
+    box_level = RARITY_TO_BOX_LEVEL.get(quest.reward_card, 1)
     options = pick_rewards(box_level, 3)
     token = uuid.uuid4().hex[:8]
-    QUEST_CHOICES.setdefault(uid, {})[token] = {
+    choices = {
+        t: p
+        for t, p in (SESSIONS.get(uid, "quest_choices") or {}).items()
+        if not quest_choice_expired(p.get("created_at"))
+    }
+    choices[token] = {
         "options": options,
         "box_level": box_level,
+        "created_at": datetime.utcnow().isoformat(),
+        "campaign": get_user_campaign(uid),
     }
+    SESSIONS.set(uid, "quest_choices", choices)
     save_quest_choice(uid, token, box_level, options)
 
     _grant_level_final(uid, _quest_level(quest))
 
     parts = [
-        f"🎉 <b>Квест {quest.get('code', idx)} выполнен!</b>",
+        f"🎉 <b>Квест {quest.code or idx} выполнен!</b>",
         f"Ты получила <b>{coin_text(coins_reward)}</b>.",
         f"Выбери 1 из 3 наград лутбокса L{box_level}:",
     ]
@@ -2693,30 +5888,28 @@ async def cb_quest_done(callback: CallbackQuery):
     await callback.answer()
 
 
-@dp.callback_query(F.data.startswith("questpick:"))
-async def cb_pick_reward(callback: CallbackQuery):
+@CALLBACK_ROUTER.route(
+    "questpick", ("token", str), ("opt_idx", int), invalid="Неверный выбор", idempotent=CALLBACK_DEDUP_TTL
+)
+async def cb_pick_reward(callback: CallbackQuery, token: str, opt_idx: int):
     uid = callback.from_user.id
-    try:
-        _, token, idx_str = callback.data.split(":", 2)
-        opt_idx = int(idx_str)
-    except Exception:
-        await callback.answer("Неверный выбор", show_alert=True)
-        return
-
-    user_choices = QUEST_CHOICES.get(uid, {})
+    user_choices = dict(SESSIONS.get(uid, "quest_choices") or {})
     payload = user_choices.get(token)
     if not payload:
         payload = load_quest_choice(token)
         if payload and payload.get("user_id") != uid:
             payload = None
+    if payload and quest_choice_expired(payload.get("created_at")):
+        payload = None
+    # Награда выдаётся только в той кампании, где закрыт квест.
+    if payload and payload.get("campaign", DEFAULT_CAMPAIGN) != get_user_campaign(uid):
+        payload = None
     if not payload:
-        await callback.answer("Выбор недоступен (устарело). Закрой квест заново.", show_alert=True)
-        return
+        return await reject_tap(callback, "Выбор недоступен (устарело). Закрой квест заново.")
 
     options = payload.get("options", [])
     if not (0 <= opt_idx < len(options)):
-        await callback.answer("Неверный выбор", show_alert=True)
-        return
+        return await reject_tap(callback, "Неверный выбор")
 
     reward_name = options[opt_idx]
     box_level = payload.get("box_level", 0)
@@ -2724,8 +5917,10 @@ async def cb_pick_reward(callback: CallbackQuery):
 
     # очистить выбор, чтобы нельзя было брать многократно
     user_choices.pop(token, None)
-    if not user_choices:
-        QUEST_CHOICES.pop(uid, None)
+    if user_choices:
+        SESSIONS.set(uid, "quest_choices", user_choices)
+    else:
+        SESSIONS.pop(uid, "quest_choices")
     clear_quest_choice(token)
 
     await callback.answer("Награда добавлена в инвентарь ✨", show_alert=False)
@@ -2734,94 +5929,36 @@ async def cb_pick_reward(callback: CallbackQuery):
     )
 
 
-@dp.callback_query(F.data.startswith("level:"))
-async def cb_level(callback: CallbackQuery):
+@CALLBACK_ROUTER.route("level", ("lvl", int), invalid="Уровень не найден")
+async def cb_level(callback: CallbackQuery, lvl: int):
     uid = callback.from_user.id
     if access_denied(uid):
         await callback.answer("Этот бот приватный 🌙", show_alert=True)
         return
 
-    try:
-        lvl = int(callback.data.split(":", 1)[1])
-    except ValueError:
-        await callback.answer("Уровень не найден", show_alert=True)
-        return
+    catalog = active_catalog()
     if not _is_level_open(uid, lvl):
-        schedule = LEVEL_SCHEDULE.get(lvl, {})
+        schedule = catalog.level_schedule.get(lvl, {})
         start = schedule.get("start")
         start_txt = f"Уровень откроется {start.isoformat()}" if start else "Уровень пока закрыт"
         await callback.answer(start_txt, show_alert=True)
         return
 
-    quests = [q for q in MAIN_QUESTS if _quest_level(q) == lvl]
+    quests = catalog.quests_by_level.get(lvl, [])
     if not quests:
         await callback.answer("Нет квестов для уровня", show_alert=True)
         return
 
-    meta = LEVEL_META.get(lvl, {})
-    date_range = meta.get("dates", "")
-    lines = [LEVEL_LABELS.get(lvl, f"Уровень {lvl}")]
-    if date_range:
-        lines.append(f"⏳ {date_range}")
-    final_line = []
-    if meta.get("final_coins") or meta.get("final_cards"):
-        rewards_txt = []
-        coins = meta.get("final_coins", 0)
-        if coins:
-            rewards_txt.append(f"+{coins} coin")
-        for r in meta.get("final_cards", []):
-            rewards_txt.append(REWARD_CARDS.get(r, REWARD_CARDS['common'])['label'])
-        final_line.append("🎯 Финал: " + " + ".join(rewards_txt))
-    if final_line:
-        lines.append("\n".join(final_line))
-    lines.append("")
-    kb = []
-    groups = LEVEL_GROUPS.get(lvl)
-    listed_ids = set()
-
-    def add_q(q):
-        status = get_main_status(uid, q["index"])
-        if status != "done" and not _quest_dependency_met(uid, q):
-            status = "locked"
-        if status == "done":
-            mark = "✓"
-        elif status == "active":
-            mark = "•"
-        else:
-            mark = "✗"
-        label = q.get("code", str(q["index"]))
-        lines.append(f"{mark} {label}. {q['title']}")
-        kb.append(
-            [
-                InlineKeyboardButton(
-                    text=f"Открыть {label}", callback_data=f"quest:{q['index']}"
-                )
-            ]
-        )
-        listed_ids.add(q["index"])
-
-    if groups:
-        for name, codes in groups:
-            lines.append(f"<b>{name}</b>")
-            for code in codes:
-                q = _quest_by_code(code)
-                if q:
-                    add_q(q)
-            lines.append("")
-    # Остальные квесты, если есть
-    for q in quests:
-        if q["index"] not in listed_ids:
-            add_q(q)
-
-    kb.append([InlineKeyboardButton(text="⬅ К карте", callback_data="menu:map")])
-    await callback.message.edit_text(
-        "\n".join(lines),
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=kb),
+    page = catalog.level_page(lvl)
+    await edit_view(
+        callback.message,
+        page.render(get_main_statuses(uid)),
+        reply_markup=page.markup,
     )
     await callback.answer()
 
 
-@dp.callback_query(F.data == "reset:ask")
+@CALLBACK_ROUTER.route("reset:ask")
 async def cb_reset_ask(callback: CallbackQuery):
     uid = callback.from_user.id
     if access_denied(uid):
@@ -2837,14 +5974,15 @@ async def cb_reset_ask(callback: CallbackQuery):
             [InlineKeyboardButton(text="❌ Отмена", callback_data="menu:profile")],
         ]
     )
-    await callback.message.edit_text(
+    await edit_view(
+        callback.message,
         f"Сбросить игру? Будут удалены {COIN_SYMBOL}, прогресс квестов и награды.",
         reply_markup=kb,
     )
     await callback.answer()
 
 
-@dp.callback_query(F.data == "reset:do")
+@CALLBACK_ROUTER.route("reset:do")
 async def cb_reset_do(callback: CallbackQuery):
     uid = callback.from_user.id
     if access_denied(uid):
@@ -2852,22 +5990,48 @@ async def cb_reset_do(callback: CallbackQuery):
         return
     coins = reset_user_progress(uid)
     _ensure_unlocks(uid)
-    await callback.message.edit_text(
+    await edit_view(
+        callback.message,
         f"Игра сброшена. Баланс: {coin_text(coins)}. Прогресс очищен.\n/menu",
         reply_markup=reply_menu_kb(),
     )
     await callback.answer("Сброшено")
 
 
-@dp.message(F.text & (lambda msg: msg.from_user.id in DAILY_SEARCH_WAIT))
+# Кто ждёт ввода поиска — отметка в памяти процесса (игрок всегда попадает в один воркер).
+# Без неё фильтр ходил бы в session_state на каждое текстовое сообщение.
+_SEARCH_PENDING: "OrderedDict[int, None]" = OrderedDict()
+
+
+def mark_search_pending(uid: int):
+    SESSIONS.set(uid, "daily_search", True)
+    _SEARCH_PENDING[uid] = None
+    _SEARCH_PENDING.move_to_end(uid)
+    while len(_SEARCH_PENDING) > SESSION_MAX_USERS:
+        _SEARCH_PENDING.popitem(last=False)
+
+
+def search_pending(message: Message) -> bool:
+    uid = message.from_user.id
+    if uid not in _SEARCH_PENDING:
+        return False
+    if SESSIONS.get(uid, "daily_search"):
+        return True
+    # Сессия истекла по TTL — отметка тоже больше не нужна.
+    _SEARCH_PENDING.pop(uid, None)
+    return False
+
+
+@dp.message(F.text, search_pending)
 async def on_daily_search(message: Message):
     uid = message.from_user.id
-    DAILY_SEARCH_WAIT.pop(uid, None)
+    SESSIONS.pop(uid, "daily_search")
+    _SEARCH_PENDING.pop(uid, None)
     query = message.text.strip()
     if not query or query.startswith("/"):
         await message.answer("Поиск отменён.")
         return
-    state = DAILY_FILTER_STATE.get(uid, {"filter_coin": "all", "category": "all"})
+    state = SESSIONS.get(uid, "daily_filter") or {"filter_coin": "all", "category": "all"}
     text, kb = build_dailies_view(
         uid,
         filter_coin=state.get("filter_coin", "all"),
@@ -2881,101 +6045,92 @@ async def on_daily_search(message: Message):
 # ---------- ДЕЙЛИКИ ----------
 
 
-@dp.callback_query(F.data.startswith("daily:"))
-async def cb_daily(callback: CallbackQuery):
+@CALLBACK_ROUTER.route("daily", ("code", CatalogRef("daily")))
+async def cb_daily(callback: CallbackQuery, code: str):
     uid = callback.from_user.id
     if access_denied(uid):
         await callback.answer("Этот бот приватный 🌙", show_alert=True)
         return
 
-    code = callback.data.split(":", 1)[1]
-    if code not in DAILY_TASKS:
+    daily_tasks = active_catalog().daily_tasks
+    if code not in daily_tasks:
         await callback.answer("Нет такого задания", show_alert=True)
         return
 
     today = date.today().isoformat()
     done_before = get_daily_done(uid, code, today)
 
+    # Пишем через журнал: серия отметок уйдёт в БД одной транзакцией.
     if not done_before:
-        set_daily_done(uid, code, today, True)
-        coins = DAILY_TASKS[code]["coins"]
-        update_coins(uid, coins)
+        DAILY_JOURNAL.set_daily_done(uid, code, today, True)
+        coins = daily_tasks[code].coins
+        DAILY_JOURNAL.add_coins(uid, coins, "daily", f"{code}:{today}")
         await callback.answer(f"+{coin_text(coins)}", show_alert=False)
     else:
-        set_daily_done(uid, code, today, False)
-        coins = DAILY_TASKS[code]["coins"]
-        update_coins(uid, -coins)
+        DAILY_JOURNAL.set_daily_done(uid, code, today, False)
+        coins = daily_tasks[code].coins
+        DAILY_JOURNAL.add_coins(uid, -coins, "daily_undo", f"{code}:{today}")
         await callback.answer(f"-{coin_text(coins)} (отмена)", show_alert=False)
 
     text, kb = build_dailies_view(uid)
-    await callback.message.edit_text(text, reply_markup=kb)
+    await edit_view(callback.message, text, reply_markup=kb)
 
 
-@dp.callback_query(F.data.startswith("dailies:"))
-async def cb_dailies_filter(callback: CallbackQuery):
+@CALLBACK_ROUTER.route("dailies:search")
+async def cb_dailies_search(callback: CallbackQuery):
     uid = callback.from_user.id
     if access_denied(uid):
         await callback.answer("Этот бот приватный 🌙", show_alert=True)
         return
+    mark_search_pending(uid)
+    await callback.answer()
+    await callback.message.answer("⌕ Введи текст для поиска дейликов (или /cancel)")
 
-    parts = callback.data.split(":")
-    # dailies:filter:<coin>:<category>:<page> OR dailies:cat:<category>:<coin>:<page> OR dailies:search OR dailies:catmenu
-    if len(parts) >= 2 and parts[1] == "search":
-        DAILY_SEARCH_WAIT[uid] = True
-        await callback.answer()
-        await callback.message.answer("⌕ Введи текст для поиска дейликов (или /cancel)")
-        return
-    if len(parts) >= 2 and parts[1] == "catmenu":
-        text, kb = build_dailies_category_menu()
-        await callback.message.edit_text(text, reply_markup=kb)
-        await callback.answer()
+
+@CALLBACK_ROUTER.route("dailies:catmenu")
+async def cb_dailies_catmenu(callback: CallbackQuery):
+    if access_denied(callback.from_user.id):
+        await callback.answer("Этот бот приватный 🌙", show_alert=True)
         return
+    text, kb = build_dailies_category_menu()
+    await edit_view(callback.message, text, reply_markup=kb)
+    await callback.answer()
 
-    filter_coin = "all"
-    category = "all"
-    page = 0
 
-    if len(parts) >= 2 and parts[1] == "filter":
-        filter_coin = parts[2] if len(parts) > 2 else "all"
-        category = parts[3] if len(parts) > 3 else "all"
-        try:
-            page = int(parts[4]) if len(parts) > 4 else 0
-        except ValueError:
-            page = 0
-    elif len(parts) >= 2 and parts[1] == "cat":
-        category = parts[2] if len(parts) > 2 else "all"
-        filter_coin = parts[3] if len(parts) > 3 else "all"
-        try:
-            page = int(parts[4]) if len(parts) > 4 else 0
-        except ValueError:
-            page = 0
+@CALLBACK_ROUTER.route(
+    "dailies:filter", ("filter_coin", str, "all"), ("category", CatalogRef("theme"), "all"), ("page", int, 0)
+)
+@CALLBACK_ROUTER.route(
+    "dailies:cat", ("category", CatalogRef("theme"), "all"), ("filter_coin", str, "all"), ("page", int, 0)
+)
+async def cb_dailies_filter(callback: CallbackQuery, filter_coin: str, category: str, page: int):
+    uid = callback.from_user.id
+    if access_denied(uid):
+        await callback.answer("Этот бот приватный 🌙", show_alert=True)
+        return
 
     text, kb = build_dailies_view(
         uid, filter_coin=filter_coin, search_term="", page=page, category=category
     )
-    await callback.message.edit_text(text, reply_markup=kb)
+    await edit_view(callback.message, text, reply_markup=kb)
     await callback.answer()
 
 
 # ---------- МАГАЗИН ----------
 
 
-@dp.callback_query(F.data.startswith("shop:list:"))
-async def cb_shop_list(callback: CallbackQuery):
+@CALLBACK_ROUTER.route("shop:list", ("page", int, 0))
+async def cb_shop_list(callback: CallbackQuery, page: int):
     uid = callback.from_user.id
     if access_denied(uid):
         await callback.answer("Этот бот приватный 🌙", show_alert=True)
         return
-    try:
-        page = int(callback.data.split(":", 2)[2])
-    except ValueError:
-        page = 0
     text, kb = build_shop_view(uid, page=page)
-    await callback.message.edit_text(text, reply_markup=kb)
+    await edit_view(callback.message, text, reply_markup=kb)
     await callback.answer()
 
 
-@dp.callback_query(F.data == "shop:reset")
+@CALLBACK_ROUTER.route("shop:reset")
 async def cb_shop_reset(callback: CallbackQuery):
     uid = callback.from_user.id
     if access_denied(uid):
@@ -2983,130 +6138,98 @@ async def cb_shop_reset(callback: CallbackQuery):
         return
     reset_shop_filters(uid)
     text, kb = build_shop_view(uid, page=0)
-    await callback.message.edit_text(text, reply_markup=kb)
+    await edit_view(callback.message, text, reply_markup=kb)
     await callback.answer("Фильтры сброшены")
 
 
-@dp.callback_query(F.data == "shop:catmenu")
+@CALLBACK_ROUTER.route("shop:catmenu")
 async def cb_shop_catmenu(callback: CallbackQuery):
     uid = callback.from_user.id
     if access_denied(uid):
         await callback.answer("Этот бот приватный 🌙", show_alert=True)
         return
     text, kb = build_shop_category_menu(uid)
-    await callback.message.edit_text(text, reply_markup=kb)
+    await edit_view(callback.message, text, reply_markup=kb)
     await callback.answer()
 
 
-@dp.callback_query(F.data.startswith("shop:cat:"))
-async def cb_shop_set_category(callback: CallbackQuery):
+@CALLBACK_ROUTER.route("shop:cat", ("category", CatalogRef("shopcat"), "all"))
+async def cb_shop_set_category(callback: CallbackQuery, category: str):
     uid = callback.from_user.id
     if access_denied(uid):
         await callback.answer("Этот бот приватный 🌙", show_alert=True)
         return
-    category = callback.data.split(":", 2)[2]
-    filters = get_shop_filters(uid)
-    filters["category"] = category
+    set_shop_filter(uid, "category", category)
     text, kb = build_shop_view(uid, page=0)
-    await callback.message.edit_text(text, reply_markup=kb)
+    await edit_view(callback.message, text, reply_markup=kb)
     await callback.answer()
 
 
-@dp.callback_query(F.data == "shop:pricemenu")
+@CALLBACK_ROUTER.route("shop:pricemenu")
 async def cb_shop_pricemenu(callback: CallbackQuery):
     uid = callback.from_user.id
     if access_denied(uid):
         await callback.answer("Этот бот приватный 🌙", show_alert=True)
         return
     kb = build_shop_price_kb(uid)
-    await callback.message.edit_text(
+    await edit_view(
+        callback.message,
         "Цена:",
         reply_markup=kb,
     )
     await callback.answer()
 
 
-@dp.callback_query(F.data.startswith("shop:price:"))
-async def cb_shop_set_price(callback: CallbackQuery):
+@CALLBACK_ROUTER.route("shop:price", ("value", str))
+@CALLBACK_ROUTER.route("shop:price:max", ("max_price", int))
+async def cb_shop_set_price(callback: CallbackQuery, value: str = "", max_price: Optional[int] = None):
     uid = callback.from_user.id
     if access_denied(uid):
         await callback.answer("Этот бот приватный 🌙", show_alert=True)
         return
-    parts = callback.data.split(":")
-    if len(parts) >= 3:
-        val = parts[2]
-        if val == "all":
-            get_shop_filters(uid)["price"] = "all"
-        elif val == "balance":
-            get_shop_filters(uid)["price"] = "balance"
-        elif val == "max" and len(parts) >= 4:
-            get_shop_filters(uid)["price"] = f"max:{parts[3]}"
+    if max_price is not None:
+        set_shop_filter(uid, "price", f"max:{max_price}")
+    elif value in ("all", "balance"):
+        set_shop_filter(uid, "price", value)
     text, kb = build_shop_view(uid, page=0)
-    await callback.message.edit_text(text, reply_markup=kb)
+    await edit_view(callback.message, text, reply_markup=kb)
     await callback.answer()
 
 
-@dp.callback_query(F.data.startswith("shop:item:"))
-async def cb_shop_item(callback: CallbackQuery):
+@CALLBACK_ROUTER.route("shop:item", ("item_id", CatalogRef("shop")))
+async def cb_shop_item(callback: CallbackQuery, item_id: str):
     uid = callback.from_user.id
     if access_denied(uid):
         await callback.answer("Этот бот приватный 🌙", show_alert=True)
         return
-    item_id = callback.data.split(":", 2)[2]
     item = get_shop_reward(item_id)
     if not item:
         await callback.answer("Награда не найдена", show_alert=True)
         return
-    icon = _shop_icon(item)
-    cat_label = shop_category_label(item.get("category", ""))
-    coins = get_coins(uid)
-    lines = [
-        f"{icon} <b>{item.get('name')}</b>",
-        f"{coin_text(int(item.get('price', 0)))} · {cat_label}",
-        f"Баланс: {coin_text(coins)}",
-    ]
-    if item.get("description"):
-        lines.append("")
-        lines.append(item.get("description"))
-    kb = [
-        [
-            InlineKeyboardButton(
-                text=f"Купить за {coin_text(int(item.get('price', 0)))}",
-                callback_data=f"shop:buy:{item.get('id')}",
-            )
-        ],
-        [InlineKeyboardButton(text="⬅ К списку", callback_data="menu:shop")],
-    ]
-    await callback.message.edit_text(
-        "\n".join(lines),
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=kb),
-    )
+    text, kb = build_shop_item_view(uid, item)
+    await edit_view(callback.message, text, reply_markup=kb)
     await callback.answer()
 
 
-@dp.callback_query(F.data.startswith("shop:buy:"))
-async def cb_shop_buy(callback: CallbackQuery):
+@CALLBACK_ROUTER.route("shop:buy", ("item_id", CatalogRef("shop")), idempotent=CALLBACK_TAP_WINDOW)
+async def cb_shop_buy(callback: CallbackQuery, item_id: str):
     uid = callback.from_user.id
     if access_denied(uid):
-        await callback.answer("Этот бот приватный 🌙", show_alert=True)
-        return
-    item_id = callback.data.split(":", 2)[2]
+        return await reject_tap(callback, "Этот бот приватный 🌙")
     item = get_shop_reward(item_id)
     if not item:
-        await callback.answer("Награда не найдена", show_alert=True)
-        return
-    price = int(item.get("price", 0))
+        return await reject_tap(callback, "Награда не найдена")
+    price = item.price
     coins = get_coins(uid)
     if coins < price:
-        await callback.answer(f"Недостаточно {COIN_SYMBOL} 💸", show_alert=True)
-        return
+        return await reject_tap(callback, f"Недостаточно {COIN_SYMBOL} 💸")
 
-    update_coins(uid, -price)
-    add_reward(uid, item.get("name"), -1)
+    update_coins(uid, -price, "shop", item_id)
+    add_reward(uid, item.name, -1)
     new_balance = get_coins(uid)
     await callback.answer("Награда добавлена в инвентарь ✨", show_alert=False)
     await callback.message.answer(
-        f"🛒 Куплено: <b>{item.get('name')}</b> за {coin_text(price)}.\n"
+        f"🛒 Куплено: <b>{item.name}</b> за {coin_text(price)}.\n"
         f"Осталось: <b>{coin_text(new_balance)}</b>.\n"
         "Награда появилась в инвентаре. /menu"
     )
@@ -3115,26 +6238,22 @@ async def cb_shop_buy(callback: CallbackQuery):
 # ---------- ЛУТБОКСЫ ----------
 
 
-@dp.callback_query(F.data.startswith("buy:"))
-async def cb_buy(callback: CallbackQuery):
+@CALLBACK_ROUTER.route("buy", ("lvl", int), invalid="Нет такого лутбокса", idempotent=CALLBACK_TAP_WINDOW)
+async def cb_buy(callback: CallbackQuery, lvl: int):
     uid = callback.from_user.id
     if access_denied(uid):
-        await callback.answer("Этот бот приватный 🌙", show_alert=True)
-        return
+        return await reject_tap(callback, "Этот бот приватный 🌙")
 
-    lvl = int(callback.data.split(":", 1)[1])
     box = LOOTBOXES.get(lvl)
     if not box:
-        await callback.answer("Нет такого лутбокса", show_alert=True)
-        return
+        return await reject_tap(callback, "Нет такого лутбокса")
 
     coins = get_coins(uid)
     if coins < box["price"]:
-        await callback.answer(f"Недостаточно {COIN_SYMBOL} 💸", show_alert=True)
-        return
+        return await reject_tap(callback, f"Недостаточно {COIN_SYMBOL} 💸")
 
     # списываем монеты
-    update_coins(uid, -box["price"])
+    update_coins(uid, -box["price"], "lootbox", f"box:{lvl}")
 
     # анимация открытия
     msg = await callback.message.answer("🎁 Лутбокс куплен. Открываем…")
@@ -3158,15 +6277,25 @@ async def cb_buy(callback: CallbackQuery):
 # ---------- ИСПОЛЬЗОВАНИЕ НАГРАД ----------
 
 
-@dp.callback_query(F.data.startswith("use:"))
-async def cb_use(callback: CallbackQuery):
+@CALLBACK_ROUTER.route("inv:page", ("before_id", int, 0))
+async def cb_inventory_page(callback: CallbackQuery, before_id: int):
     uid = callback.from_user.id
     if access_denied(uid):
         await callback.answer("Этот бот приватный 🌙", show_alert=True)
         return
+    text, kb = build_inventory_view(uid, before_id or None)
+    await edit_view(callback.message, text, reply_markup=kb)
+    await callback.answer()
+
+
+@CALLBACK_ROUTER.route("use", ("rid", int), invalid="Награда не найдена", idempotent=CALLBACK_DEDUP_TTL)
+async def cb_use(callback: CallbackQuery, rid: int):
+    uid = callback.from_user.id
+    if access_denied(uid):
+        return await reject_tap(callback, "Этот бот приватный 🌙")
 
-    rid = int(callback.data.split(":", 1)[1])
-    mark_reward_used(rid)
+    if not mark_reward_used(uid, rid):
+        return await reject_tap(callback, "Эта награда уже использована", show_alert=False)
 
     await callback.answer("Награда использована ✨", show_alert=False)
     await callback.message.answer(
@@ -3175,19 +6304,232 @@ async def cb_use(callback: CallbackQuery):
     )
 
 
+# ================== НЕСКОЛЬКО ВОРКЕРОВ ==================
+
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "1000"))
+# Сколько роутер ждёт места в очереди воркера, прежде чем отбросить апдейт.
+WORKER_PUT_TIMEOUT = float(os.getenv("WORKER_PUT_TIMEOUT", "1"))
+HASH_RING_REPLICAS = 64
+
+
+class HashRing:
+    """Консистентное хэширование user_id -> воркер (с виртуальными узлами)."""
+
+    def __init__(self, nodes: List[str], replicas: int = HASH_RING_REPLICAS):
+        self._ring: List[Tuple[int, str]] = sorted(
+            (self._hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas)
+        )
+        self._keys = [h for h, _ in self._ring]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+    def node_for(self, key) -> str:
+        idx = bisect.bisect(self._keys, self._hash(str(key))) % len(self._keys)
+        return self._ring[idx][1]
+
+
+def update_user_id(update) -> int:
+    event = update.event
+    user = getattr(event, "from_user", None)
+    return user.id if user else 0
+
+
+def _worker_main(worker_id: int, queue):
+    """Точка входа процесса-воркера: получает апдейты своих пользователей из очереди."""
+    asyncio.run(_worker_loop(worker_id, queue))
+
+
+async def _worker_loop(worker_id: int, queue):
+    from aiogram.types import Update
+
+    refresh_content()
+    journal_task = asyncio.create_task(DAILY_JOURNAL.run())
+    tasks = set()
+    print(f"Воркер {worker_id} запущен")
+    try:
+        while True:
+            payload = await asyncio.to_thread(queue.get)
+            if payload is None:
+                break
+            update = Update.model_validate_json(payload, context={"bot": bot})
+            task = asyncio.create_task(dp.feed_update(bot, update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        journal_task.cancel()
+        DAILY_JOURNAL.flush()
+        await bot.session.close()
+
+
+class WorkerPool:
+    """
+    Процессы-воркеры с очередями апдейтов. Апдейт уходит воркеру, выбранному
+    по user_id через HashRing. Упавший воркер перезапускается на той же очереди,
+    а переполненная очередь теряет апдейт, но не останавливает роутер для остальных.
+    """
+
+    def __init__(self, count: int, ctx=None, target=_worker_main, put_timeout: float = WORKER_PUT_TIMEOUT):
+        self.ctx = ctx or multiprocessing.get_context("spawn")
+        self.target = target
+        self.put_timeout = put_timeout
+        self.ring = HashRing([str(i) for i in range(count)])
+        self.queues = [self.ctx.Queue(maxsize=WORKER_QUEUE_SIZE) for _ in range(count)]
+        self.procs: List = [None] * count
+        self.restarts = 0
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self.queues)
+
+    def start(self, worker_id: int):
+        proc = self.ctx.Process(target=self.target, args=(worker_id, self.queues[worker_id]), daemon=True)
+        proc.start()
+        self.procs[worker_id] = proc
+
+    def start_all(self):
+        for worker_id in range(len(self.queues)):
+            self.start(worker_id)
+
+    def ensure_alive(self) -> int:
+        """Перезапускает умершие воркеры. Возвращает, сколько перезапущено."""
+        restarted = 0
+        for worker_id, proc in enumerate(self.procs):
+            if proc is not None and not proc.is_alive():
+                print(f"Воркер {worker_id} завершился (код {proc.exitcode}), перезапускаю")
+                self.start(worker_id)
+                restarted += 1
+        self.restarts += restarted
+        return restarted
+
+    def worker_for(self, user_id: int) -> int:
+        return int(self.ring.node_for(user_id))
+
+    def put(self, update) -> bool:
+        """Кладёт апдейт в очередь воркера его пользователя; False — очередь полна, апдейт отброшен."""
+        worker_id = self.worker_for(update_user_id(update))
+        try:
+            self.queues[worker_id].put(update.model_dump_json(exclude_none=True), timeout=self.put_timeout)
+        except Full:
+            self.dropped += 1
+            print(f"Очередь воркера {worker_id} переполнена: апдейт {update.update_id} отброшен")
+            return False
+        return True
+
+    def stop(self):
+        for worker_queue in self.queues:
+            try:
+                worker_queue.put(None, timeout=self.put_timeout)
+            except Full:
+                pass
+        for proc in self.procs:
+            if proc is not None:
+                proc.join(timeout=10)
+                if proc.is_alive():
+                    proc.terminate()
+
+
+async def _route_updates(pool: WorkerPool) -> None:
+    """
+    Единственный процесс, который опрашивает Telegram. Каждый апдейт уходит
+    воркеру своего пользователя, поэтому кэши профилей и журнал дейликов
+    в каждом воркере видят всех «своих» пользователей целиком.
+    """
+    allowed = dp.resolve_used_update_types()
+    await bot.delete_webhook(drop_pending_updates=True)
+    maintenance_task = asyncio.create_task(maintenance_loop())
+    offset = None
+    print(f"Роутер запущен, воркеров: {len(pool)}")
+    try:
+        while True:
+            updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed)
+            pool.ensure_alive()
+            for update in updates:
+                offset = update.update_id + 1
+                await asyncio.to_thread(pool.put, update)
+    finally:
+        maintenance_task.cancel()
+        await bot.session.close()
+
+
+def run_workers(count: int):
+    """
+    Запускает роутер и count процессов-воркеров на одной машине. Общее
+    состояние живёт в SQLite (WAL): сессии и защита от повторных callback
+    переключаются на sqlite, иначе каждый воркер видел бы только свою память.
+    """
+    os.environ["SESSION_BACKEND"] = "sqlite"
+    os.environ["CALLBACK_DEDUP_BACKEND"] = "sqlite"
+    init_db()
+    pool = WorkerPool(count)
+    pool.start_all()
+    try:
+        asyncio.run(_route_updates(pool))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.stop()
+
+
 # ================== ЗАПУСК ==================
 
 
 async def main():
-    refresh_reward_table()
-    refresh_shop_rewards()
-    refresh_tasks_from_docx()
+    refresh_content()
     init_db()
     # Очистим возможный вебхук, чтобы polling не конфликтовал с другими инстансами.
     await bot.delete_webhook(drop_pending_updates=True)
+    journal_task = asyncio.create_task(DAILY_JOURNAL.run())
+    maintenance_task = asyncio.create_task(maintenance_loop())
     print("Bot started")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        journal_task.cancel()
+        maintenance_task.cancel()
+        DAILY_JOURNAL.flush()
+
+
+def cli(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="RLViGame bot")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=BOT_WORKERS,
+        help="сколько процессов-воркеров запустить (1 — обычный polling)",
+    )
+    commands = parser.add_subparsers(dest="command")
+    import_users = commands.add_parser("import-users", help="перенести data/users.json в БД")
+    import_users.add_argument("path", nargs="?", default=USERS_JSON_FILE)
+    import_users.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    backup = commands.add_parser("backup", help="горячий бэкап БД (можно при работающем боте)")
+    backup.add_argument("dest", nargs="?", default=None)
+    export = commands.add_parser("export", help="выгрузить таблицы в JSONL")
+    export.add_argument("out_dir", nargs="?", default="export")
+    export.add_argument("--tables", nargs="*", default=None)
+    compile_cmd = commands.add_parser("compile-content", help="проверить контент и собрать артефакт")
+    compile_cmd.add_argument("--bundle", default=None, help="JSON-бандл вместо xlsx/docx/json")
+    compile_cmd.add_argument("--out", default=CONTENT_ARTIFACT)
+    compile_cmd.add_argument("--write-bundle", default=None, help="сохранить бандл в JSON")
+    args = parser.parse_args(argv)
+    if args.command == "compile-content":
+        if not compile_content(args.bundle, args.out, args.write_bundle):
+            raise SystemExit(1)
+    elif args.command == "import-users":
+        import_users_json(args.path, args.batch_size)
+    elif args.command == "backup":
+        print(f"Бэкап сохранён: {backup_database(args.dest)}")
+    elif args.command == "export":
+        export_jsonl(args.out_dir, args.tables)
+    elif args.workers > 1:
+        run_workers(args.workers)
+    else:
+        asyncio.run(main())
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    cli()
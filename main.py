@@ -1,7 +1,5 @@
-import asyncio
-
-from bot import main as bot_main
+from bot import cli
 
 
 if __name__ == "__main__":
-    asyncio.run(bot_main())
+    cli()
@@ -0,0 +1,35 @@
+import os
+import sys
+import zipfile
+from xml.sax.saxutils import escape
+
+# bot.py читает окружение при импорте: токен нужен только формально, БД — временная.
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN_TEST_TOKEN_TEST_TOKEN_123")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+import bot  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Чистая база на тест; кэши и журнал не переносят состояние между тестами."""
+    monkeypatch.setattr(bot, "DB_PATH", str(tmp_path / "game.db"))
+    bot.init_db()
+    bot.PROFILE_CACHE._items.clear()
+    yield bot.DB_PATH
+    bot.PROFILE_CACHE._items.clear()
+
+
+def make_docx(path, paragraphs):
+    """Минимальный docx: только word/document.xml с абзацами по одному текстовому run."""
+    body = "".join(f"<w:p><w:r><w:t>{escape(text)}</w:t></w:r></w:p>" for text in paragraphs)
+    xml = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f"<w:body>{body}</w:body></w:document>"
+    )
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("word/document.xml", xml)
+    return path
@@ -0,0 +1,104 @@
+import pytest
+
+import bot
+
+LONG = "очень-длинный-идентификатор-награды-из-таблицы-контента-"
+
+
+def make_catalog(items: int, version: str = "v1") -> bot.Catalog:
+    shop = [
+        bot.ShopItem(id=f"{LONG}{i}", name=f"Награда {i}", category=f"категория-с-длинным-названием-{i % 7}", price=i)
+        for i in range(items)
+    ]
+    dailies = {
+        f"{LONG}d{i}": bot.DailyTask(code=f"{LONG}d{i}", title=f"Дейлик {i}", category=f"тема-{i % 5}")
+        for i in range(items)
+    }
+    return bot.Catalog("ids", version, [], dailies, shop, {})
+
+
+@pytest.fixture
+def catalog(monkeypatch):
+    # 5000 значений — номера занимают уже три base64-цифры.
+    catalog = make_catalog(5000)
+    token = bot.CURRENT_CATALOG.set(catalog)
+    monkeypatch.setattr(bot, "get_coins", lambda uid: 10**9)
+    monkeypatch.setattr(bot, "get_shop_filters", lambda uid: {"category": "all", "price": "all"})
+    monkeypatch.setattr(bot, "SHOP_PAGE_CACHE", bot.RenderCache(100))
+    yield catalog
+    bot.CURRENT_CATALOG.reset(token)
+
+
+@pytest.mark.parametrize("kind", list(bot.CALLBACK_ID_SOURCES))
+def test_every_value_round_trips(catalog, kind):
+    table = catalog.callback_ids(kind)
+    tokens = [table.encode(value) for value in table.values]
+    assert len(set(tokens)) == len(tokens)
+    assert [table.decode(token) for token in tokens] == table.values
+
+
+def test_unknown_value_uses_fallback_or_raises(catalog):
+    assert catalog.callback_ids("shopcat").encode("нет такой") == catalog.callback_ids("shopcat").encode("all")
+    with pytest.raises(KeyError):
+        catalog.callback_ids("shop").encode("нет такой")
+
+
+def test_tag_is_stable_between_processes_and_changes_with_content(catalog):
+    # Одинаковые значения — одна метка: кнопку поймёт любой воркер и после рестарта.
+    same = make_catalog(5000, version="v2")
+    assert same.callback_ids("shop").tag == catalog.callback_ids("shop").tag
+    token = catalog.callback_ids("shop").encode(f"{LONG}7")
+    assert same.callback_ids("shop").decode(token) == f"{LONG}7"
+
+    reloaded = make_catalog(5001, version="v3")
+    with pytest.raises(ValueError):
+        reloaded.callback_ids("shop").decode(token)
+
+
+@pytest.mark.parametrize("suffix", ["", "!", "AAAAA"])
+def test_garbage_tokens_are_rejected(catalog, suffix):
+    table = catalog.callback_ids("shop")
+    with pytest.raises(ValueError):
+        table.decode(table.tag + suffix)
+
+
+def test_out_of_range_or_foreign_tokens_are_rejected(catalog):
+    table = catalog.callback_ids("shop")
+    with pytest.raises(ValueError):
+        table.decode(table.tag + bot.encode_callback_int(len(table.values)))
+    with pytest.raises(ValueError):
+        table.decode(catalog.callback_ids("daily").encode(f"{LONG}d1"))
+
+
+def test_stale_button_after_reload_gets_a_refusal(catalog):
+    data = f"shop:buy:{bot.callback_ref('shop', f'{LONG}42')}"
+    route, payload = bot.CALLBACK_ROUTER.match(data)
+    assert (route.handler, payload) == (bot.cb_shop_buy, {"item_id": f"{LONG}42"})
+
+    reloaded = make_catalog(4999, version="v2")
+    bot.CURRENT_CATALOG.set(reloaded)
+    route, payload = bot.CALLBACK_ROUTER.match(data)
+    assert route.handler is bot.cb_shop_buy and payload is None
+
+
+def _callback_data(markup):
+    return [button.callback_data for row in markup.inline_keyboard for button in row if button.callback_data]
+
+
+def test_rendered_buttons_fit_telegram_limit(catalog, db):
+    last = len(catalog.shop_rewards) - 1
+    item = catalog.shop_rewards[last]
+    data = _callback_data(bot.build_shop_view(1, page=last // bot.SHOP_PAGE_SIZE)[1])
+    data += _callback_data(bot.build_shop_item_view(1, item)[1])
+    data += _callback_data(bot.build_shop_categories_kb(1))
+    data += _callback_data(bot.build_dailies_category_menu()[1])
+    data += _callback_data(bot.build_dailies_view(1, category="тема-4", page=10**6)[1])
+
+    assert any(value.startswith("shop:buy:") for value in data)
+    assert any(value.startswith("daily:") for value in data)
+    assert max(len(value.encode("utf-8")) for value in data) <= 64
+    # Ни одно длинное значение не попало в кнопку целиком.
+    assert not any(LONG in value for value in data)
+    for value in data:
+        route, payload = bot.CALLBACK_ROUTER.match(value)
+        assert route is not None and payload is not None, value
@@ -0,0 +1,139 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import bot
+
+WINDOW = 3
+
+
+class FakeCallback:
+    """CallbackQuery с нужными middleware полями; ответы копятся в answers."""
+
+    def __init__(self, callback_id: str, data: str = "shop:buy:x", uid: int = 1, message_id: int = 10):
+        self.id = callback_id
+        self.data = data
+        self.from_user = SimpleNamespace(id=uid)
+        self.answers = []
+        self.sent = []
+
+        async def send(text, **kwargs):
+            self.sent.append(text)
+
+        self.message = SimpleNamespace(chat=SimpleNamespace(id=uid), message_id=message_id, answer=send)
+
+    async def answer(self, text=None, show_alert=False):
+        self.answers.append(text)
+
+
+def route(window=WINDOW):
+    return {"callback_route": SimpleNamespace(flags={"idempotent": window} if window else {})}
+
+
+def tap(middleware, callback, handler, window=WINDOW):
+    return asyncio.run(middleware(handler, callback, route(window)))
+
+
+class Handler:
+    def __init__(self, result=None, error=None):
+        self.calls = 0
+        self.result = result
+        self.error = error
+
+    async def __call__(self, event, data):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return self.result
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(bot.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(bot.time, "time", lambda: now[0])
+    return now
+
+
+def test_redelivered_callback_is_skipped():
+    middleware = bot.CallbackDedupMiddleware(bot.MemoryDedupCache(100))
+    handler = Handler("ok")
+    first, again = FakeCallback("c1"), FakeCallback("c1", message_id=99)
+    assert tap(middleware, first, handler) == "ok"
+    assert tap(middleware, again, handler) is None
+    assert handler.calls == 1
+    assert again.answers == ["Уже учтено ✓"]
+    assert middleware.skipped == 1
+
+
+def test_double_tap_is_skipped_only_inside_window(clock):
+    middleware = bot.CallbackDedupMiddleware(bot.MemoryDedupCache(100))
+    handler = Handler()
+    tap(middleware, FakeCallback("c1"), handler)
+    clock[0] += WINDOW - 0.5
+    tap(middleware, FakeCallback("c2"), handler)
+    assert handler.calls == 1
+    clock[0] += WINDOW
+    tap(middleware, FakeCallback("c3"), handler)
+    assert handler.calls == 2
+
+
+def test_routes_without_flag_are_not_deduplicated():
+    middleware = bot.CallbackDedupMiddleware(bot.MemoryDedupCache(100))
+    handler = Handler()
+    for _ in range(3):
+        tap(middleware, FakeCallback("c1"), handler, window=None)
+    assert handler.calls == 3
+
+
+def test_rejected_or_failed_tap_can_be_retried_at_once():
+    middleware = bot.CallbackDedupMiddleware(bot.MemoryDedupCache(100))
+    rejecting = Handler(bot.TAP_REJECTED)
+    assert tap(middleware, FakeCallback("c1"), rejecting) is None
+    failing = Handler(error=RuntimeError("db"))
+    with pytest.raises(RuntimeError):
+        tap(middleware, FakeCallback("c2"), failing)
+    accepting = Handler("ok")
+    assert tap(middleware, FakeCallback("c3"), accepting) == "ok"
+    assert (rejecting.calls, failing.calls, accepting.calls) == (1, 1, 1)
+    assert middleware.skipped == 0
+
+
+def test_shop_buy_with_too_few_coins_does_not_burn_the_window(db, monkeypatch):
+    item = next(iter(bot.active_catalog().shop_rewards))
+    coins = {"value": item.price - 1}
+    monkeypatch.setattr(bot, "get_coins", lambda uid: coins["value"])
+    middleware = bot.CallbackDedupMiddleware(bot.MemoryDedupCache(100))
+
+    async def buy(event, data):
+        return await bot.cb_shop_buy(event, item.id)
+
+    poor = FakeCallback("c1")
+    tap(middleware, poor, buy)
+    assert poor.answers == [f"Недостаточно {bot.COIN_SYMBOL} 💸"]
+
+    coins["value"] = item.price
+    retry = FakeCallback("c2")
+    tap(middleware, retry, buy)
+    assert retry.answers == ["Награда добавлена в инвентарь ✨"]
+    assert [name for name, *_ in bot.get_reward_stacks(1)] == [item.name]
+
+    double = FakeCallback("c3")
+    tap(middleware, double, buy)
+    assert double.answers == ["Уже учтено ✓"]
+
+
+def test_sqlite_backend_is_shared_between_instances(db, clock):
+    first = bot.CallbackDedupMiddleware(bot.SqliteDedupCache())
+    second = bot.CallbackDedupMiddleware(bot.SqliteDedupCache())
+    handler = Handler()
+    tap(first, FakeCallback("c1"), handler)
+    tap(second, FakeCallback("c1", message_id=99), handler)  # тот же id в другом воркере
+    tap(second, FakeCallback("c2"), handler)  # двойное нажатие той же кнопки
+    assert handler.calls == 1
+    assert second.skipped == 2
+
+    clock[0] += WINDOW + 1
+    tap(second, FakeCallback("c3"), handler)
+    assert handler.calls == 2
@@ -0,0 +1,143 @@
+import json
+import sqlite3
+
+import pytest
+
+import bot
+from conftest import make_docx
+
+CAMPAIGN_DOCX = [
+    "1.1 Первый шаг → Rare ×1 + 3 coin",
+    "1.2 Второй шаг → Common ×1 + 1 coin",
+    "2.1 Хвосты кампании → Epic ×1 + 5 coin",
+    "● 6.1 Маленькие задачи",
+    "Описание раздела",
+    "Ещё описание",
+    "Полить цветы",
+    "Выпить воды",
+]
+
+
+@pytest.fixture
+def campaigns(tmp_path, monkeypatch, db):
+    root = tmp_path / "campaigns"
+    (root / "alt").mkdir(parents=True)
+    make_docx(root / "alt" / "tasks.docx", CAMPAIGN_DOCX)
+    monkeypatch.setattr(bot, "CAMPAIGNS_DIR", str(root))
+    bot.invalidate_catalogs()
+    yield root
+    bot.invalidate_catalogs()
+
+
+def test_campaign_catalog_uses_its_docx_dailies_and_own_codes(campaigns):
+    catalog = bot.get_catalog("alt")
+    assert [q.code for q in catalog.main_quests] == ["1.1", "1.2", "2.1"]
+    assert catalog.daily_tasks["d61_1"].title == "Полить цветы"
+    assert catalog.daily_tasks["d61_2"].title == "Выпить воды"
+    # Дефолтные группы и зависимости урезаны до кодов кампании.
+    assert catalog.level_groups == {2: [("Хвосты", ["2.1"])]}
+    assert catalog.quest_dependencies == {}
+    assert set(catalog.level_labels) == {1, 2}
+
+
+def test_campaign_levels_json(campaigns):
+    levels = {
+        "level_labels": {"1": "Старт"},
+        "level_meta": {"1": {"dates": "", "final_coins": 7, "final_cards": ["rare"]}},
+        "level_schedule": {},
+        "level_groups": {"1": [["Начало", ["1.1", "1.2"]]]},
+        "quest_dependencies": {"1.2": "1.1"},
+    }
+    (campaigns / "alt" / "levels.json").write_text(json.dumps(levels), encoding="utf-8")
+    catalog = bot.get_catalog("alt")
+    assert catalog.level_labels == {1: "Старт"}
+    assert catalog.level_groups == {1: [("Начало", ["1.1", "1.2"])]}
+    assert catalog.quest_dependencies == {"1.2": "1.1"}
+    # levels.json не принят за магазин.
+    assert catalog.shop_rewards is bot.default_catalog().shop_rewards
+
+
+def test_campaign_levels_json_with_foreign_codes_is_rejected(campaigns):
+    levels = {"level_groups": {"2": [["Upwork", ["2.3", "2.4"]]]}, "quest_dependencies": {"2.4": "2.3"}}
+    (campaigns / "alt" / "levels.json").write_text(json.dumps(levels), encoding="utf-8")
+    catalog = bot.get_catalog("alt")
+    assert catalog.quest_dependencies == {}
+    assert catalog.level_groups == {2: [("Хвосты", ["2.1"])]}
+
+
+def test_progress_is_kept_per_campaign(campaigns):
+    uid = 501
+    bot.set_main_status(uid, 1, "done")
+    bot.set_main_status(uid, 2, "active")
+    bot.set_user_campaign(uid, "alt")
+    assert bot.get_main_statuses(uid) == {}
+    bot.set_main_status(uid, 1, "active")
+    bot.set_user_campaign(uid, bot.DEFAULT_CAMPAIGN)
+    assert bot.get_main_statuses(uid) == {1: "done", 2: "active"}
+    bot.set_user_campaign(uid, "alt")
+    assert bot.get_main_statuses(uid) == {1: "active"}
+
+
+def test_level_final_and_inventory_are_per_campaign(campaigns):
+    uid = 502
+    catalog = bot.get_catalog("alt")
+    token = bot.CURRENT_CATALOG.set(catalog)
+    try:
+        bot.set_user_campaign(uid, "alt")
+        for q in catalog.quests_by_level[1]:
+            bot.set_main_status(uid, q.index, "done")
+        bot._grant_level_final(uid, 1)
+        bot._grant_level_final(uid, 1)
+        alt_stacks = bot.get_reward_stacks(uid)
+    finally:
+        bot.CURRENT_CATALOG.reset(token)
+    bot.set_user_campaign(uid, bot.DEFAULT_CAMPAIGN)
+    conn = sqlite3.connect(bot.DB_PATH)
+    finals = conn.execute("SELECT campaign, level FROM level_finals WHERE user_id = ?", (uid,)).fetchall()
+    conn.close()
+    assert finals == [("alt", 1)]
+    assert [name for name, *_ in alt_stacks] == ["ФИНАЛ 1: " + bot.REWARD_CARDS["uncommon"]["label"]]
+    assert bot.get_reward_stacks(uid) == []
+
+
+def test_migration_moves_old_progress_to_default_campaign(tmp_path, monkeypatch):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        """
+        CREATE TABLE main_progress(user_id INTEGER, node_index INTEGER, status TEXT,
+                                   PRIMARY KEY(user_id, node_index));
+        CREATE TABLE level_finals(user_id INTEGER, level INTEGER, granted_at TEXT,
+                                  PRIMARY KEY(user_id, level));
+        CREATE TABLE rewards(id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, name TEXT,
+                             box_level INTEGER, used INTEGER DEFAULT 0, created_at TEXT);
+        CREATE TABLE reward_stacks(user_id INTEGER, name TEXT, box_level INTEGER, count INTEGER,
+                                   last_id INTEGER, PRIMARY KEY(user_id, name, box_level));
+        CREATE INDEX idx_reward_stacks_page ON reward_stacks(user_id, last_id);
+        CREATE TABLE quest_choices(token TEXT PRIMARY KEY, user_id INTEGER, box_level INTEGER,
+                                   options_json TEXT, created_at TEXT);
+        INSERT INTO main_progress VALUES (7, 1, 'done'), (7, 2, 'active');
+        INSERT INTO level_finals VALUES (7, 0, '2025-11-20');
+        INSERT INTO rewards(user_id, name, box_level, used, created_at)
+            VALUES (7, 'Карта', 1, 0, '2025-11-20'), (7, 'Карта', 1, 0, '2025-11-21');
+        INSERT INTO reward_stacks VALUES (7, 'Карта', 1, 2, 2);
+        INSERT INTO quest_choices VALUES ('tok', 7, 1, '[]', '2025-11-20');
+        """
+    )
+    conn.commit()
+    conn.close()
+
+    monkeypatch.setattr(bot, "DB_PATH", path)
+    bot.init_db()
+    bot.init_db()  # повторный запуск ничего не ломает
+    bot.PROFILE_CACHE.forget(7)
+
+    assert bot.get_main_statuses(7) == {1: "done", 2: "active"}
+    assert bot.get_reward_stacks(7) == [("Карта", 1, 2, 2)]
+    assert bot.load_quest_choice("tok")["campaign"] == bot.DEFAULT_CAMPAIGN
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT campaign, level FROM level_finals").fetchall() == [("default", 0)]
+    tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    conn.close()
+    assert not any(name.endswith("_old") for name in tables)
+    bot.PROFILE_CACHE.forget(7)
@@ -0,0 +1,90 @@
+import sqlite3
+
+import pytest
+
+import bot
+
+
+def _balance_and_ledger(uid):
+    conn = bot.get_conn()
+    row = conn.execute("SELECT coins FROM users WHERE user_id = ?", (uid,)).fetchone()
+    ledger = conn.execute(
+        "SELECT delta, reason, ref FROM coin_ledger WHERE user_id = ? ORDER BY id", (uid,)
+    ).fetchall()
+    conn.close()
+    return (row[0] if row else None), ledger
+
+
+def test_coin_change_and_ledger_row_commit_together(db):
+    bot.update_coins(1, 10, "quest", "1.1")
+    bot.update_coins(1, -4, "shop", "tea")
+    assert _balance_and_ledger(1) == (6, [(10, "quest", "1.1"), (-4, "shop", "tea")])
+
+
+def test_failed_ledger_insert_rolls_back_coins(db):
+    bot.update_coins(1, 10, "quest")
+    conn = bot.get_conn()
+    with conn:
+        conn.execute(
+            "CREATE TRIGGER ledger_full BEFORE INSERT ON coin_ledger "
+            "BEGIN SELECT RAISE(ABORT, 'ledger is full'); END"
+        )
+    conn.close()
+
+    with pytest.raises(sqlite3.IntegrityError):
+        bot.update_coins(1, 5, "quest")
+    journal = bot.WriteBehindJournal(flush_interval_ms=60_000, max_pending=1000)
+    journal.add_coins(1, 7, "daily", "a")
+    with pytest.raises(sqlite3.IntegrityError):
+        journal.flush()
+    assert journal.pending_coins(1) == 7
+    assert _balance_and_ledger(1) == (10, [(10, "quest", None)])
+
+
+def test_migration_opens_ledger_with_existing_balances(tmp_path, monkeypatch):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("CREATE TABLE users(user_id INTEGER PRIMARY KEY, coins INTEGER DEFAULT 0, created_at TEXT)")
+        conn.executemany("INSERT INTO users(user_id, coins) VALUES(?,?)", [(1, 40), (2, 0), (3, -5)])
+    conn.close()
+
+    monkeypatch.setattr(bot, "DB_PATH", path)
+    bot.init_db()
+    assert _balance_and_ledger(1) == (40, [(40, "opening", None)])
+    assert _balance_and_ledger(2) == (0, [])
+    assert _balance_and_ledger(3) == (-5, [(-5, "opening", None)])
+
+    reconciler = bot.CoinReconciler(repair=False)
+    reconciler()
+    assert reconciler.checked == 3 and reconciler.mismatches == []
+
+    # Повторный init_db не добавляет открывающих записей.
+    bot.init_db()
+    assert _balance_and_ledger(1) == (40, [(40, "opening", None)])
+
+
+def test_reconciler_reports_and_repairs_mismatch(db):
+    for uid in range(1, 6):
+        bot.update_coins(uid, 10 * uid, "quest")
+    conn = bot.get_conn()
+    with conn:
+        conn.execute("UPDATE users SET coins = coins + 3 WHERE user_id = 2")
+        conn.execute("UPDATE users SET coins = coins - 7 WHERE user_id = 5")
+    conn.close()
+
+    reporter = bot.CoinReconciler(repair=False)
+    assert [reporter(2) for _ in range(3)] == [2, 2, 1]
+    assert reporter.mismatches == [(2, 23, 20), (5, 43, 50)]
+    assert reporter.repaired == 0
+
+    repairer = bot.CoinReconciler(repair=True)
+    while repairer(2) == 2:
+        pass
+    assert repairer.repaired == 2
+    assert _balance_and_ledger(2) == (23, [(20, "quest", None), (3, "reconcile", None)])
+    assert _balance_and_ledger(5)[1][-1] == (-7, "reconcile", None)
+
+    check = bot.CoinReconciler(repair=False)
+    check(100)
+    assert check.checked == 5 and check.mismatches == []
@@ -0,0 +1,85 @@
+import json
+import shutil
+
+import pytest
+
+import bot
+
+CONTENT_GLOBALS = (
+    "MAIN_QUESTS",
+    "DAILY_TASKS",
+    "SHOP_REWARDS",
+    "REWARD_TABLE",
+    "LEVEL_LABELS",
+    "LEVEL_META",
+    "LEVEL_SCHEDULE",
+    "LEVEL_GROUPS",
+    "QUEST_DEPENDENCIES",
+)
+
+
+@pytest.fixture
+def content_env(tmp_path, monkeypatch):
+    """Артефакт и файл магазина во временном каталоге; контент по умолчанию восстанавливается."""
+    for name in CONTENT_GLOBALS:
+        monkeypatch.setattr(bot, name, getattr(bot, name))
+    shop = tmp_path / "shop_rewards.json"
+    shutil.copy(bot.SHOP_REWARDS_FILE, shop)
+    monkeypatch.setattr(bot, "SHOP_REWARDS_FILE", str(shop))
+    monkeypatch.setattr(bot, "CONTENT_ARTIFACT", str(tmp_path / "content.bin"))
+    yield shop
+    bot.invalidate_catalogs()
+    bot.SHOP_PAGE_CACHE.clear()
+
+
+def _shop_ids():
+    return [item.id for item in bot.SHOP_REWARDS]
+
+
+def test_fresh_artifact_is_loaded(content_env):
+    assert bot.compile_content(out_path=bot.CONTENT_ARTIFACT)
+    bot.refresh_content()
+    assert isinstance(bot.SHOP_REWARDS, bot.MappedShop)
+
+
+def test_stale_artifact_is_recompiled(content_env):
+    assert bot.compile_content(out_path=bot.CONTENT_ARTIFACT)
+    items = json.loads(content_env.read_text(encoding="utf-8"))
+    items.append(dict(items[0], id="fresh_item", name="Новая награда"))
+    content_env.write_text(json.dumps(items, ensure_ascii=False), encoding="utf-8")
+
+    assert bot.stale_content_sources(bot.read_content_artifact(bot.CONTENT_ARTIFACT)["_sources"]) == ["shop"]
+    bot.refresh_content()
+    assert "fresh_item" in _shop_ids()
+
+    # Артефакт пересобран: следующий запуск берёт его без пересборки.
+    recorded = bot.read_content_artifact(bot.CONTENT_ARTIFACT)["_sources"]
+    assert bot.stale_content_sources(recorded) == []
+    bot.refresh_content()
+    assert isinstance(bot.SHOP_REWARDS, bot.MappedShop)
+    assert "fresh_item" in _shop_ids()
+
+
+def test_bundle_artifact_ignores_local_sources(content_env, tmp_path):
+    bundle = tmp_path / "bundle.json"
+    assert bot.compile_content(out_path=bot.CONTENT_ARTIFACT, write_bundle=str(bundle))
+    assert bot.compile_content(str(bundle), out_path=bot.CONTENT_ARTIFACT)
+    content_env.write_text("[]", encoding="utf-8")
+    assert bot.stale_content_sources(bot.read_content_artifact(bot.CONTENT_ARTIFACT)["_sources"]) == []
+
+
+def test_bundle_without_sections_is_reported(content_env, tmp_path, capsys):
+    bot.refresh_tasks_from_docx()
+    content = bot.content_from_globals()
+    del content["shop_rewards"]
+    content["level_groups"] = []
+    bundle = tmp_path / "bundle.json"
+    bundle.write_text(json.dumps(content, ensure_ascii=False), encoding="utf-8")
+
+    assert bot.validate_content(content) == [
+        "нет раздела shop_rewards или у него неверный тип",
+        "нет раздела level_groups или у него неверный тип",
+    ]
+    assert not bot.compile_content(str(bundle), out_path=bot.CONTENT_ARTIFACT)
+    assert "нет раздела shop_rewards" in capsys.readouterr().out
+    assert not (tmp_path / "content.bin").exists()
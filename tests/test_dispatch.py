@@ -0,0 +1,114 @@
+import asyncio
+import random
+import time
+
+from aiogram import Dispatcher
+from aiogram.types import Update
+
+import bot
+
+USERS = 50
+PER_USER = 5
+STEP = 0.02
+
+
+def message_update(update_id: int, uid: int, text: str) -> Update:
+    return Update.model_validate(
+        {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": 0,
+                "chat": {"id": uid, "type": "private"},
+                "from": {"id": uid, "is_bot": False, "first_name": "u"},
+                "text": text,
+            },
+        },
+        context={"bot": bot.bot},
+    )
+
+
+def test_keyed_dispatcher_orders_per_key_and_runs_keys_in_parallel():
+    dispatcher = bot.KeyedDispatcher(max_pending=100)
+    seen = {}
+    rnd = random.Random(3)
+
+    async def job(key, seq):
+        # Случайная задержка: без очереди задания одного ключа перемешались бы.
+        await asyncio.sleep(rnd.random() * STEP)
+        seen.setdefault(key, []).append(seq)
+
+    async def scenario():
+        jobs = [
+            dispatcher.run(key, lambda key=key, seq=seq: job(key, seq))
+            for seq in range(PER_USER)
+            for key in range(USERS)
+        ]
+        started = time.perf_counter()
+        await asyncio.gather(*jobs)
+        return time.perf_counter() - started
+
+    elapsed = asyncio.run(scenario())
+    assert all(seen[key] == list(range(PER_USER)) for key in range(USERS))
+    # Последовательно по всем ключам было бы ~USERS * PER_USER * STEP / 2 = 2.5 с.
+    assert elapsed < PER_USER * STEP * 3
+    assert len(dispatcher) == 0
+
+
+def test_keyed_dispatcher_drops_overflow_and_duplicates():
+    dispatcher = bot.KeyedDispatcher(max_pending=2)
+    gate = asyncio.Event()
+
+    async def job():
+        await gate.wait()
+        return "ok"
+
+    async def scenario():
+        first = asyncio.ensure_future(dispatcher.run(1, job, dedup="tap"))
+        await asyncio.sleep(0)
+        duplicate = await dispatcher.run(1, job, dedup="tap")
+        second = asyncio.ensure_future(dispatcher.run(1, job))
+        await asyncio.sleep(0)
+        overflow = await dispatcher.run(1, job)
+        gate.set()
+        return duplicate, overflow, await first, await second
+
+    duplicate, overflow, first, second = asyncio.run(scenario())
+    assert duplicate is bot.KeyedDispatcher.DROPPED
+    assert overflow is bot.KeyedDispatcher.DROPPED
+    assert (first, second) == ("ok", "ok")
+    assert dispatcher.dropped == 2
+
+
+def test_user_serial_middleware_keeps_order_through_feed_update():
+    dp = Dispatcher()
+    dp.update.outer_middleware(bot.UserSerialMiddleware(bot.KeyedDispatcher(100)))
+    seen = {}
+    active = set()
+    overlaps = []
+    rnd = random.Random(5)
+
+    @dp.message()
+    async def handler(message):
+        uid = message.from_user.id
+        if uid in active:
+            overlaps.append(uid)
+        active.add(uid)
+        await asyncio.sleep(rnd.random() * STEP)
+        seen.setdefault(uid, []).append(int(message.text))
+        active.discard(uid)
+
+    async def scenario():
+        updates = [
+            message_update(seq * USERS + uid, uid, str(seq))
+            for seq in range(PER_USER)
+            for uid in range(1, USERS + 1)
+        ]
+        started = time.perf_counter()
+        await asyncio.gather(*(dp.feed_update(bot.bot, u) for u in updates))
+        return time.perf_counter() - started
+
+    elapsed = asyncio.run(scenario())
+    assert overlaps == []
+    assert all(seen[uid] == list(range(PER_USER)) for uid in range(1, USERS + 1))
+    assert elapsed < PER_USER * STEP * 3
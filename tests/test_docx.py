@@ -0,0 +1,99 @@
+import pytest
+
+import bot
+from conftest import make_docx
+
+DOCX_LINES = [
+    "Вступление без раздела",
+    "1.1 Первый шаг → Rare ×1 + 3 coin",
+    "● 6.1 Маленькие задачи",
+    "Описание раздела",
+    "Ещё описание",
+    "Полить цветы",
+    "Вариант: что угодно",
+    "Выпить воды",
+    "▲ 6.2 Стандартные задачи",
+    "Описание",
+    "Описание",
+    "Разобрать почту",
+    "+2 монеты за каждую",
+    "★ 6.4 Фокус",
+    "Описание",
+    "Описание",
+    "Час без телефона",
+]
+
+
+def _extract(lines):
+    extractor = bot._DailyTaskExtractor()
+    for line in lines:
+        extractor.feed(line)
+    return {code: (task.title, task.coins, task.cost_key) for code, task in extractor.result().items()}
+
+
+def test_extractor_sections_and_skipped_lines():
+    assert _extract(DOCX_LINES) == {
+        "d61_1": ("Полить цветы", 1, "small"),
+        "d61_2": ("Выпить воды", 1, "small"),
+        "d62_1": ("Разобрать почту", 2, "standard"),
+        "d64_1": ("Час без телефона", 5, "focus"),
+    }
+
+
+def test_repeated_header_restarts_only_its_section():
+    lines = DOCX_LINES + ["⏱ 6.2 Стандартные задачи (новая редакция)", "Описание", "Описание", "Помыть посуду"]
+    tasks = _extract(lines)
+    assert tasks["d62_1"] == ("Помыть посуду", 2, "standard")
+    assert "d62_2" not in tasks
+    assert [code for code in tasks if code.startswith("d61")] == ["d61_1", "d61_2"]
+    assert tasks["d64_1"] == ("Час без телефона", 5, "focus")
+
+
+def test_lines_before_any_header_are_ignored():
+    assert _extract(["Полить цветы", "6.1 без маркера", "Ещё строка"]) == {}
+
+
+@pytest.fixture
+def content(monkeypatch):
+    for name in ("MAIN_QUESTS", "DAILY_TASKS"):
+        monkeypatch.setattr(bot, name, getattr(bot, name))
+    yield
+    bot.invalidate_catalogs()
+
+
+def test_refresh_swaps_in_docx_quests_and_dailies(tmp_path, monkeypatch, content):
+    path = make_docx(tmp_path / "tasks.docx", DOCX_LINES)
+    monkeypatch.setattr(bot, "TASKS_DOCX_CANDIDATES", [str(path)])
+    bot.default_catalog()  # каталог собран до обновления и должен пересобраться
+    bot.refresh_tasks_from_docx()
+
+    assert [(q.code, q.title, q.reward_coins, q.reward_card) for q in bot.MAIN_QUESTS] == [
+        ("1.1", "Первый шаг", 3, "rare")
+    ]
+    raw = bot.build_daily_tasks_from_raw()
+    docx = {code: task for code, task in bot.DAILY_TASKS.items() if code not in raw}
+    assert set(raw) <= set(bot.DAILY_TASKS)
+    assert {code: task.category for code, task in docx.items()} == dict.fromkeys(
+        ["d61_1", "d61_2", "d62_1", "d64_1"], "docx"
+    )
+    catalog = bot.default_catalog()
+    assert catalog.main_quests == bot.MAIN_QUESTS
+    assert catalog.daily_tasks["d64_1"].title == "Час без телефона"
+    assert "docx" in catalog.daily_themes
+
+
+def test_refresh_without_docx_keeps_quests_and_raw_dailies(tmp_path, monkeypatch, content):
+    quests = [bot.Quest(index=1, code="1.1", title="Из прошлой загрузки")]
+    monkeypatch.setattr(bot, "MAIN_QUESTS", quests)
+
+    monkeypatch.setattr(bot, "TASKS_DOCX_CANDIDATES", [str(tmp_path / "missing.docx")])
+    bot.refresh_tasks_from_docx()
+    assert bot.MAIN_QUESTS == quests
+    assert bot.DAILY_TASKS == bot.build_daily_tasks_from_raw()
+
+    # Docx без квестов: квесты остаются прежними, дейлики из него добавляются.
+    path = make_docx(tmp_path / "dailies.docx", DOCX_LINES[2:])
+    monkeypatch.setattr(bot, "TASKS_DOCX_CANDIDATES", [str(path)])
+    bot.refresh_tasks_from_docx()
+    assert bot.MAIN_QUESTS == quests
+    assert "d61_1" in bot.DAILY_TASKS
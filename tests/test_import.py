@@ -0,0 +1,97 @@
+import io
+import json
+
+import pytest
+
+import bot
+
+DOCUMENT = {
+    "1": 12345,
+    "2": -1.5e-3,
+    "3": 10.25,
+    "4": "строка с \"кавычками\", \\ и ☃",
+    "5": {"tokens": {"a": 1, "b": 22}, "rp": 300, "bp_level": 4, "nested": [1, [2.5, {"x": None}]]},
+    "6": [True, False, None, 0, -0.0, 1e20],
+    "7": "",
+    "8": 7,
+}
+
+
+@pytest.mark.parametrize("indent", [None, 1])
+def test_items_survive_every_chunk_boundary(indent):
+    text = json.dumps(DOCUMENT, ensure_ascii=False, indent=indent)
+    escaped = json.dumps(DOCUMENT, ensure_ascii=True, indent=indent)
+    for source in (text, escaped):
+        for chunk in range(1, 24):
+            items = list(bot.iter_json_object_items(io.StringIO(source), chunk_bytes=chunk))
+            assert items == list(DOCUMENT.items()), chunk
+
+
+def test_number_cut_at_chunk_end():
+    # «12» | «.5» и «1» | «e3»: без дочитывания получились бы 12 и 1.
+    for source in ('{"a": 12.5}', '{"a": 1e3}', '{"a": -7, "b": 100}'):
+        expected = list(json.loads(source).items())
+        for chunk in range(1, len(source) + 1):
+            assert list(bot.iter_json_object_items(io.StringIO(source), chunk_bytes=chunk)) == expected
+
+
+@pytest.mark.parametrize("source", ["[1, 2]", '{"a": 1', '{"a" 1}', '{"a": tru}'])
+def test_broken_documents_raise(source):
+    with pytest.raises(ValueError):
+        list(bot.iter_json_object_items(io.StringIO(source), chunk_bytes=2))
+
+
+def _users_json(tmp_path, records):
+    path = tmp_path / "users.json"
+    path.write_text(json.dumps(records, ensure_ascii=False), encoding="utf-8")
+    return str(path)
+
+
+def _table(name):
+    conn = bot.get_conn()
+    rows = sorted(conn.execute(f"SELECT * FROM {name}"))
+    conn.close()
+    return rows
+
+
+def test_import_writes_in_batches_and_skips_bad_records(db, tmp_path, monkeypatch):
+    records = {str(uid): {"tokens": {"star": uid}, "rp": uid * 10, "bp_level": 1} for uid in range(1, 8)}
+    records["oops"] = {"rp": 1}
+    batches = []
+    real_write = bot._write_import_batch
+    monkeypatch.setattr(bot, "_write_import_batch", lambda u, t, p: batches.append(len(u)) or real_write(u, t, p))
+
+    result = bot.import_users_json(_users_json(tmp_path, records), batch_size=3)
+    assert (result["imported"], result["skipped"]) == (7, 1)
+    assert batches == [3, 3, 1]
+    assert [row[0] for row in _table("users")] == list(range(1, 8))
+    assert _table("user_tokens") == [(uid, "star", uid) for uid in range(1, 8)]
+    assert _table("battle_pass") == [(uid, uid * 10, 1) for uid in range(1, 8)]
+
+
+def test_interrupted_import_resumes_without_duplicates(db, tmp_path, monkeypatch):
+    records = {str(uid): {"tokens": {"star": 1}, "rp": uid} for uid in range(1, 7)}
+    path = _users_json(tmp_path, records)
+    real_write = bot._write_import_batch
+    calls = []
+
+    def failing_write(users, tokens, passes):
+        calls.append(len(users))
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        real_write(users, tokens, passes)
+
+    monkeypatch.setattr(bot, "_write_import_batch", failing_write)
+    with pytest.raises(KeyboardInterrupt):
+        bot.import_users_json(path, batch_size=2)
+    # Первая пачка сохранена целиком, вторая не записана вовсе.
+    assert [row[0] for row in _table("users")] == [1, 2]
+
+    # Баланс, заработанный между запусками, повторный импорт не сбрасывает.
+    bot.update_coins(1, 5, "quest")
+    monkeypatch.setattr(bot, "_write_import_batch", real_write)
+    records["1"]["tokens"]["star"] = 3
+    bot.import_users_json(_users_json(tmp_path, records), batch_size=2)
+    assert [row[:2] for row in _table("users")] == [(1, 5)] + [(uid, 0) for uid in range(2, 7)]
+    assert _table("user_tokens") == [(1, "star", 3)] + [(uid, "star", 1) for uid in range(2, 7)]
+    assert _table("battle_pass") == [(uid, uid, 0) for uid in range(1, 7)]
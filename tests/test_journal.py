@@ -0,0 +1,167 @@
+import asyncio
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import textwrap
+import time
+
+import bot
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FLUSH_MS = 100
+# Запас на сам сброс (fsync) и планировщик ОС.
+SLACK = 0.15
+
+CHILD = textwrap.dedent(
+    """
+    import asyncio, sys, time
+    import bot
+
+    bot.init_db()
+
+    async def main():
+        asyncio.create_task(bot.DAILY_JOURNAL.run())
+        i = 0
+        while True:
+            bot.DAILY_JOURNAL.set_daily_done(1, f"t{i}", "2024-01-01", True)
+            bot.DAILY_JOURNAL.add_coins(1, 1, "daily", f"t{i}")
+            # Отметка подтверждена игроку — с этого момента она не должна потеряться
+            # дольше чем на интервал сброса.
+            print(i, time.time(), flush=True)
+            i += 1
+            await asyncio.sleep(0.002)
+
+    asyncio.run(main())
+    """
+)
+
+
+def test_acknowledged_toggles_survive_kill(tmp_path):
+    db_path = str(tmp_path / "crash.db")
+    env = dict(
+        os.environ,
+        DB_PATH=db_path,
+        JOURNAL_FLUSH_MS=str(FLUSH_MS),
+        PYTHONPATH=ROOT,
+    )
+    child = subprocess.Popen(
+        [sys.executable, "-c", CHILD], env=env, stdout=subprocess.PIPE, text=True
+    )
+    acks = {}
+    try:
+        for line in child.stdout:
+            i, ts = line.split()
+            acks[int(i)] = float(ts)
+            if len(acks) >= 400:
+                break
+        killed_at = time.time()
+        child.send_signal(signal.SIGKILL)
+    finally:
+        child.wait()
+
+    conn = sqlite3.connect(db_path)
+    stored = {int(code[1:]) for (code,) in conn.execute("SELECT task_code FROM daily_tasks")}
+    coins = conn.execute("SELECT coins FROM users WHERE user_id = 1").fetchone()
+    conn.close()
+
+    window = FLUSH_MS / 1000 + SLACK
+    must_survive = {i for i, ts in acks.items() if ts < killed_at - window}
+    assert must_survive, "процесс не успел проработать дольше интервала сброса"
+    assert must_survive <= stored
+    # Монеты пишутся той же транзакцией, что и отметки.
+    assert coins is not None and coins[0] == len(stored)
+
+
+def test_overflow_wakes_background_flush(db):
+    journal = bot.WriteBehindJournal(flush_interval_ms=60_000, max_pending=10)
+
+    async def scenario():
+        task = asyncio.create_task(journal.run())
+        await asyncio.sleep(0)
+        for i in range(10):
+            journal.set_daily_done(2, f"t{i}", "2024-01-01", True)
+        # Обработчик вернулся, не записав ничего сам.
+        assert journal.daily_state(2, "t0", "2024-01-01") is True
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+    asyncio.run(scenario())
+    assert journal.daily_state(2, "t0", "2024-01-01") is None
+    assert bot._load_daily_done(2, "2024-01-01") == {f"t{i}" for i in range(10)}
+
+
+# ---------- Кэш профилей ----------
+
+
+class Loader:
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self, *args):
+        self.calls += 1
+        return self.value
+
+
+def test_profile_cache_hits_after_first_load():
+    cache = bot.ProfileCache(max_users=10, ttl=60)
+    loader = Loader(7)
+    assert cache.coins(1, loader) == 7
+    assert cache.coins(1, loader) == 7
+    assert loader.calls == 1
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 1)
+
+
+def test_profile_cache_expires_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(bot.time, "monotonic", lambda: now[0])
+    cache = bot.ProfileCache(max_users=10, ttl=60)
+    loader = Loader(7)
+    cache.coins(1, loader)
+    now[0] += 59
+    cache.coins(1, loader)
+    assert loader.calls == 1
+    now[0] += 1
+    cache.coins(1, loader)
+    assert loader.calls == 2
+
+
+def test_profile_cache_evicts_least_recently_used():
+    cache = bot.ProfileCache(max_users=2, ttl=60)
+    loader = Loader(0)
+    cache.coins(1, loader)
+    cache.coins(2, loader)
+    cache.coins(1, loader)  # 1 становится самым свежим
+    cache.coins(3, loader)
+    assert list(cache._items) == [1, 3]
+    assert cache.stats()["evictions"] == 1
+    cache.coins(2, loader)
+    assert loader.calls == 4
+
+
+def test_journal_flush_refreshes_cached_profile(db, monkeypatch):
+    journal = bot.WriteBehindJournal(flush_interval_ms=60_000, max_pending=1000)
+    monkeypatch.setattr(bot, "DAILY_JOURNAL", journal)
+    day = "2024-01-01"
+    bot.update_coins(1, 10, "test")
+    assert bot.get_coins(1) == 10
+    assert not bot.get_daily_done(1, "a", day)
+
+    journal.set_daily_done(1, "a", day, True)
+    journal.add_coins(1, 3, "daily", "a")
+    assert bot.get_coins(1) == 13
+    assert journal.flush() == 2
+
+    # Монеты перечитываются из БД, дейлик применён к кэшу без перечитывания.
+    entry = bot.PROFILE_CACHE._peek(1)
+    assert entry.coins is None
+    assert entry.daily_done == {"a"}
+    assert bot.get_coins(1) == 13
+    assert bot.get_daily_done(1, "a", day)
+
+    journal.set_daily_done(1, "a", day, False)
+    journal.flush()
+    assert entry.daily_done == set()
+    assert not bot.get_daily_done(1, "a", day)
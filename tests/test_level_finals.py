@@ -0,0 +1,122 @@
+import sqlite3
+import threading
+
+import pytest
+
+import bot
+from conftest import make_docx
+
+UID = 601
+FINAL_CARD = "ФИНАЛ 1: " + bot.REWARD_CARDS["uncommon"]["label"]
+
+
+@pytest.fixture
+def level_done(tmp_path, monkeypatch, db):
+    """Кампания с двумя квестами уровня 1; игрок в ней и закрыл оба."""
+    root = tmp_path / "campaigns"
+    (root / "fin").mkdir(parents=True)
+    make_docx(root / "fin" / "tasks.docx", ["1.1 Первый → Rare ×1 + 3 coin", "1.2 Второй → Common ×1 + 1 coin"])
+    monkeypatch.setattr(bot, "CAMPAIGNS_DIR", str(root))
+    bot.invalidate_catalogs()
+    catalog = bot.get_catalog("fin")
+    bot.set_user_campaign(UID, "fin")
+    token = bot.CURRENT_CATALOG.set(catalog)
+    for q in catalog.quests_by_level[1]:
+        bot.set_main_status(UID, q.index, "done")
+    yield catalog
+    bot.CURRENT_CATALOG.reset(token)
+    bot.invalidate_catalogs()
+
+
+def _grants(uid):
+    conn = bot.get_conn()
+    finals = conn.execute("SELECT campaign, level FROM level_finals WHERE user_id = ?", (uid,)).fetchall()
+    ledger = conn.execute(
+        "SELECT delta, ref FROM coin_ledger WHERE user_id = ? AND reason = 'level_final'", (uid,)
+    ).fetchall()
+    cards = conn.execute("SELECT name FROM rewards WHERE user_id = ? AND name LIKE 'ФИНАЛ %'", (uid,)).fetchall()
+    conn.close()
+    return finals, ledger, [name for (name,) in cards]
+
+
+def test_second_grant_is_a_no_op(level_done):
+    bot._grant_level_final(UID, 1)
+    coins = bot.get_coins(UID)
+    bot._grant_level_final(UID, 1)
+    assert _grants(UID) == ([("fin", 1)], [(5, "level:1")], [FINAL_CARD])
+    assert bot.get_coins(UID) == coins == 5
+
+
+def test_unfinished_level_is_not_granted(level_done):
+    bot.set_main_status(UID, level_done.quests_by_level[1][0].index, "active")
+    bot._grant_level_final(UID, 1)
+    assert _grants(UID) == ([], [], [])
+
+
+def test_concurrent_grants_issue_one_final(level_done):
+    threads_count = 8
+    barrier = threading.Barrier(threads_count)
+    errors = []
+
+    def grant():
+        # Контекст каталога в поток не наследуется.
+        bot.CURRENT_CATALOG.set(level_done)
+        barrier.wait()
+        try:
+            bot._grant_level_final(UID, 1)
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=grant) for _ in range(threads_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert _grants(UID) == ([("fin", 1)], [(5, "level:1")], [FINAL_CARD])
+
+
+def test_migration_backfills_finals_from_cards(tmp_path, monkeypatch):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        f"""
+        CREATE TABLE rewards(id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, name TEXT,
+                             box_level INTEGER, used INTEGER DEFAULT 0, created_at TEXT);
+        CREATE TABLE rewards_archive(id INTEGER PRIMARY KEY, user_id INTEGER, name TEXT,
+                                     box_level INTEGER, created_at TEXT, archived_at TEXT);
+        INSERT INTO rewards(user_id, name, box_level, used, created_at) VALUES
+            ({UID}, 'ФИНАЛ 1: Карта', 0, 0, '2025-12-01'),
+            ({UID}, 'Кофе', 1, 0, '2025-12-02'),
+            (7, 'ФИНАЛ 2: Карта', 0, 0, '2026-01-05');
+        INSERT INTO rewards_archive VALUES
+            (100, {UID}, 'ФИНАЛ 10: Карта', 0, '2026-05-30', '2026-06-01'),
+            (101, 7, 'Финальный чай', 1, '2026-01-06', '2026-01-07');
+        """
+    )
+    conn.commit()
+    conn.close()
+
+    monkeypatch.setattr(bot, "DB_PATH", path)
+    bot.init_db()
+    bot.PROFILE_CACHE.forget(UID)
+    conn = sqlite3.connect(path)
+    finals = sorted(conn.execute("SELECT user_id, campaign, level, granted_at FROM level_finals"))
+    conn.close()
+    assert finals == [
+        (7, bot.DEFAULT_CAMPAIGN, 2, "2026-01-05"),
+        (UID, bot.DEFAULT_CAMPAIGN, 1, "2025-12-01"),
+        (UID, bot.DEFAULT_CAMPAIGN, 10, "2026-05-30"),
+    ]
+
+    # Перенесённый финал не выдаётся второй раз.
+    quests = [bot.Quest(index=i, code=f"1.{i}", title=f"Квест {i}") for i in (1, 2)]
+    monkeypatch.setattr(bot, "MAIN_QUESTS", quests)
+    bot.invalidate_catalogs()
+    assert bot.default_catalog().quests_by_level[1] == quests
+    for q in quests:
+        bot.set_main_status(UID, q.index, "done")
+    bot._grant_level_final(UID, 1)
+    assert _grants(UID)[1] == []
+    bot.invalidate_catalogs()
+    bot.PROFILE_CACHE.forget(UID)
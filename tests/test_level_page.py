@@ -0,0 +1,113 @@
+import random
+
+import pytest
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+import bot
+
+UID = 701
+CODES = ["1.1", "1.2", "2.1", "2.2", "2.3", "2.4", "2.5", "2.6", "2.7", "2.8", "2.9", "9.1"]
+
+
+def old_level_view(uid, lvl):
+    """Экран уровня, как его собирал cb_level до скелетов LevelPage."""
+    catalog = bot.active_catalog()
+    quests = catalog.quests_by_level.get(lvl, [])
+    meta = catalog.level_meta.get(lvl, {})
+    date_range = meta.get("dates", "")
+    lines = [catalog.level_labels.get(lvl, f"Уровень {lvl}")]
+    if date_range:
+        lines.append(f"⏳ {date_range}")
+    final_line = []
+    if meta.get("final_coins") or meta.get("final_cards"):
+        rewards_txt = []
+        coins = meta.get("final_coins", 0)
+        if coins:
+            rewards_txt.append(f"+{coins} coin")
+        for r in meta.get("final_cards", []):
+            rewards_txt.append(bot.REWARD_CARDS.get(r, bot.REWARD_CARDS["common"])["label"])
+        final_line.append("🎯 Финал: " + " + ".join(rewards_txt))
+    if final_line:
+        lines.append("\n".join(final_line))
+    lines.append("")
+    kb = []
+    groups = catalog.level_groups.get(lvl)
+    listed_ids = set()
+
+    def add_q(q):
+        status = bot.get_main_status(uid, q.index)
+        if status != "done" and not bot._quest_dependency_met(uid, q):
+            status = "locked"
+        if status == "done":
+            mark = "✓"
+        elif status == "active":
+            mark = "•"
+        else:
+            mark = "✗"
+        label = q.code or str(q.index)
+        lines.append(f"{mark} {label}. {q.title}")
+        kb.append([InlineKeyboardButton(text=f"Открыть {label}", callback_data=f"quest:{q.index}")])
+        listed_ids.add(q.index)
+
+    if groups:
+        for name, codes in groups:
+            lines.append(f"<b>{name}</b>")
+            for code in codes:
+                q = bot._quest_by_code(code)
+                if q:
+                    add_q(q)
+            lines.append("")
+    for q in quests:
+        if q.index not in listed_ids:
+            add_q(q)
+
+    kb.append([InlineKeyboardButton(text="⬅ К карте", callback_data="menu:map")])
+    return "\n".join(lines), InlineKeyboardMarkup(inline_keyboard=kb)
+
+
+@pytest.fixture
+def catalog(db):
+    # Уровень 0 — квест без кода и без строки финала; 2 — группы, зависимости и квест вне групп;
+    # 9 — уровень без подписи и дат.
+    quests = [bot.Quest(index=1, title="Без кода")]
+    quests += [bot.Quest(index=i, code=code, title=f"Квест {code}") for i, code in enumerate(CODES, start=2)]
+    catalog = bot.Catalog("levels", "v1", quests, {}, [], {})
+    token = bot.CURRENT_CATALOG.set(catalog)
+    yield catalog
+    bot.CURRENT_CATALOG.reset(token)
+
+
+def test_skeleton_matches_old_build_for_random_statuses(catalog):
+    rnd = random.Random(50)
+    levels = sorted(catalog.quests_by_level)
+    assert levels == [0, 1, 2, 9]
+    for _ in range(30):
+        for q in catalog.main_quests:
+            status = rnd.choice(["locked", "active", "done", None])
+            if status:
+                bot.set_main_status(UID, q.index, status)
+        bot.PROFILE_CACHE.forget(UID)
+        for lvl in levels:
+            page = catalog.level_page(lvl)
+            text, markup = old_level_view(UID, lvl)
+            assert page.render(bot.get_main_statuses(UID)) == text
+            assert page.markup == markup
+
+
+def test_dependency_locks_until_previous_quest_is_done(catalog):
+    page = catalog.level_page(2)
+    index = {q.code: q.index for q in catalog.main_quests}
+    statuses = {index["2.3"]: "active", index["2.4"]: "active", index["2.5"]: "done"}
+    lines = page.render(statuses).split("\n")
+    # 2.4 ждёт 2.3; выполненный 2.5 остаётся выполненным, даже если 2.4 ещё нет.
+    assert "✗ 2.4. Квест 2.4" in lines and "• 2.3. Квест 2.3" in lines and "✓ 2.5. Квест 2.5" in lines
+    statuses[index["2.3"]] = "done"
+    assert "• 2.4. Квест 2.4" in page.render(statuses).split("\n")
+
+
+def test_pages_are_built_once_per_catalog(catalog):
+    page = catalog.level_page(2)
+    assert catalog.level_page(2) is page
+    rebuilt = bot.Catalog("levels", "v2", catalog.main_quests, {}, [], {})
+    assert rebuilt.level_page(2) is not page
+    assert rebuilt.level_page(2).parts == page.parts
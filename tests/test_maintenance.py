@@ -0,0 +1,134 @@
+import os
+import sqlite3
+from datetime import date, timedelta
+
+import pytest
+
+import bot
+
+
+def test_incremental_vacuum_frees_one_batch(db):
+    conn = bot.get_conn()
+    with conn:
+        conn.execute("CREATE TABLE filler(data BLOB)")
+        conn.executemany("INSERT INTO filler VALUES(?)", [(b"x" * 4000,) for _ in range(500)])
+    with conn:
+        conn.execute("DELETE FROM filler")
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    conn.close()
+    assert free > 100
+
+    assert bot.incremental_vacuum(100) == 100
+    assert bot.incremental_vacuum(10_000) == free - 100
+    assert bot.incremental_vacuum(100) == 0
+
+
+def test_failed_backup_leaves_no_part_file(db, tmp_path, monkeypatch):
+    backups = tmp_path / "backups"
+    backups.mkdir()
+    monkeypatch.setattr(bot, "BACKUP_DIR", str(backups))
+
+    class FailingConn:
+        def __init__(self, conn):
+            self._conn = conn
+
+        def execute(self, *args):
+            return self._conn.execute(*args)
+
+        def backup(self, *args, **kwargs):
+            raise OSError("database or disk is full")
+
+        def close(self):
+            self._conn.close()
+
+    real_get_conn = bot.get_conn
+    monkeypatch.setattr(bot, "get_conn", lambda: FailingConn(real_get_conn()))
+    with pytest.raises(OSError):
+        bot.backup_database()
+    assert list(backups.iterdir()) == []
+
+    monkeypatch.setattr(bot, "get_conn", real_get_conn)
+    path = bot.backup_database()
+    assert [p.name for p in backups.iterdir()] == [os.path.basename(path)]
+
+
+def test_existing_db_is_switched_to_incremental_vacuum(tmp_path, monkeypatch):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("CREATE TABLE users(user_id INTEGER PRIMARY KEY, coins INTEGER DEFAULT 0, created_at TEXT)")
+        conn.execute("CREATE TABLE filler(data BLOB)")
+        conn.executemany("INSERT INTO filler VALUES(?)", [(b"x" * 4000,) for _ in range(300)])
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+    conn.close()
+
+    monkeypatch.setattr(bot, "DB_PATH", path)
+    bot.init_db()
+    conn = bot.get_conn()
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    first_run = conn.execute("SELECT last_run, processed FROM maintenance_state WHERE job = 'auto_vacuum'").fetchone()
+    assert first_run[1] == 2
+    with conn:
+        conn.execute("DELETE FROM filler")
+    conn.close()
+    assert bot.incremental_vacuum(10_000) > 200
+
+    # Повторный старт VACUUM не повторяет.
+    bot.init_db()
+    conn = bot.get_conn()
+    assert conn.execute("SELECT last_run, processed FROM maintenance_state WHERE job = 'auto_vacuum'").fetchone() == first_run
+    conn.close()
+
+
+def _days_ago(days: int) -> str:
+    return (date.today() - timedelta(days=days)).isoformat()
+
+
+def test_rollup_old_daily_tasks_in_batches(db):
+    old, older = _days_ago(bot.DAILY_RETENTION_DAYS + 1), _days_ago(bot.DAILY_RETENTION_DAYS + 5)
+    fresh = _days_ago(bot.DAILY_RETENTION_DAYS - 1)
+    rows = [(1, f"t{i}", old, i % 2) for i in range(5)]
+    rows += [(1, f"t{i}", older, 1) for i in range(2)]
+    rows += [(2, f"t{i}", old, 0) for i in range(3)]
+    rows += [(1, f"t{i}", fresh, 1) for i in range(4)]
+    conn = bot.get_conn()
+    with conn:
+        conn.executemany("INSERT INTO daily_tasks(user_id, task_code, day, done) VALUES(?,?,?,?)", rows)
+    conn.close()
+
+    # Группы (игрок, день) разрезаются пачками: свёртка должна их досуммировать.
+    assert [bot.rollup_old_daily_tasks(3) for _ in range(5)] == [3, 3, 3, 1, 0]
+
+    conn = bot.get_conn()
+    summary = sorted(conn.execute("SELECT user_id, day, done_count, total_count FROM daily_summary"))
+    left = sorted(conn.execute("SELECT user_id, task_code, day, done FROM daily_tasks"))
+    conn.close()
+    assert summary == sorted([(1, old, 2, 5), (1, older, 2, 2), (2, old, 0, 3)])
+    assert left == sorted(row for row in rows if row[2] == fresh)
+
+
+def test_archive_used_rewards_in_batches(db):
+    for i in range(7):
+        bot.add_reward(1, f"Награда {i}", 1)
+    bot.add_reward(2, "Чужая", 2)
+    conn = bot.get_conn()
+    rewards = {row[0]: row for row in conn.execute("SELECT id, user_id, campaign, name, box_level, created_at FROM rewards")}
+    conn.close()
+    ids = sorted(rewards)
+    used = ids[:5] + ids[-1:]
+    for rid in used:
+        assert bot.mark_reward_used(rewards[rid][1], rid)
+
+    assert [bot.archive_used_rewards(4) for _ in range(3)] == [4, 2, 0]
+
+    conn = bot.get_conn()
+    archived = conn.execute(
+        "SELECT id, user_id, campaign, name, box_level, created_at, archived_at FROM rewards_archive ORDER BY id"
+    ).fetchall()
+    remaining = [row[0] for row in conn.execute("SELECT id FROM rewards ORDER BY id")]
+    conn.close()
+    assert [row[:6] for row in archived] == [rewards[rid] for rid in used]
+    assert all(row[6] for row in archived)
+    assert remaining == ids[5:-1]
+    # Неиспользованные награды остались в инвентаре.
+    assert [count for _name, _lvl, count, _ in bot.get_reward_stacks(1)] == [1, 1]
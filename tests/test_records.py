@@ -0,0 +1,52 @@
+import copy
+import pickle
+
+import pytest
+
+import bot
+
+QUEST = bot.Quest(index=3, code="1.3", title="Третий", reward_coins=5, reward_card="rare")
+
+
+@pytest.mark.parametrize("record", [
+    QUEST,
+    bot.ShopItem(id="tea", name="Чай", price=10),
+    bot.DailyTask(code="d1", title="Вода"),
+    bot.LootEntry(threshold=50, name="Кофе"),
+])
+def test_records_are_frozen_and_have_no_dict(record):
+    with pytest.raises(AttributeError):
+        setattr(record, record.__slots__[0], "другое")
+    with pytest.raises(AttributeError):
+        delattr(record, record.__slots__[0])
+    with pytest.raises(AttributeError):
+        record.extra = 1
+    assert not hasattr(record, "__dict__")
+    assert type(record).from_dict(record.to_dict()) == record
+
+
+def test_from_dict_fills_defaults_and_ignores_foreign_keys():
+    task = bot.DailyTask.from_dict({"code": "d1", "title": "Вода", "legacy": True})
+    assert task.to_dict() == {"code": "d1", "title": "Вода", "coins": 1, "category": "", "cost_key": "standard"}
+    with pytest.raises(TypeError):
+        bot.DailyTask(code="d1", legacy=True)
+
+
+def test_value_equality_hash_and_replace():
+    same = bot.Quest.from_dict(QUEST.to_dict())
+    assert same == QUEST and same is not QUEST
+    assert hash(same) == hash(QUEST)
+    assert len({QUEST, same}) == 1
+
+    cheaper = QUEST.replace(reward_coins=1)
+    assert cheaper != QUEST and QUEST.reward_coins == 5
+    assert cheaper.to_dict() == dict(QUEST.to_dict(), reward_coins=1)
+
+    # Одинаковые значения полей у записей разных типов не делают их равными.
+    assert bot.LootEntry(threshold=1, name="x") != bot.DailyTask(code=1, title="x")
+    assert repr(bot.LootEntry(threshold=1, name="x")) == "LootEntry(threshold=1, name='x')"
+
+
+def test_records_survive_pickle_and_copy():
+    assert pickle.loads(pickle.dumps(QUEST)) == QUEST
+    assert copy.copy(QUEST) == copy.deepcopy(QUEST) == QUEST
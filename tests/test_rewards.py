@@ -0,0 +1,100 @@
+import bot
+
+
+def _stack_ids(uid):
+    return [(name, count) for name, _lvl, count, _last in bot.get_reward_stacks(uid)]
+
+
+def test_mark_reward_used_requires_owner(db):
+    bot.add_reward(1, "Кофе", 1)
+    bot.add_reward(1, "Кофе", 1)
+    rid = bot.get_reward_stacks(1)[0][3]
+
+    assert not bot.mark_reward_used(2, rid)
+    assert _stack_ids(1) == [("Кофе", 2)]
+
+    assert bot.mark_reward_used(1, rid)
+    assert not bot.mark_reward_used(1, rid)
+    assert _stack_ids(1) == [("Кофе", 1)]
+
+
+def _all_pages(uid, limit):
+    pages, before = [], None
+    while True:
+        rows = bot.get_reward_stacks(uid, before, limit)
+        if not rows:
+            return pages
+        pages.append(rows)
+        before = rows[-1][3]
+
+
+def _grouped(uid):
+    conn = bot.get_conn()
+    rows = conn.execute(
+        "SELECT name, box_level, COUNT(*), MAX(id) FROM rewards "
+        "WHERE user_id = ? AND used = 0 GROUP BY name, box_level",
+        (uid,),
+    ).fetchall()
+    conn.close()
+    return sorted(rows)
+
+
+def test_identical_rewards_are_grouped_into_stacks(db):
+    for name, lvl in [("Кофе", 1), ("Чай", 1), ("Кофе", 1), ("Кофе", 2), ("Кофе", 1)]:
+        bot.add_reward(1, name, lvl)
+    bot.add_reward(2, "Кофе", 1)
+
+    stacks = bot.get_reward_stacks(1)
+    assert [(name, lvl, count) for name, lvl, count, _ in stacks] == [
+        ("Кофе", 1, 3),
+        ("Кофе", 2, 1),
+        ("Чай", 1, 1),
+    ]
+    assert sorted(stacks) == _grouped(1)
+
+    # Использование снимает верхнюю награду стопки; пустая стопка исчезает.
+    coffee_id = stacks[0][3]
+    assert bot.mark_reward_used(1, coffee_id)
+    assert bot.mark_reward_used(1, bot.get_reward_stacks(1)[-1][3])
+    stacks = bot.get_reward_stacks(1)
+    assert [(name, lvl, count) for name, lvl, count, _ in stacks] == [("Кофе", 2, 1), ("Кофе", 1, 2)]
+    assert stacks[1][3] < coffee_id
+    assert sorted(stacks) == _grouped(1)
+
+
+def test_keyset_pages_do_not_skip_stacks_while_items_are_used(db):
+    names = [f"Награда {i}" for i in range(20)]
+    for round_ in range(3):
+        for name in names:
+            bot.add_reward(1, name, 1)
+
+    seen = {}
+    used = set()
+    before = None
+    while True:
+        rows = bot.get_reward_stacks(1, before, 3)
+        if not rows:
+            break
+        for name, _lvl, count, last_id in rows:
+            seen.setdefault(name, []).append(count)
+        # Пока игрок листает, он использует награду со своей страницы и со следующей.
+        assert bot.mark_reward_used(1, rows[0][3])
+        used.add(rows[0][0])
+        ahead = [row for row in bot.get_reward_stacks(1, rows[-1][3], 100) if row[0] not in used][:1]
+        if ahead:
+            assert bot.mark_reward_used(1, ahead[0][3])
+            used.add(ahead[0][0])
+        before = rows[-1][3]
+
+    assert set(seen) == set(names)
+    for name in set(names) - used:
+        assert seen[name] == [3]
+    # Каждая стопка показывается с количеством, которое было на момент чтения.
+    assert all(1 <= count <= 3 for counts in seen.values() for count in counts)
+    assert sorted(bot.get_reward_stacks(1, limit=100)) == _grouped(1)
+
+    # Без изменений страницы складываются ровно в полный список.
+    pages = _all_pages(1, 4)
+    flat = [row for page in pages for row in page]
+    assert flat == bot.get_reward_stacks(1, limit=100)
+    assert all(len(page) == 4 for page in pages[:-1])
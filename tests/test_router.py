@@ -0,0 +1,152 @@
+import asyncio
+
+import pytest
+from aiogram import Dispatcher
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.types import CallbackQuery, Update
+
+import bot
+
+
+def make_router():
+    router = bot.CallbackRouter()
+    calls = []
+
+    def handler(name):
+        async def handle(callback, **payload):
+            calls.append((name, payload))
+            return name
+
+        return handle
+
+    router.route("menu", ("section", str))(handler("menu"))
+    router.route("level", ("lvl", int), invalid="Уровень не найден")(handler("level"))
+    router.route("shop:price", ("value", str))(handler("price"))
+    router.route("shop:price:max", ("max_price", int))(handler("price_max"))
+    router.route("shop:list", ("page", int, 0))(handler("list"))
+    router.route("pick", ("token", str), ("opt", int))(handler("pick"))
+    router.route("filter", ("coin", str, "all"), ("page", int, 0))(handler("filter"))
+    router.route("reset:ask")(handler("reset"))
+    router.route("shop:buy", ("item", str), idempotent=3)(handler("buy"))
+    return router, calls
+
+
+def matched(router, data):
+    route, payload = router.match(data)
+    return (route.prefix if route else None), payload
+
+
+@pytest.mark.parametrize("data, expected", [
+    ("menu:shop", ("menu", {"section": "shop"})),
+    ("level:3", ("level", {"lvl": 3})),
+    ("shop:price:max:100", ("shop:price:max", {"max_price": 100})),
+    ("shop:price:all", ("shop:price", {"value": "all"})),
+    # Самый длинный префикс не подошёл — пробуется более короткий.
+    ("shop:price:max:дорого", ("shop:price", {"value": "max:дорого"})),
+    ("pick:ab12:2", ("pick", {"token": "ab12", "opt": 2})),
+    ("reset:ask", ("reset:ask", {})),
+])
+def test_longest_prefix_and_typed_payload(data, expected):
+    router, _ = make_router()
+    assert matched(router, data) == expected
+
+
+def test_last_field_takes_the_rest_of_the_string():
+    router, _ = make_router()
+    assert matched(router, "menu:a:b:c") == ("menu", {"section": "a:b:c"})
+
+
+@pytest.mark.parametrize("data, expected", [
+    ("shop:list", {"page": 0}),
+    ("shop:list:2", {"page": 2}),
+    ("shop:list:abc", {"page": 0}),
+    ("filter", {"coin": "all", "page": 0}),
+    ("filter:3", {"coin": "3", "page": 0}),
+    ("filter:3:x", {"coin": "3", "page": 0}),
+    ("filter:3:4", {"coin": "3", "page": 4}),
+])
+def test_missing_or_broken_fields_fall_back_to_defaults(data, expected):
+    router, _ = make_router()
+    assert matched(router, data)[1] == expected
+
+
+@pytest.mark.parametrize("data, prefix", [
+    ("level:x", "level"),
+    ("level", "level"),
+    ("pick:ab12:x", "pick"),
+    ("reset:ask:now", "reset:ask"),
+])
+def test_broken_payload_keeps_the_route(data, prefix):
+    router, _ = make_router()
+    assert matched(router, data) == (prefix, None)
+
+
+@pytest.mark.parametrize("data", ["", "unknown", "unknown:1", "shop", "shop:nothing", "menux:shop"])
+def test_unknown_callback_data_is_not_matched(data):
+    router, _ = make_router()
+    assert matched(router, data) == (None, None)
+    assert router.filter(callback("1", data)) is False
+
+
+def test_duplicate_prefix_is_rejected():
+    router, _ = make_router()
+    with pytest.raises(ValueError):
+        router.route("level", ("lvl", int))(lambda callback, lvl: None)
+    assert len(router) == 9
+
+
+def callback(callback_id, data):
+    user = {"id": 1, "is_bot": False, "first_name": "u"}
+    return CallbackQuery.model_validate(
+        {
+            "id": callback_id,
+            "from": user,
+            "chat_instance": "test",
+            "data": data,
+            "message": {"message_id": 10, "date": 0, "chat": {"id": 1, "type": "private"}, "from": user, "text": "x"},
+        },
+        context={"bot": bot.bot},
+    )
+
+
+@pytest.fixture
+def answers(monkeypatch):
+    sent = []
+
+    async def answer(self, text=None, show_alert=None, **kwargs):
+        sent.append((self.data, text))
+
+    monkeypatch.setattr(CallbackQuery, "answer", answer)
+    return sent
+
+
+def test_dispatch_through_router_and_dedup_flag(answers):
+    router, calls = make_router()
+    middleware = bot.CallbackDedupMiddleware(bot.MemoryDedupCache(100))
+    dp = Dispatcher()
+    dp.callback_query.middleware(middleware)
+    dp.callback_query.register(bot.dispatch_callback, router.filter)
+
+    async def scenario():
+        results = []
+        for i, data in enumerate(["shop:buy:tea", "shop:buy:tea", "shop:list:1", "shop:list:1", "level:x", "nope"]):
+            update = Update(update_id=i, callback_query=callback(str(i), data))
+            results.append(await dp.feed_update(bot.bot, update))
+        return results
+
+    results = asyncio.run(scenario())
+    # Второе нажатие «купить» отброшено флагом idempotent маршрута, список — нет.
+    assert calls == [("buy", {"item": "tea"}), ("list", {"page": 1}), ("list", {"page": 1})]
+    assert middleware.skipped == 1
+    assert results[:4] == ["buy", None, "list", "list"]
+    assert answers == [("shop:buy:tea", "Уже учтено ✓"), ("level:x", "Уровень не найден")]
+    assert results[5] is UNHANDLED
+
+
+def test_bot_routes_are_registered_with_their_flags():
+    route, payload = bot.CALLBACK_ROUTER.match("use:17")
+    assert (route.handler, payload) == (bot.cb_use, {"rid": 17})
+    assert route.flags == {"idempotent": bot.CALLBACK_DEDUP_TTL}
+    route, payload = bot.CALLBACK_ROUTER.match("shop:price:max:50")
+    assert (route.handler, payload) == (bot.cb_shop_set_price, {"max_price": 50})
+    assert bot.CALLBACK_ROUTER.match("shop:list")[0].flags == {}
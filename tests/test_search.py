@@ -0,0 +1,94 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import bot
+
+SHOP = ["Кофе латте", "Кофейник большой", "Кофе", "Ёлочная игрушка"]
+DAILIES = ["Выпить кофе утром", "Елка во дворе", "Полить цветы"]
+
+
+def make_catalog(shop_names, daily_titles=()):
+    shop = [bot.ShopItem(id=f"s{i}", name=name, price=10) for i, name in enumerate(shop_names)]
+    dailies = {f"d{i}": bot.DailyTask(code=f"d{i}", title=title) for i, title in enumerate(daily_titles)}
+    return bot.Catalog("search", "v1", [], dailies, shop, {})
+
+
+def titles(query, catalog=None):
+    index = (catalog or make_catalog(SHOP, DAILIES)).search_index()
+    return [index.entries[i][2] for i in index.search(query)]
+
+
+def test_exact_word_beats_prefix_then_shorter_titles_first():
+    assert titles("кофе") == ["Кофе", "Кофе латте", "Выпить кофе утром", "Кофейник большой"]
+    assert titles("КОФ") == ["Кофе", "Кофе латте", "Кофейник большой", "Выпить кофе утром"]
+
+
+def test_every_query_word_must_match():
+    assert titles("кофе утр") == ["Выпить кофе утром"]
+    assert titles("кофе чай") == []
+    assert titles("  ") == SHOP + DAILIES
+
+
+def test_yo_and_ye_are_the_same_letter():
+    assert titles("елочная") == titles("ёлочная") == ["Ёлочная игрушка"]
+    assert titles("ёлка") == ["Елка во дворе"]
+
+
+def test_typos_match_only_above_cutoff_and_on_the_same_letter(monkeypatch):
+    assert titles("игрушко") == ["Ёлочная игрушка"]
+    assert titles("угрушка") == []  # первая буква не совпадает — кандидатов нет
+    monkeypatch.setattr(bot, "SEARCH_FUZZY_CUTOFF", 0.9)
+    assert titles("игрушко") == []
+
+
+def test_typo_in_one_word_keeps_ranking_by_the_others():
+    catalog = make_catalog(["Чайник малиновый", "Чай малиновый", "Кофе малиновый", "Чай мятный"])
+    # «малинвый» найдётся только как похожее слово; точное «чай» выше префикса «чайник».
+    assert titles("чай малинвый", catalog) == ["Чай малиновый", "Чайник малиновый"]
+    assert titles("чай", catalog) == ["Чай мятный", "Чай малиновый", "Чайник малиновый"]
+
+
+@pytest.fixture
+def big_catalog():
+    catalog = make_catalog([f"Награда {i}" for i in range(120)], ["Награда-дейлик"])
+    token = bot.CURRENT_CATALOG.set(catalog)
+    yield catalog
+    bot.CURRENT_CATALOG.reset(token)
+
+
+def inline(text, offset=""):
+    answers = []
+
+    async def answer(results, **kwargs):
+        answers.append((results, kwargs))
+
+    query = SimpleNamespace(query=text, offset=offset, from_user=SimpleNamespace(id=1), answer=answer)
+    asyncio.run(bot.on_inline_query(query))
+    (results, kwargs), = answers
+    return results, kwargs["next_offset"]
+
+
+def test_inline_results_are_paged_by_telegram_limit(big_catalog):
+    pages, offset = [], ""
+    while True:
+        results, offset = inline("награда", offset)
+        assert len(results) <= bot.INLINE_RESULTS_LIMIT
+        pages.append(results)
+        if not offset:
+            break
+    assert [len(page) for page in pages] == [50, 50, 21]
+    ids = [result.id for page in pages for result in page]
+    assert len(set(ids)) == 121
+    # Названия короче — выше: «Награда 0» … «Награда 9» открывают первую страницу.
+    assert [result.title.split()[-1] for result in pages[0][:10]] == [str(i) for i in range(10)]
+
+
+@pytest.mark.parametrize("offset", ["мусор", "-5"])
+def test_broken_inline_offset_starts_from_the_top(big_catalog, offset):
+    assert [r.id for r in inline("награда", offset)[0]] == [r.id for r in inline("награда")[0]]
+
+
+def test_inline_offset_past_the_end_returns_nothing(big_catalog):
+    assert inline("награда", "500") == ([], "")
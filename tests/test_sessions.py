@@ -0,0 +1,78 @@
+import tracemalloc
+from types import SimpleNamespace
+
+import bot
+
+MILLION = 1_000_000
+
+
+def test_memory_store_million_users_footprint():
+    tracemalloc.start()
+    try:
+        store = bot.MemorySessionStore(MILLION, 3600)
+        for uid in range(MILLION):
+            store.set(uid, "daily_search", True)
+        used, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert len(store) == MILLION
+    # ~220 байт на игрока: __slots__-сессия + узел OrderedDict.
+    assert used / MILLION < 300
+
+
+def test_memory_store_is_bounded_by_max_users():
+    tracemalloc.start()
+    try:
+        store = bot.MemorySessionStore(10_000, 3600)
+        for uid in range(MILLION):
+            store.set(uid, "daily_filter", {"filter_coin": "all", "category": "all"})
+        used, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert len(store) == 10_000
+    assert store.get(0, "daily_filter") is None
+    assert store.get(MILLION - 1, "daily_filter") is not None
+    assert used < 10 * 1024 * 1024
+
+
+def test_search_filter_skips_store_for_idle_users(db, monkeypatch):
+    store = bot.SqliteSessionStore(3600)
+    reads = []
+    real_get = store.get
+    store.get = lambda *args, **kwargs: reads.append(args) or real_get(*args, **kwargs)
+    monkeypatch.setattr(bot, "SESSIONS", store)
+    monkeypatch.setattr(bot, "_SEARCH_PENDING", type(bot._SEARCH_PENDING)())
+
+    def msg(uid):
+        return SimpleNamespace(from_user=SimpleNamespace(id=uid))
+
+    for _ in range(100):
+        assert not bot.search_pending(msg(1))
+    assert reads == []
+
+    bot.mark_search_pending(2)
+    assert bot.search_pending(msg(2))
+    store.pop(2, "daily_search")
+    assert not bot.search_pending(msg(2))
+    assert 2 not in bot._SEARCH_PENDING
+
+
+def test_dailies_view_writes_state_only_on_change(db, monkeypatch):
+    store = bot.SqliteSessionStore(3600)
+    writes = []
+    real_set = store.set
+    store.set = lambda *args: writes.append(args) or real_set(*args)
+    monkeypatch.setattr(bot, "SESSIONS", store)
+
+    bot.build_dailies_view(1)
+    bot.build_dailies_view(1)
+    bot.build_dailies_view(1, page=10_000)  # за пределами списка — та же последняя страница
+    assert len(writes) <= 2
+    writes.clear()
+    for _ in range(3):
+        bot.build_dailies_view(1)
+    assert writes == []
+
+    bot.build_dailies_view(1, search_term="чай")
+    assert [args[2]["search"] for args in writes] == ["чай"]
+    assert store.get(1, "daily_filter")["search"] == "чай"
@@ -0,0 +1,49 @@
+import pytest
+
+import bot
+
+
+@pytest.fixture
+def shop(monkeypatch):
+    """Фильтры и баланс игрока подменяются; кэш страниц пуст в начале и в конце теста."""
+    state = {"coins": 0, "filters": {"category": "all", "price": "balance"}}
+    monkeypatch.setattr(bot, "get_coins", lambda uid: state["coins"])
+    monkeypatch.setattr(bot, "get_shop_filters", lambda uid: dict(state["filters"]))
+    monkeypatch.setattr(bot, "SHOP_PAGE_CACHE", bot.RenderCache(10_000))
+    yield state
+
+
+def _item_rows(markup):
+    return [row[0].text for row in markup.inline_keyboard if row[0].callback_data.startswith("shop:item:")]
+
+
+def test_balance_filter_shares_entries_between_balances(shop):
+    prices = bot.active_catalog().shop_prices("all")
+    for coins in range(300):
+        shop["coins"] = coins
+        _text, markup = bot.build_shop_view(1)
+        assert len(_item_rows(markup)) == min(bot.SHOP_PAGE_SIZE, sum(p <= coins for p in prices))
+
+    distinct = {sum(p <= coins for p in prices) for coins in range(300)}
+    stats = bot.SHOP_PAGE_CACHE.stats()
+    assert stats["size"] == len(distinct)
+    assert stats["hits"] == 300 - len(distinct)
+
+
+def test_out_of_range_pages_share_last_page(shop):
+    shop["filters"] = {"category": "all", "price": "all"}
+    count = len(bot.active_catalog().shop_prices("all"))
+    last = (count - 1) // bot.SHOP_PAGE_SIZE
+    views = [bot.build_shop_view(1, page) for page in (last, 5 + last, 99, 1000)]
+
+    assert all(view == views[0] for view in views)
+    assert bot.SHOP_PAGE_CACHE.stats()["size"] == 1
+
+
+def test_cutoff_matches_unfiltered_render(shop):
+    shop["filters"] = {"category": "all", "price": "balance"}
+    shop["coins"] = 10**9
+    affordable = bot.build_shop_view(1)
+    shop["filters"] = {"category": "all", "price": "all"}
+    assert _item_rows(bot.build_shop_view(1)[1]) == _item_rows(affordable[1])
+    assert bot.SHOP_PAGE_CACHE.stats()["size"] == 1
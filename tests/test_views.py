@@ -0,0 +1,90 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import EditMessageText
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+import bot
+
+
+class FakeMessage:
+    """Сообщение с записью вызовов; error — исключение для следующего edit_text."""
+
+    def __init__(self, chat_id: int = 1, message_id: int = 10):
+        self.chat = SimpleNamespace(id=chat_id)
+        self.message_id = message_id
+        self.calls = []
+        self.error = None
+
+    async def edit_text(self, text, reply_markup=None):
+        self.calls.append(("text", text, reply_markup))
+        if self.error:
+            error, self.error = self.error, None
+            raise error
+
+    async def edit_reply_markup(self, reply_markup=None):
+        self.calls.append(("markup", reply_markup))
+
+
+def markup(label: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text=label, callback_data="x")]])
+
+
+def bad_request(text: str) -> TelegramBadRequest:
+    return TelegramBadRequest(EditMessageText(text="t"), text)
+
+
+@pytest.fixture(autouse=True)
+def clean_views():
+    bot.RENDERED_VIEWS.clear()
+    yield
+    bot.RENDERED_VIEWS.clear()
+
+
+def edit(message, text, reply_markup=None):
+    return asyncio.run(bot.edit_view(message, text, reply_markup))
+
+
+def test_identical_render_is_skipped():
+    message = FakeMessage()
+    assert edit(message, "экран", markup("a"))
+    assert not edit(message, "экран", markup("a"))
+    assert message.calls == [("text", "экран", markup("a"))]
+
+
+def test_markup_only_change_edits_markup():
+    message = FakeMessage()
+    edit(message, "экран", markup("a"))
+    assert edit(message, "экран", markup("b"))
+    assert message.calls[-1] == ("markup", markup("b"))
+
+    # Сменился текст — правится всё сообщение.
+    assert edit(message, "другой экран", markup("b"))
+    assert message.calls[-1] == ("text", "другой экран", markup("b"))
+    assert len(message.calls) == 3
+
+
+def test_not_modified_error_is_swallowed_and_remembered():
+    message = FakeMessage()
+    message.error = bad_request("Bad Request: message is not modified")
+    assert edit(message, "экран", markup("a"))
+    assert not edit(message, "экран", markup("a"))
+    assert len(message.calls) == 1
+
+
+def test_other_errors_propagate_and_forget_view():
+    message = FakeMessage()
+    edit(message, "экран", markup("a"))
+    message.error = bad_request("Bad Request: message to edit not found")
+    with pytest.raises(TelegramBadRequest):
+        edit(message, "новый экран", markup("a"))
+    assert (message.chat.id, message.message_id) not in bot.RENDERED_VIEWS
+
+
+def test_views_are_evicted_beyond_cache_size(monkeypatch):
+    monkeypatch.setattr(bot, "RENDERED_VIEW_CACHE_SIZE", 2)
+    for message_id in range(3):
+        edit(FakeMessage(message_id=message_id), "экран")
+    assert list(bot.RENDERED_VIEWS) == [(1, 1), (1, 2)]
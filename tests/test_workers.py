@@ -0,0 +1,104 @@
+import json
+import multiprocessing
+import time
+from collections import Counter
+
+import bot
+from test_dispatch import message_update
+
+USERS = 100_000
+
+
+def test_hash_ring_is_stable_and_even():
+    ring = bot.HashRing([str(i) for i in range(4)])
+    again = bot.HashRing([str(i) for i in range(4)])
+    owners = [ring.node_for(uid) for uid in range(USERS)]
+    assert owners == [again.node_for(uid) for uid in range(USERS)]
+
+    counts = Counter(owners)
+    assert set(counts) == {"0", "1", "2", "3"}
+    assert all(abs(n - USERS / 4) < USERS / 4 * 0.25 for n in counts.values())
+
+    # Новый воркер забирает примерно свою долю, остальные пользователи остаются на местах.
+    grown = bot.HashRing([str(i) for i in range(5)])
+    moved = [uid for uid in range(USERS) if grown.node_for(uid) != owners[uid]]
+    assert len(moved) < USERS * 0.3
+    assert all(grown.node_for(uid) == "4" for uid in moved)
+
+
+def _drain(worker_queue):
+    items = []
+    while True:
+        try:
+            items.append(worker_queue.get(timeout=0.2))
+        except Exception:
+            return items
+
+
+def test_pool_routes_every_update_of_a_user_to_one_worker():
+    pool = bot.WorkerPool(3, ctx=multiprocessing.get_context("fork"))
+    updates = [message_update(seq * 30 + uid, uid, str(seq)) for seq in range(5) for uid in range(1, 31)]
+    assert all(pool.put(update) for update in updates)
+
+    seen = {}
+    for worker_id, worker_queue in enumerate(pool.queues):
+        for payload in _drain(worker_queue):
+            message = json.loads(payload)["message"]
+            seen.setdefault(message["from_user"]["id"], []).append((worker_id, message["text"]))
+    for uid in range(1, 31):
+        assert {worker_id for worker_id, _ in seen[uid]} == {pool.worker_for(uid)}
+        assert [text for _, text in seen[uid]] == [str(seq) for seq in range(5)]
+
+
+def test_full_queue_drops_instead_of_blocking(monkeypatch):
+    monkeypatch.setattr(bot, "WORKER_QUEUE_SIZE", 1)
+    pool = bot.WorkerPool(2, ctx=multiprocessing.get_context("fork"), put_timeout=0.05)
+    assert pool.put(message_update(1, 7, "a"))
+    started = time.perf_counter()
+    assert not pool.put(message_update(2, 7, "b"))
+    assert time.perf_counter() - started < 1
+    assert pool.dropped == 1
+
+    # Другой воркер продолжает получать апдейты своих пользователей.
+    other = next(uid for uid in range(100) if pool.worker_for(uid) != pool.worker_for(7))
+    assert pool.put(message_update(3, other, "c"))
+
+
+def _exit_at_once(worker_id, worker_queue):
+    pass
+
+
+def _serve_until_stop(worker_id, worker_queue):
+    while worker_queue.get() is not None:
+        pass
+
+
+def test_dead_worker_is_restarted():
+    pool = bot.WorkerPool(2, ctx=multiprocessing.get_context("fork"), target=_exit_at_once)
+    pool.start_all()
+    for proc in pool.procs:
+        proc.join(timeout=5)
+    pool.target = _serve_until_stop
+    assert pool.ensure_alive() == 2
+    assert all(proc.is_alive() for proc in pool.procs)
+    assert pool.ensure_alive() == 0
+    pool.stop()
+    assert not any(proc.is_alive() for proc in pool.procs)
+
+
+def test_run_workers_switches_shared_state_to_sqlite(monkeypatch):
+    started = []
+    monkeypatch.setattr(bot, "init_db", lambda: None)
+    monkeypatch.setattr(bot.WorkerPool, "start_all", lambda self: started.append(len(self)))
+    monkeypatch.setattr(bot.WorkerPool, "stop", lambda self: None)
+
+    def route(pool):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(bot, "_route_updates", route)
+    monkeypatch.delenv("CALLBACK_DEDUP_BACKEND", raising=False)
+    monkeypatch.delenv("SESSION_BACKEND", raising=False)
+    bot.run_workers(2)
+    assert started == [2]
+    assert bot.os.environ["CALLBACK_DEDUP_BACKEND"] == "sqlite"
+    assert bot.os.environ["SESSION_BACKEND"] == "sqlite"